@@ -9,11 +9,16 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 load_dotenv()
 
+import click
 from flask import Flask
 from werkzeug.middleware.proxy_fix import ProxyFix
 from backend.config import Config
 from backend.extensions import db, cors
+from backend.base_datos import configurar_base_datos
+from backend.json_rapido import configurar_json
+from backend.migraciones import actualizar_esquema, version_esquema
 from backend.models import User, ConstantesFASAR
+from backend.services.importacion_service import ErrorImportacion, importar_catalogo
 
 # Import blueprints
 from backend.routes import auth, catalogos, conceptos, proyectos, ia, admin
@@ -46,6 +51,10 @@ def create_app(config_class=Config):
     app.register_blueprint(ia.bp)
     app.register_blueprint(admin.bp)
 
+    # PRAGMAs de SQLite por conexión y reintentos de escritura ante "database is locked"
+    configurar_base_datos(app)
+    configurar_json(app)
+
     @app.route("/", methods=["GET"])
     def index():
         return """
@@ -65,13 +74,40 @@ def create_app(config_class=Config):
     def health_check():
         return {"status": "ok", "db": "connected"}, 200
 
-    # Ensure DB is created and migrated
-    with app.app_context():
-        import backend.models  # Import all models to ensure they are registered
-        db.create_all()
-        _migrate_database() # Auto-fix for existing databases
+    # El esquema se crea y migra una sola vez por despliegue con `flask db-upgrade`;
+    # los workers arrancan sin tocar la base.
+    @app.cli.command("db-upgrade")
+    def db_upgrade():
+        """Crea las tablas que falten, aplica las migraciones pendientes y el admin por defecto."""
+        aplicados = actualizar_esquema()
+        if aplicados:
+            print(f"✅ Migraciones aplicadas: {aplicados}")
+        print(f"Esquema en la versión {version_esquema()}.")
         _create_default_admin()
-        # FASAR configs are now created per-user on demand
+
+    @app.cli.command("importar-catalogo")
+    @click.argument("ruta", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--tipo", default="Material", show_default=True, help="Material, ManoObra, Equipo o Maquinaria")
+    @click.option("--usuario", default=None, help="Usuario dueño de los insumos; sin él se importa al catálogo global")
+    def importar_catalogo_cli(ruta, tipo, usuario):
+        """Importa una lista de precios CSV o XLSX (ver POST /api/catalogos/importar)."""
+        user_id = None
+        if usuario:
+            user = User.query.filter_by(username=usuario).first()
+            if user is None:
+                raise click.ClickException(f"No existe el usuario '{usuario}'")
+            user_id = user.id
+        with open(ruta, "rb") as archivo:
+            try:
+                reporte = importar_catalogo(archivo, ruta, tipo, user_id)
+            except ErrorImportacion as e:
+                raise click.ClickException(str(e))
+        print(f"{reporte['filas']} filas: {reporte['insertados']} nuevas, {reporte['actualizados']} actualizadas, "
+              f"{reporte['sin_cambios']} sin cambios, {reporte['con_error']} con error ({reporte['duracion_ms']} ms)")
+        for error in reporte["errores"]:
+            print(f"  fila {error['fila']}: {error['error']}")
+        if reporte["error"]:
+            raise click.ClickException(f"Importación interrumpida: {reporte['error']}")
 
     return app
 
@@ -98,62 +134,12 @@ def _create_default_admin():
     except Exception as e:
         print(f"Error creando admin: {e}")
 
-def _migrate_database():
-    """Ejecuta migraciones manuales para SQLite para añadir columnas faltantes."""
-    import sqlite3
-    # Extraer la ruta del archivo desde la URI de SQLAlchemy
-    db_uri = Config.SQLALCHEMY_DATABASE_URI
-    if not db_uri.startswith("sqlite:///"):
-        return
-    
-    db_path = db_uri.replace("sqlite:///", "")
-    
-    if not os.path.exists(db_path):
-        return
-
-    try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Columnas a verificar/añadir
-        migrations = [
-            ("ALTER TABLE users ADD COLUMN is_premium BOOLEAN DEFAULT 0", "users.is_premium"),
-            ("ALTER TABLE users ADD COLUMN trial_ends_at DATETIME", "users.trial_ends_at"),
-            
-            # Columnas para ConstantesFASAR
-            ("ALTER TABLE constantes_fasar ADD COLUMN user_id INTEGER REFERENCES users(id)", "constantes_fasar.user_id"),
-            ("ALTER TABLE constantes_fasar ADD COLUMN valor_uma NUMERIC(10, 2) DEFAULT 108.57", "constantes_fasar.valor_uma"),
-            ("ALTER TABLE constantes_fasar ADD COLUMN salario_minimo_general NUMERIC(10, 2) DEFAULT 248.93", "constantes_fasar.salario_minimo_general"),
-            ("ALTER TABLE constantes_fasar ADD COLUMN dias_festivos_costumbre NUMERIC(6, 2) DEFAULT 3.0", "constantes_fasar.dias_festivos_costumbre"),
-            ("ALTER TABLE constantes_fasar ADD COLUMN dias_mal_tiempo NUMERIC(6, 2) DEFAULT 2.0", "constantes_fasar.dias_mal_tiempo"),
-            ("ALTER TABLE constantes_fasar ADD COLUMN dias_permisos_sindicales NUMERIC(6, 2) DEFAULT 2.0", "constantes_fasar.dias_permisos_sindicales"),
-            ("ALTER TABLE constantes_fasar ADD COLUMN prima_riesgo_trabajo_patronal NUMERIC(10, 6) DEFAULT 7.58875", "constantes_fasar.prima_riesgo_trabajo_patronal"),
-            ("ALTER TABLE constantes_fasar ADD COLUMN impuesto_sobre_nomina NUMERIC(6, 4) DEFAULT 0.03", "constantes_fasar.impuesto_sobre_nomina"),
-
-            # Aislamiento por usuario
-            ("ALTER TABLE materiales ADD COLUMN user_id INTEGER REFERENCES users(id)", "materiales.user_id"),
-            ("ALTER TABLE mano_obra ADD COLUMN user_id INTEGER REFERENCES users(id)", "mano_obra.user_id"),
-            ("ALTER TABLE equipos ADD COLUMN user_id INTEGER REFERENCES users(id)", "equipos.user_id"),
-            ("ALTER TABLE maquinaria ADD COLUMN user_id INTEGER REFERENCES users(id)", "maquinaria.user_id"),
-            ("ALTER TABLE conceptos ADD COLUMN user_id INTEGER REFERENCES users(id)", "conceptos.user_id"),
-            ("ALTER TABLE proyectos ADD COLUMN user_id INTEGER REFERENCES users(id)", "proyectos.user_id"),
-        ]
-        
-        for sql, col_name in migrations:
-            try:
-                cursor.execute(sql)
-                print(f"✅ Migración: Columna '{col_name}' añadida.")
-            except sqlite3.OperationalError:
-                # Si falla es porque probablemente ya existe
-                pass
-        
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        print(f"Error en auto-migración: {e}")
-
 # Create app instance for Gunicorn
 app = create_app()
 
 if __name__ == "__main__":
+    # Servidor de desarrollo: un solo proceso, así que puede migrar al arrancar.
+    with app.app_context():
+        actualizar_esquema()
+        _create_default_admin()
     app.run(host="0.0.0.0", port=8000)
@@ -0,0 +1,100 @@
+"""Perfil de conexión SQLite y reintentos de escritura.
+
+Con varios workers de gunicorn sobre el mismo archivo, el modo de journal por defecto
+bloquea a los lectores mientras alguien escribe. El perfil se aplica en cada conexión
+nueva: WAL (lectores y un escritor en paralelo), busy_timeout (esperar el candado en
+lugar de fallar), synchronous=NORMAL (seguro con WAL), cache y mmap, y foreign_keys.
+
+Aun con busy_timeout, SQLite devuelve "database is locked" sin esperar cuando una
+transacción de lectura intenta volverse de escritura mientras otra ya escribe; ahí lo
+único correcto es deshacer y repetir la transacción completa. reintentar_si_bloqueada
+hace eso con las vistas marcadas con @reintentable: solo las que escriben en una sola
+transacción y no llaman servicios externos. Una vista que hace commit por lotes (la
+importación) o que consulta a Gemini no se puede repetir sin efectos dobles.
+"""
+import random
+import time
+from functools import wraps
+from typing import Callable, Dict
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from backend.extensions import db
+
+_MENSAJES_BLOQUEO = ("database is locked", "database table is locked", "database is busy")
+
+
+def perfil_sqlite(config) -> Dict[str, object]:
+    """PRAGMAs a aplicar en cada conexión, en orden, según la configuración de la app."""
+    if not config["SQLITE_APLICAR_PERFIL"]:
+        return {}
+    return {
+        "journal_mode": config["SQLITE_JOURNAL_MODE"],
+        "busy_timeout": config["SQLITE_BUSY_TIMEOUT_MS"],
+        "synchronous": config["SQLITE_SYNCHRONOUS"],
+        "cache_size": config["SQLITE_CACHE_SIZE"],
+        "mmap_size": config["SQLITE_MMAP_SIZE"],
+        "foreign_keys": "ON" if config["SQLITE_FOREIGN_KEYS"] else "OFF",
+    }
+
+
+def aplicar_perfil_sqlite(engine: Engine, pragmas: Dict[str, object]) -> None:
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _al_conectar(conexion_dbapi, _registro):
+        cursor = conexion_dbapi.cursor()
+        try:
+            for nombre, valor in pragmas.items():
+                cursor.execute(f"PRAGMA {nombre}={valor}")
+        finally:
+            cursor.close()
+
+
+def es_bloqueo(error: Exception) -> bool:
+    if not isinstance(error, OperationalError):
+        return False
+    mensaje = str(error.orig).lower()
+    return any(texto in mensaje for texto in _MENSAJES_BLOQUEO)
+
+
+def reintentar_si_bloqueada(funcion: Callable, intentos: int = 5, espera_ms: float = 50) -> Callable:
+    """Repite la función si la base está bloqueada, deshaciendo la sesión antes de cada intento.
+
+    La espera crece al doble por intento, con variación aleatoria para que los workers
+    que chocaron no vuelvan a chocar. Otros errores se propagan sin reintentar.
+    """
+    @wraps(funcion)
+    def envoltura(*args, **kwargs):
+        for intento in range(intentos):
+            try:
+                return funcion(*args, **kwargs)
+            except OperationalError as error:
+                if not es_bloqueo(error) or intento == intentos - 1:
+                    raise
+                db.session.rollback()
+                time.sleep(espera_ms / 1000 * (2 ** intento) * (0.5 + random.random()))
+
+    return envoltura
+
+
+def reintentable(vista: Callable) -> Callable:
+    """Marca una vista de escritura de una sola transacción para repetirla si la base está bloqueada."""
+    vista.reintentable = True
+    return vista
+
+
+def configurar_base_datos(app) -> None:
+    """Aplica el perfil SQLite al engine de la app y los reintentos a las vistas @reintentable."""
+    with app.app_context():
+        aplicar_perfil_sqlite(db.engine, perfil_sqlite(app.config))
+
+    intentos = app.config["SQLITE_REINTENTOS"]
+    if intentos <= 1:
+        return
+    for endpoint, vista in app.view_functions.items():
+        if getattr(vista, "reintentable", False):
+            app.view_functions[endpoint] = reintentar_si_bloqueada(
+                vista, intentos, app.config["SQLITE_REINTENTO_ESPERA_MS"]
+            )
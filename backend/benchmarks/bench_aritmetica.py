@@ -0,0 +1,88 @@
+"""Compara el camino Decimal contra el de punto fijo en matrices grandes.
+
+Mide también el costo de compilar el plan (renglones sin compilar) contra costear un
+plan ya compilado, que es lo que hacen los cálculos con conceptos guardados.
+
+Uso: python -m backend.benchmarks.bench_aritmetica [renglones] [repeticiones]
+
+Los insumos se crean como objetos en memoria y se pasan en caches ya llenos, así que
+solo se mide el cálculo, sin consultas a la base.
+"""
+import random
+import sys
+import time
+from decimal import Decimal
+from backend.models import Material, ManoObra, Equipo, Maquinaria
+from backend.services.calculation_service import compilar_plan, _sumar_registros, _sumar_plan, _aplicar_factores
+from backend.services.punto_fijo import sumar_plan_entero, aplicar_factores_entero
+
+FACTORES = {
+    "mano_obra": {"activo": True, "porcentaje": Decimal("0.05")},
+    "indirectos": {"activo": True, "porcentaje": Decimal("0.12")},
+    "utilidad": {"activo": True, "porcentaje": Decimal("0.10")},
+    "iva": {"activo": True, "porcentaje": Decimal("0.16")},
+}
+
+
+def _caches(rng: random.Random, por_tipo: int = 200):
+    materiales, manos, equipos, maquinas = {}, {}, {}, {}
+    for i in range(1, por_tipo + 1):
+        materiales[i] = Material(id=i, precio_unitario=Decimal(str(round(rng.uniform(1, 900), 2))),
+                                 porcentaje_merma=Decimal("0.03"), precio_flete_unitario=Decimal("1.5"))
+        manos[i] = ManoObra(id=i, salario_base=Decimal(str(round(rng.uniform(300, 900), 2))),
+                            fasar=Decimal("1.65"), rendimiento_jornada=Decimal("8"))
+        equipos[i] = Equipo(id=i, costo_hora_maq=Decimal(str(round(rng.uniform(20, 400), 2))))
+        maquinas[i] = Maquinaria(id=i, costo_posesion_hora=Decimal(str(round(rng.uniform(100, 2000), 4))),
+                                 rendimiento_horario=Decimal("2.5"))
+    return materiales, manos, equipos, maquinas
+
+
+def _registros(rng: random.Random, renglones: int, por_tipo: int = 200):
+    tipos = ("Material", "ManoObra", "Equipo", "Maquinaria")
+    registros = []
+    for _ in range(renglones):
+        registro = {"tipo_insumo": rng.choice(tipos), "id_insumo": rng.randint(1, por_tipo),
+                    "cantidad": round(rng.uniform(0, 20), 4)}
+        if rng.random() < 0.1:
+            registro["precio_custom"] = round(rng.uniform(1, 500), 2)
+        registros.append(registro)
+    return registros
+
+
+def _medir(funcion, repeticiones: int) -> float:
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def main(renglones: int = 200_000, repeticiones: int = 3) -> None:
+    rng = random.Random(1)
+    caches = _caches(rng)
+    registros = _registros(rng, renglones)
+
+    plan = compilar_plan(registros)
+
+    def sin_plan():
+        return _aplicar_factores(*_sumar_registros(registros, *caches), FACTORES)
+
+    def decimal():
+        return _aplicar_factores(*_sumar_plan(plan, *caches), FACTORES)
+
+    def entera():
+        return aplicar_factores_entero(*sumar_plan_entero(plan, *caches), FACTORES)
+
+    t_sin_plan = _medir(sin_plan, repeticiones)
+    t_decimal = _medir(decimal, repeticiones)
+    t_entera = _medir(entera, repeticiones)
+    a, b = decimal(), entera()
+    print(f"renglones: {renglones}")
+    print(f"decimal sin plan: {t_sin_plan * 1000:.1f} ms")
+    print(f"decimal con plan: {t_decimal * 1000:.1f} ms  pu={a['precio_unitario']:.6f}")
+    print(f"entera con plan:  {t_entera * 1000:.1f} ms  pu={b['precio_unitario']:.6f}")
+    print(f"aceleración entera: {t_decimal / t_entera:.2f}x  diferencia: {abs(a['precio_unitario'] - b['precio_unitario']):.6f}")
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:3]))
@@ -0,0 +1,61 @@
+"""Latencia de /buscar con un catálogo grande: con el corte de MAX_CANDIDATOS y ordenando todo.
+
+Llena un catálogo de materiales con nombres de palabras comunes y mide la mediana de
+buscar() para consultas con pocas y con muchas coincidencias, con el corte por defecto
+y con max_candidatos=None (lo que usan sugerir_precio_mercado y el emparejamiento de la IA).
+
+Uso: python -m backend.benchmarks.bench_busqueda [filas] [repeticiones]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from sqlalchemy import insert
+from backend.app import create_app
+from backend.config import Config
+from backend.extensions import db
+from backend.models import Material
+from backend.services.busqueda_service import MAX_CANDIDATOS, buscar, buscar_con_tiempo
+
+PALABRAS = (
+    "cemento", "tubo", "pvc", "cobre", "varilla", "arena", "grava", "block", "pintura", "cable",
+    "thw", "calibre", "codo", "tee", "valvula", "gris", "blanco", "rojo", "1/2", "3/4",
+)
+CONSULTAS = ("cable calibre", "tubo pvc", "cemento", "c")
+
+
+def _medir(consulta: str, repeticiones: int, max_candidatos) -> float:
+    buscar(consulta, None, max_candidatos=max_candidatos)  # calienta caches de SQLite
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        buscar(consulta, None, max_candidatos=max_candidatos)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def main(filas: int = 50000, repeticiones: int = 15) -> None:
+    ruta = os.path.join(tempfile.mkdtemp(), "bench_busqueda.sqlite3")
+    app = create_app(type("ConfigBench", (Config,), {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{ruta}"}))
+    aleatorio = random.Random(1)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(Material), [
+            {"nombre": " ".join(aleatorio.sample(PALABRAS, 4)) + f" {i}", "unidad": "pza", "precio_unitario": 1}
+            for i in range(filas)
+        ])
+        db.session.commit()
+
+        print(f"{filas} filas, mediana de {repeticiones} repeticiones")
+        for consulta in CONSULTAS:
+            recortados = buscar_con_tiempo(consulta, None, None, 20)["candidatos_recortados"]
+            con_corte = _medir(consulta, repeticiones, MAX_CANDIDATOS)
+            sin_corte = _medir(consulta, repeticiones, None)
+            print(f"{consulta!r:16s} corte {MAX_CANDIDATOS}: {con_corte:7.2f} ms "
+                  f"({'recortada' if recortados else 'completa'}) | todas: {sin_corte:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main(*(int(valor) for valor in sys.argv[1:3]))
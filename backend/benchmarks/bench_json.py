@@ -0,0 +1,99 @@
+"""Latencia y memoria de las respuestas de lista grandes: catálogo y detalles de presupuesto.
+
+Compara el camino anterior (objetos ORM + to_dict() + proveedor JSON de Flask) contra
+el actual (consulta de columnas + serializador precalculado + orjson), dentro de una
+petición de prueba para contar también la construcción de la respuesta.
+
+Uso: python -m backend.benchmarks.bench_json [filas] [repeticiones]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from decimal import Decimal
+from flask import jsonify
+from sqlalchemy import insert
+from backend.app import create_app
+from backend.config import Config
+from backend.extensions import db
+from backend.models import Material, Concepto, Proyecto, Partida, DetallePresupuesto
+from backend.services.listado_service import consulta_filas, listar_catalogo, serializar_filas
+
+
+def _config(ruta: str, json_rapido: bool):
+    return type("ConfigBench", (Config,), {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{ruta}", "JSON_RAPIDO": json_rapido})
+
+
+def _preparar(ruta: str, filas: int) -> int:
+    app = create_app(_config(ruta, True))
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(Material), [
+            {"nombre": f"Material {i:06d}", "unidad": "pza", "precio_unitario": Decimal(i % 900 + 1) / 7,
+             "disciplina": "Obra civil", "calidad": "Estándar"}
+            for i in range(filas)
+        ])
+        concepto = Concepto(clave="C-1", descripcion="Muro", unidad_concepto="m2")
+        proyecto = Proyecto(nombre_proyecto="Bench")
+        db.session.add_all([concepto, proyecto])
+        db.session.flush()
+        partida = Partida(proyecto_id=proyecto.id, nombre_partida="Obra negra")
+        db.session.add(partida)
+        db.session.flush()
+        db.session.execute(insert(DetallePresupuesto), [
+            {"partida_id": partida.id, "concepto_id": concepto.id, "cantidad_obra": Decimal(i % 50 + 1),
+             "precio_unitario_calculado": Decimal("123.4567"), "costo_directo": Decimal("98.7654")}
+            for i in range(filas)
+        ])
+        db.session.commit()
+        return partida.id
+
+
+def _medir(app, funcion, repeticiones: int):
+    tiempos = []
+    with app.test_request_context():
+        funcion()  # calienta caches de SQLAlchemy
+        for _ in range(repeticiones):
+            db.session.expunge_all()
+            inicio = time.perf_counter()
+            respuesta = funcion()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        db.session.expunge_all()
+        tracemalloc.start()
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return statistics.median(tiempos), pico / 1024 / 1024, len(respuesta.get_data())
+
+
+def main(filas: int = 10000, repeticiones: int = 5) -> None:
+    ruta = os.path.join(tempfile.mkdtemp(), "bench_json.sqlite3")
+    partida_id = _preparar(ruta, filas)
+    antes = create_app(_config(ruta, False))
+    ahora = create_app(_config(ruta, True))
+
+    casos = {
+        "catalogo": (
+            lambda: jsonify([m.to_dict() for m in Material.query.order_by(Material.nombre, Material.id)]),
+            lambda: jsonify(listar_catalogo(Material, None, {})),
+        ),
+        "presupuesto": (
+            lambda: jsonify([d.to_dict() for d in DetallePresupuesto.query.filter_by(partida_id=partida_id)]),
+            lambda: jsonify(serializar_filas(DetallePresupuesto, consulta_filas(DetallePresupuesto).filter(
+                DetallePresupuesto.partida_id == partida_id).order_by(DetallePresupuesto.id))),
+        ),
+    }
+    print(f"{filas} filas, mediana de {repeticiones} repeticiones")
+    for nombre, (camino_antes, camino_ahora) in casos.items():
+        with antes.app_context():
+            ms_antes, mib_antes, bytes_antes = _medir(antes, camino_antes, repeticiones)
+        with ahora.app_context():
+            ms_ahora, mib_ahora, bytes_ahora = _medir(ahora, camino_ahora, repeticiones)
+        print(f"{nombre:12s} antes {ms_antes:8.1f} ms {mib_antes:7.1f} MiB ({bytes_antes} bytes) | "
+              f"ahora {ms_ahora:8.1f} ms {mib_ahora:7.1f} MiB ({bytes_ahora} bytes) | x{ms_antes / ms_ahora:.1f}")
+
+
+if __name__ == "__main__":
+    main(*(int(valor) for valor in sys.argv[1:3]))
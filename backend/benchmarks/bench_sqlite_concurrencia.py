@@ -0,0 +1,113 @@
+"""Lecturas y escrituras por segundo con N workers sobre el mismo archivo SQLite.
+
+Compara la configuración anterior (journal por defecto, sin reintentos) contra el
+perfil de base_datos.py (WAL, busy_timeout, synchronous=NORMAL, cache, mmap y
+reintentos ante "database is locked"). Cada worker es un proceso con su propia app,
+como los workers de gunicorn, y mezcla consultas al catálogo con transacciones que
+leen un material y actualizan su precio.
+
+Uso: python -m backend.benchmarks.bench_sqlite_concurrencia [workers] [segundos] [fraccion_escritura]
+"""
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from backend.app import create_app
+from backend.base_datos import es_bloqueo, reintentar_si_bloqueada
+from backend.config import Config
+from backend.extensions import db
+from backend.migraciones import actualizar_esquema
+from backend.models import Material
+
+MATERIALES = 5000
+
+PERFILES = {
+    "antes": {"SQLITE_APLICAR_PERFIL": False, "SQLITE_REINTENTOS": 1},
+    "perfil": {"SQLITE_APLICAR_PERFIL": True, "SQLITE_REINTENTOS": Config.SQLITE_REINTENTOS},
+}
+
+
+def _config(ruta: str, opciones: dict):
+    return type("ConfigBench", (Config,), {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{ruta}", **opciones})
+
+
+def _preparar(ruta: str, opciones: dict) -> None:
+    # Como `flask db-upgrade` antes de gunicorn: el archivo ya queda en WAL al arrancar los workers.
+    app = create_app(_config(ruta, opciones))
+    with app.app_context():
+        actualizar_esquema()
+        db.session.add_all(
+            Material(nombre=f"Material {i}", unidad="pza", precio_unitario=Decimal(i % 900 + 1))
+            for i in range(MATERIALES)
+        )
+        db.session.commit()
+
+
+def _leer(rng: random.Random) -> None:
+    desde = rng.randint(1, MATERIALES - 50)
+    db.session.query(func.count(Material.id), func.sum(Material.precio_unitario)).filter(
+        Material.id.between(desde, desde + 50)
+    ).one()
+    db.session.rollback()
+
+
+def _escribir(rng: random.Random) -> None:
+    material = db.session.get(Material, rng.randint(1, MATERIALES))
+    material.precio_unitario = Decimal(material.precio_unitario) + 1
+    db.session.commit()
+
+
+def _worker(argumentos) -> dict:
+    ruta, opciones, segundos, fraccion_escritura, semilla = argumentos
+    rng = random.Random(semilla)
+    app = create_app(_config(ruta, opciones))
+    escribir = _escribir
+    if opciones["SQLITE_REINTENTOS"] > 1:
+        escribir = reintentar_si_bloqueada(_escribir, opciones["SQLITE_REINTENTOS"], Config.SQLITE_REINTENTO_ESPERA_MS)
+
+    lecturas = escrituras = errores = 0
+    with app.app_context():
+        fin = time.perf_counter() + segundos
+        while time.perf_counter() < fin:
+            try:
+                if rng.random() < fraccion_escritura:
+                    escribir(rng)
+                    escrituras += 1
+                else:
+                    _leer(rng)
+                    lecturas += 1
+            except OperationalError as error:
+                if not es_bloqueo(error):
+                    raise
+                db.session.rollback()
+                errores += 1
+    return {"lecturas": lecturas, "escrituras": escrituras, "errores": errores}
+
+
+def main() -> None:
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    segundos = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    fraccion_escritura = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+
+    print(f"{workers} workers, {segundos:g} s, {fraccion_escritura:.0%} escrituras")
+    for nombre, opciones in PERFILES.items():
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, "bench.sqlite3")
+            _preparar(ruta, opciones)
+            tareas = [(ruta, opciones, segundos, fraccion_escritura, semilla) for semilla in range(workers)]
+            with multiprocessing.Pool(workers) as pool:
+                resultados = pool.map(_worker, tareas)
+        lecturas = sum(r["lecturas"] for r in resultados)
+        escrituras = sum(r["escrituras"] for r in resultados)
+        errores = sum(r["errores"] for r in resultados)
+        print(f"  {nombre:<7} lecturas/s {lecturas / segundos:9.1f}   escrituras/s {escrituras / segundos:8.1f}   "
+              f"'database is locked' {errores}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,19 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", f"sqlite:///{os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data.sqlite3')}")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Perfil SQLite aplicado a cada conexión (ver backend/base_datos.py)
+    SQLITE_APLICAR_PERFIL = os.environ.get("SQLITE_APLICAR_PERFIL", "1") == "1"
+    SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", "-65536"))  # negativo = KiB (64 MiB)
+    SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_FOREIGN_KEYS = os.environ.get("SQLITE_FOREIGN_KEYS", "1") == "1"
+    SQLITE_REINTENTOS = int(os.environ.get("SQLITE_REINTENTOS", "5"))
+    SQLITE_REINTENTO_ESPERA_MS = float(os.environ.get("SQLITE_REINTENTO_ESPERA_MS", "50"))
+    # Respuestas JSON con orjson (ver json_rapido.py); 0 vuelve al proveedor de Flask
+    JSON_RAPIDO = os.environ.get("JSON_RAPIDO", "1") == "1"
+
     # Session cookies
     SESSION_COOKIE_SECURE = True
     SESSION_COOKIE_HTTPONLY = True
@@ -13,6 +26,9 @@ class Config:
 
     # Business Logic
     PRECIOS_OBSOLETOS_DIAS = int(os.environ.get("PRECIOS_OBSOLETOS_DIAS", "90"))
+    PU_CACHE_MAX_ENTRADAS = int(os.environ.get("PU_CACHE_MAX_ENTRADAS", "4096"))
+    # Memoria (aproximada) para las instantáneas del catálogo por usuario; ver catalogo_cache_service.
+    CATALOGO_CACHE_MAX_MB = float(os.environ.get("CATALOGO_CACHE_MAX_MB", "64"))
     GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
     # Updated to gemini-2.5-flash as per user requirement (from image)
     GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash-lite")
@@ -0,0 +1,75 @@
+"""Proveedor JSON de la app basado en orjson.
+
+Las respuestas grandes (catálogos, detalles de presupuesto) pasan la mayor parte del
+tiempo en json.dumps. orjson serializa en C directo a bytes; el proveedor conserva lo
+que hace el de Flask: llaves ordenadas, Decimal como texto, fechas en formato HTTP y
+el salto de línea final. Lo que orjson no acepta (llaves no textuales, enteros de más
+de 64 bits) se serializa con el proveedor de Flask, igual que en modo debug (sangría).
+Sin orjson instalado la app usa el proveedor de Flask.
+"""
+from datetime import date
+from decimal import Decimal
+from typing import Any
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional
+    orjson = None
+
+
+def _por_defecto(valor: Any) -> Any:
+    # Mismas conversiones que DefaultJSONProvider para lo que orjson no serializa igual
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, date):
+        return DefaultJSONProvider.default(valor)
+    if hasattr(valor, "__html__"):
+        return str(valor.__html__())
+    raise TypeError(f"Object of type {type(valor).__name__} is not JSON serializable")
+
+
+class ProveedorJSONRapido(DefaultJSONProvider):
+    def _opciones(self) -> int:
+        opciones = orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            opciones |= orjson.OPT_SORT_KEYS
+        return opciones
+
+    def _bytes(self, obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_por_defecto, option=self._opciones())
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        try:
+            return self._bytes(obj).decode()
+        except TypeError:
+            return super().dumps(obj)
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            return super().loads(s)  # NaN, Infinity y demás extensiones de json
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(obj)
+        try:
+            cuerpo = self._bytes(obj)
+        except TypeError:
+            return super().response(obj)
+        return self._app.response_class(cuerpo + b"\n", mimetype=self.mimetype)
+
+
+def configurar_json(app: Flask) -> None:
+    """Registra el proveedor rápido si orjson está disponible y JSON_RAPIDO está activo."""
+    if orjson is None or not app.config["JSON_RAPIDO"]:
+        return
+    app.json_provider_class = ProveedorJSONRapido
+    app.json = ProveedorJSONRapido(app)
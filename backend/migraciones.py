@@ -0,0 +1,190 @@
+"""Migraciones de esquema versionadas.
+
+Cada paso tiene un número y se registra en la tabla schema_version al aplicarse, dentro
+de la misma transacción. Los pasos son idempotentes (revisan columnas e índices antes
+de crearlos), así que una base nueva, creada ya completa por db.create_all(), solo los
+marca como aplicados. Se ejecutan una vez por despliegue con `flask db-upgrade`; los
+workers arrancan sin tocar el esquema.
+"""
+from datetime import date, datetime
+from typing import Callable, List, Tuple
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+from backend.extensions import db
+from backend.services.busqueda_service import crear_indice_busqueda, reconstruir_indice_busqueda
+from backend.services.historial_service import proteger_historial
+
+
+def _existe_tabla(conn: Connection, tabla: str) -> bool:
+    return inspect(conn).has_table(tabla)
+
+
+def _agregar_columnas(conn: Connection, tabla: str, columnas: List[Tuple[str, str]]) -> List[str]:
+    """Agrega las columnas que falten; devuelve las que se agregaron."""
+    if not _existe_tabla(conn, tabla):
+        return []
+    existentes = {c["name"] for c in inspect(conn).get_columns(tabla)}
+    agregadas = []
+    for nombre, definicion in columnas:
+        if nombre in existentes:
+            continue
+        conn.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {nombre} {definicion}"))
+        agregadas.append(nombre)
+        print(f"✅ Migración: Columna '{tabla}.{nombre}' añadida.")
+    return agregadas
+
+
+def _crear_indices(conn: Connection, indices: List[Tuple[str, str, str]]) -> None:
+    for nombre, tabla, columnas in indices:
+        if _existe_tabla(conn, tabla):
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {nombre} ON {tabla} ({columnas})"))
+
+
+def _paso_campos_insumos(conn: Connection) -> None:
+    # Antes en migrations/add_insumo_fields.py
+    hoy = date.today().isoformat()
+    for tabla in ("materiales", "equipos", "maquinaria", "mano_obra"):
+        _agregar_columnas(conn, tabla, [
+            ("disciplina", "TEXT"),
+            ("calidad", "TEXT"),
+            ("fecha_actualizacion", f"DATE DEFAULT '{hoy}' NOT NULL"),
+        ])
+
+
+def _paso_usuarios_y_fasar(conn: Connection) -> None:
+    _agregar_columnas(conn, "users", [
+        ("is_premium", "BOOLEAN DEFAULT 0"),
+        ("trial_ends_at", "DATETIME"),
+    ])
+    _agregar_columnas(conn, "constantes_fasar", [
+        ("user_id", "INTEGER REFERENCES users(id)"),
+        ("valor_uma", "NUMERIC(10, 2) DEFAULT 108.57"),
+        ("salario_minimo_general", "NUMERIC(10, 2) DEFAULT 248.93"),
+        ("dias_festivos_costumbre", "NUMERIC(6, 2) DEFAULT 3.0"),
+        ("dias_mal_tiempo", "NUMERIC(6, 2) DEFAULT 2.0"),
+        ("dias_permisos_sindicales", "NUMERIC(6, 2) DEFAULT 2.0"),
+        ("prima_riesgo_trabajo_patronal", "NUMERIC(10, 6) DEFAULT 7.58875"),
+        ("impuesto_sobre_nomina", "NUMERIC(6, 4) DEFAULT 0.03"),
+    ])
+
+
+def _paso_aislamiento_por_usuario(conn: Connection) -> None:
+    for tabla in ("materiales", "mano_obra", "equipos", "maquinaria", "conceptos", "proyectos"):
+        _agregar_columnas(conn, tabla, [("user_id", "INTEGER REFERENCES users(id)")])
+
+
+def _paso_plan_costo(conn: Connection) -> None:
+    _agregar_columnas(conn, "conceptos", [("plan_costo", "TEXT")])
+
+
+def _paso_subtotales(conn: Connection) -> None:
+    columnas = [
+        ("total", "NUMERIC(16, 4) NOT NULL DEFAULT 0"),
+        ("total_costo_directo", "NUMERIC(16, 4) NOT NULL DEFAULT 0"),
+    ]
+    _agregar_columnas(conn, "partidas", columnas)
+    _agregar_columnas(conn, "proyectos", columnas)
+    if not (_existe_tabla(conn, "partidas") and _existe_tabla(conn, "proyectos")):
+        return
+    # Llenar los subtotales de presupuestos que ya existían
+    conn.execute(text(
+        "UPDATE partidas SET "
+        "total = COALESCE((SELECT SUM(cantidad_obra * precio_unitario_calculado) FROM detalle_presupuesto d WHERE d.partida_id = partidas.id), 0), "
+        "total_costo_directo = COALESCE((SELECT SUM(cantidad_obra * costo_directo) FROM detalle_presupuesto d WHERE d.partida_id = partidas.id), 0)"
+    ))
+    conn.execute(text(
+        "UPDATE proyectos SET "
+        "total = COALESCE((SELECT SUM(total) FROM partidas p WHERE p.proyecto_id = proyectos.id), 0), "
+        "total_costo_directo = COALESCE((SELECT SUM(total_costo_directo) FROM partidas p WHERE p.proyecto_id = proyectos.id), 0)"
+    ))
+
+
+def _paso_indices(conn: Connection) -> None:
+    # Mismos nombres que genera SQLAlchemy para index=True, así create_all no los duplica.
+    _crear_indices(conn, [
+        ("ix_matriz_insumo_concepto_id", "matriz_insumo", "concepto_id"),
+        ("ix_matriz_insumo_tipo_id", "matriz_insumo", "tipo_insumo, id_insumo"),
+        ("ix_detalle_presupuesto_partida_id", "detalle_presupuesto", "partida_id"),
+        ("ix_detalle_presupuesto_concepto_id", "detalle_presupuesto", "concepto_id"),
+        ("ix_partidas_proyecto_id", "partidas", "proyecto_id"),
+        ("ix_materiales_user_id", "materiales", "user_id"),
+        ("ix_mano_obra_user_id", "mano_obra", "user_id"),
+        ("ix_equipos_user_id", "equipos", "user_id"),
+        ("ix_maquinaria_user_id", "maquinaria", "user_id"),
+        ("ix_conceptos_user_id", "conceptos", "user_id"),
+        ("ix_proyectos_user_id", "proyectos", "user_id"),
+        ("ix_constantes_fasar_user_id", "constantes_fasar", "user_id"),
+    ])
+
+
+def _paso_indices_listados(conn: Connection) -> None:
+    # Orden (nombre, id) de la paginación por cursor; materiales y conceptos ya tienen índice único.
+    _crear_indices(conn, [
+        ("ix_equipos_nombre", "equipos", "nombre"),
+        ("ix_maquinaria_nombre", "maquinaria", "nombre"),
+        ("ix_mano_obra_puesto", "mano_obra", "puesto"),
+    ])
+
+
+def _paso_busqueda(conn: Connection) -> None:
+    if conn.dialect.name != "sqlite":
+        return
+    crear_indice_busqueda(conn)
+    reconstruir_indice_busqueda(conn)
+
+
+def _paso_historial_precios(conn: Connection) -> None:
+    # La tabla historial_precios la crea create_all; aquí los índices del filtro obsoleto
+    # y los triggers de solo inserción en bases que ya tenían la tabla.
+    _crear_indices(conn, [
+        (f"ix_{tabla}_fecha_actualizacion", tabla, "fecha_actualizacion")
+        for tabla in ("materiales", "mano_obra", "equipos", "maquinaria")
+    ])
+    if conn.dialect.name == "sqlite" and _existe_tabla(conn, "historial_precios"):
+        proteger_historial(conn)
+
+
+PASOS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Campos disciplina, calidad y fecha_actualizacion en insumos", _paso_campos_insumos),
+    (2, "Columnas de usuarios y constantes FASAR", _paso_usuarios_y_fasar),
+    (3, "user_id en catálogos, conceptos y proyectos", _paso_aislamiento_por_usuario),
+    (4, "Plan de costo compilado por concepto", _paso_plan_costo),
+    (5, "Subtotales materializados de partidas y proyectos", _paso_subtotales),
+    (6, "Índices de matriz, presupuestos y user_id", _paso_indices),
+    (7, "Índices de orden para listados paginados", _paso_indices_listados),
+    (8, "Índice FTS5 de búsqueda en catálogos y conceptos", _paso_busqueda),
+    (9, "Historial de precios de solo inserción e índices de fecha_actualizacion", _paso_historial_precios),
+]
+
+
+def version_esquema() -> int:
+    with db.engine.connect() as conn:
+        if not _existe_tabla(conn, "schema_version"):
+            return 0
+        return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def actualizar_esquema() -> List[int]:
+    """Crea las tablas que falten y aplica los pasos pendientes. Devuelve los pasos aplicados."""
+    import backend.models  # noqa: F401  registra todos los modelos antes de create_all
+
+    db.create_all()
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, descripcion VARCHAR(255) NOT NULL, aplicada_en DATETIME NOT NULL)"
+        ))
+
+    actual = version_esquema()
+    aplicados = []
+    for version, descripcion, paso in PASOS:
+        if version <= actual:
+            continue
+        with db.engine.begin() as conn:
+            paso(conn)
+            conn.execute(
+                text("INSERT INTO schema_version (version, descripcion, aplicada_en) VALUES (:v, :d, :f)"),
+                {"v": version, "d": descripcion, "f": datetime.utcnow()},
+            )
+        aplicados.append(version)
+    return aplicados
@@ -1,4 +1,4 @@
-from datetime import date
+from datetime import date, datetime
 from decimal import Decimal
 from typing import Dict, Optional, List
 from .extensions import db
@@ -69,7 +69,7 @@ class ConstantesFASAR(db.Model):
     __tablename__ = "constantes_fasar"
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True) # Solo null para migraciones iniciales
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True) # Solo null para migraciones iniciales
     
     # Valores de Referencia Nacional
     valor_uma = db.Column(db.Numeric(10, 2), default=Decimal("108.57"))
@@ -93,14 +93,12 @@ class ConstantesFASAR(db.Model):
     
     @classmethod
     def get_for_user(cls, user_id: int) -> "ConstantesFASAR":
-        instancia = cls.query.filter_by(user_id=user_id).first()
+        """Fila editable del usuario; la crea si no existe. Solo para escrituras y sin commit:
+        las lecturas usan fasar_service.obtener_constantes, que nunca inserta."""
+        instancia = cls.query.filter_by(user_id=user_id).order_by(cls.id).first()
         if not instancia:
             instancia = cls(user_id=user_id)
             db.session.add(instancia)
-            try:
-                db.session.commit()
-            except:
-                db.session.rollback()
         return instancia
 
     def to_dict(self) -> Dict:
@@ -126,11 +124,11 @@ class Material(db.Model):
     __tablename__ = "materiales"
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     nombre = db.Column(db.String(255), unique=True, nullable=False)
     unidad = db.Column(db.String(50), nullable=False)
     precio_unitario = db.Column(db.Numeric(12, 4), nullable=False)
-    fecha_actualizacion = db.Column(db.Date, default=date.today, nullable=False)
+    fecha_actualizacion = db.Column(db.Date, default=date.today, nullable=False, index=True)
     disciplina = db.Column(db.String(100), nullable=True)
     calidad = db.Column(db.String(100), nullable=True)
     porcentaje_merma = db.Column(db.Numeric(5, 4), default=Decimal("0.03"), nullable=False)
@@ -155,12 +153,12 @@ class Equipo(db.Model):
     __tablename__ = "equipos"
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
-    nombre = db.Column(db.String(255), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
+    nombre = db.Column(db.String(255), nullable=False, index=True)
     unidad = db.Column(db.String(50), nullable=False)
     disciplina = db.Column(db.String(100), nullable=True)
     calidad = db.Column(db.String(100), nullable=True)
-    fecha_actualizacion = db.Column(db.Date, default=date.today, nullable=False)
+    fecha_actualizacion = db.Column(db.Date, default=date.today, nullable=False, index=True)
     costo_hora_maq = db.Column(db.Numeric(12, 4), nullable=False)
 
     def to_dict(self) -> Dict:
@@ -176,12 +174,24 @@ class Equipo(db.Model):
         }
 
 
+def costo_posesion_por_hora(costo_adquisicion, vida_util_horas, tasa_interes_anual) -> Decimal:
+    """Depreciación más interés por hora; también se usa en importaciones masivas sin instanciar el modelo."""
+    costo = decimal_field(costo_adquisicion)
+    vida = decimal_field(vida_util_horas or Decimal("1.0"))
+    if vida <= 0:
+        vida = Decimal("1.0")
+    tasa = decimal_field(tasa_interes_anual or Decimal("0.0"))
+    depreciacion = costo / vida
+    interes = (costo * tasa) / vida
+    return depreciacion + interes
+
+
 class Maquinaria(db.Model):
     __tablename__ = "maquinaria"
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
-    nombre = db.Column(db.String(255), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
+    nombre = db.Column(db.String(255), nullable=False, index=True)
     costo_adquisicion = db.Column(db.Numeric(14, 2), nullable=False)
     vida_util_horas = db.Column(db.Numeric(14, 2), nullable=False)
     tasa_interes_anual = db.Column(db.Numeric(5, 4), default=Decimal("0.10"), nullable=False)
@@ -189,18 +199,10 @@ class Maquinaria(db.Model):
     costo_posesion_hora = db.Column(db.Numeric(14, 4), default=Decimal("0.0000"), nullable=False)
     disciplina = db.Column(db.String(100), nullable=True)
     calidad = db.Column(db.String(100), nullable=True)
-    fecha_actualizacion = db.Column(db.Date, default=date.today, nullable=False)
+    fecha_actualizacion = db.Column(db.Date, default=date.today, nullable=False, index=True)
 
     def actualizar_costo_posesion(self):
-        # Implement logic inline to avoid circular import issues with services
-        costo = decimal_field(self.costo_adquisicion)
-        vida = decimal_field(self.vida_util_horas or Decimal("1.0"))
-        if vida <= 0:
-            vida = Decimal("1.0")
-        tasa = decimal_field(self.tasa_interes_anual or Decimal("0.0"))
-        depreciacion = costo / vida
-        interes = (costo * tasa) / vida
-        self.costo_posesion_hora = depreciacion + interes
+        self.costo_posesion_hora = costo_posesion_por_hora(self.costo_adquisicion, self.vida_util_horas, self.tasa_interes_anual)
 
     def to_dict(self) -> Dict:
         return {
@@ -222,86 +224,22 @@ class ManoObra(db.Model):
     __tablename__ = "mano_obra"
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
-    puesto = db.Column(db.String(255), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
+    puesto = db.Column(db.String(255), nullable=False, index=True)
     salario_base = db.Column(db.Numeric(12, 2), nullable=False)
     antiguedad_anios = db.Column(db.Integer, default=1, nullable=False)
     fasar = db.Column(db.Numeric(12, 4), default=Decimal("1.0000"), nullable=False)
     rendimiento_jornada = db.Column(db.Numeric(10, 4), default=Decimal("1.0000"), nullable=False)
     disciplina = db.Column(db.String(100), nullable=True)
     calidad = db.Column(db.String(100), nullable=True)
-    fecha_actualizacion = db.Column(db.Date, default=date.today, nullable=False)
+    fecha_actualizacion = db.Column(db.Date, default=date.today, nullable=False, index=True)
 
     def refresh_fasar(self):
         """Calcula el FASAR individual profesional basado en la Ley del IMSS e INFONAVIT."""
-        if not self.user_id:
-            # Si no hay usuario (migración), usar singleton de admin
-            c = ConstantesFASAR.get_for_user(None)
-        else:
-            c = ConstantesFASAR.get_for_user(self.user_id)
-        
-        # 1. Determinación de Vacaciones según Antigüedad (Ley 2023)
-        # 1 año: 12d, 2: 14d, 3: 16d, 4: 18d, 5: 20d, etc.
-        if self.antiguedad_anios <= 1: vac = 12
-        elif self.antiguedad_anios == 2: vac = 14
-        elif self.antiguedad_anios == 3: vac = 16
-        elif self.antiguedad_anios == 4: vac = 18
-        elif self.antiguedad_anios <= 5: vac = 20
-        elif self.antiguedad_anios <= 10: vac = 22
-        elif self.antiguedad_anios <= 15: vac = 24
-        elif self.antiguedad_anios <= 20: vac = 26
-        else: vac = 30
-        
-        # 2. Factor de Integración Salarial (FSB)
-        # (365 + Aguinaldo + Prima Vacacional) / 365
-        dias_pagados_anio = Decimal(c.dias_del_anio) + Decimal(c.dias_aguinaldo_minimos) + (Decimal(vac) * Decimal(c.prima_vacacional_porcentaje))
-        factor_integracion = dias_pagados_anio / Decimal(c.dias_del_anio)
-        
-        sbc = Decimal(self.salario_base) * factor_integracion # Salario Base de Cotización
-        
-        # 3. Días Realmente Trabajados al año (TI)
-        ti = (Decimal(c.dias_del_anio) 
-              - 52 # Domingos
-              - Decimal(vac) 
-              - Decimal(c.dias_festivos_obligatorios) 
-              - Decimal(c.dias_festivos_costumbre) 
-              - Decimal(c.dias_mal_tiempo) 
-              - Decimal(c.dias_riesgo_trabajo_promedio) 
-              - Decimal(c.dias_permisos_sindicales))
-        
-        # 4. Cálculo de Cuotas Patronales (Simplificado pero realista)
-        # PS = Cuota Fija + Excedente + Prestaciones Dinero + Gastos Médicos + Invalidez/Vida + Riesgo + Guardería + Retiro + Vejez + Infonavit
-        uma = Decimal(c.valor_uma)
-        
-        # Cuota Fija (20.40% de la UMA)
-        cuota_fija = uma * Decimal("0.204")
-        
-        # Excedente (1.10% de lo que exceda 3 UMAs)
-        exc = Decimal("0")
-        if sbc > (uma * 3):
-            exc = (sbc - (uma * 3)) * Decimal("0.011")
-            
-        # Otros % sobre SBC
-        prest_dinero = sbc * Decimal("0.007")
-        gastos_med = sbc * Decimal("0.0105")
-        riesgo = sbc * (Decimal(c.prima_riesgo_trabajo_patronal) / 100)
-        invalidez = sbc * Decimal("0.0175")
-        guarderia = sbc * Decimal("0.01")
-        infonavit = sbc * Decimal("0.05")
-        sar = sbc * Decimal("0.02")
-        vejez = sbc * Decimal("0.0315") # Variable según salario, promedio
-        isn = Decimal(self.salario_base) * Decimal(c.impuesto_sobre_nomina)
-        
-        cargas_sociales_dia = cuota_fija + exc + prest_dinero + gastos_med + riesgo + invalidez + guarderia + infonavit + sar + vejez + isn
-        
-        # 5. Factor de Salario Real Final
-        # FSR = (Tp/Ti) + (CargasSocialesDia / (Ti/365 * SBC))
-        # Una forma más directa usada en México:
-        # FSR = (CargasSocialesDia / SalarioBase) + (DíasPagados / DíasTrabajados)
-        tp_ti = dias_pagados_anio / ti if ti > 0 else Decimal("1.0")
-        fsr = (cargas_sociales_dia / Decimal(self.salario_base)) + tp_ti
-        
-        self.fasar = fsr.quantize(Decimal("0.0001"))
+        from backend.services.fasar_service import parametros_fasar
+
+        # Sin usuario (migración) se usan las constantes globales
+        self.fasar = parametros_fasar(self.user_id).fasar(self.salario_base, self.antiguedad_anios)
 
     def to_dict(self) -> Dict:
         return {
@@ -322,10 +260,12 @@ class Concepto(db.Model):
     __tablename__ = "conceptos"
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     clave = db.Column(db.String(50), unique=True, nullable=False)
     descripcion = db.Column(db.Text, nullable=False)
     unidad_concepto = db.Column(db.String(50), nullable=False)
+    # Plan de costo compilado de la matriz (JSON); se regenera al editar la matriz.
+    plan_costo = db.Column(db.Text, nullable=True)
 
     insumos = db.relationship("MatrizInsumo", backref="concepto", cascade="all, delete-orphan")
 
@@ -340,9 +280,13 @@ class Concepto(db.Model):
 
 class MatrizInsumo(db.Model):
     __tablename__ = "matriz_insumo"
+    __table_args__ = (
+        # Índice inverso insumo -> conceptos (la referencia es polimórfica, sin FK).
+        db.Index("ix_matriz_insumo_tipo_id", "tipo_insumo", "id_insumo"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    concepto_id = db.Column(db.Integer, db.ForeignKey("conceptos.id"), nullable=False)
+    concepto_id = db.Column(db.Integer, db.ForeignKey("conceptos.id"), nullable=False, index=True)
     tipo_insumo = db.Column(db.String(20), nullable=False)
     id_insumo = db.Column(db.Integer, nullable=False)
     cantidad = db.Column(db.Numeric(12, 4), nullable=False)
@@ -373,7 +317,7 @@ class Proyecto(db.Model):
     __tablename__ = "proyectos"
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
     nombre_proyecto = db.Column(db.String(255), nullable=False)
     ubicacion = db.Column(db.String(255), nullable=True, default="")
     descripcion = db.Column(db.Text, nullable=True, default="")
@@ -390,6 +334,9 @@ class Proyecto(db.Model):
     ajuste_iva_porcentaje = db.Column(db.Numeric(6, 4), default=Decimal("0.00"))
     has_presupuesto_maximo = db.Column(db.Boolean, default=False)
     monto_maximo = db.Column(db.Numeric(14, 2), default=Decimal("0.00"))
+    # Subtotales materializados (ver services/totales_service.py)
+    total = db.Column(db.Numeric(16, 4), default=Decimal("0.0000"), nullable=False)
+    total_costo_directo = db.Column(db.Numeric(16, 4), default=Decimal("0.0000"), nullable=False)
 
     partidas = db.relationship("Partida", backref="proyecto", cascade="all, delete-orphan")
 
@@ -424,15 +371,23 @@ class Proyecto(db.Model):
              },
              "has_presupuesto_maximo": bool(self.has_presupuesto_maximo),
              "monto_maximo": float(self.monto_maximo or 0),
+             "total": float(self.total or 0),
+             "total_costo_directo": float(self.total_costo_directo or 0),
+             "excede_presupuesto_maximo": self.excede_presupuesto_maximo(),
         }
 
+    def excede_presupuesto_maximo(self) -> bool:
+        return bool(self.has_presupuesto_maximo) and (self.total or 0) > (self.monto_maximo or 0)
+
 
 class Partida(db.Model):
     __tablename__ = "partidas"
 
     id = db.Column(db.Integer, primary_key=True)
-    proyecto_id = db.Column(db.Integer, db.ForeignKey("proyectos.id"), nullable=False)
+    proyecto_id = db.Column(db.Integer, db.ForeignKey("proyectos.id"), nullable=False, index=True)
     nombre_partida = db.Column(db.String(255), nullable=False)
+    total = db.Column(db.Numeric(16, 4), default=Decimal("0.0000"), nullable=False)
+    total_costo_directo = db.Column(db.Numeric(16, 4), default=Decimal("0.0000"), nullable=False)
 
     detalles = db.relationship("DetallePresupuesto", backref="partida", cascade="all, delete-orphan")
 
@@ -441,6 +396,8 @@ class Partida(db.Model):
             "id": self.id,
             "proyecto": self.proyecto_id,
             "nombre_partida": self.nombre_partida,
+            "total": float(self.total or 0),
+            "total_costo_directo": float(self.total_costo_directo or 0),
         }
 
 
@@ -448,8 +405,8 @@ class DetallePresupuesto(db.Model):
     __tablename__ = "detalle_presupuesto"
 
     id = db.Column(db.Integer, primary_key=True)
-    partida_id = db.Column(db.Integer, db.ForeignKey("partidas.id"), nullable=False)
-    concepto_id = db.Column(db.Integer, db.ForeignKey("conceptos.id"), nullable=False)
+    partida_id = db.Column(db.Integer, db.ForeignKey("partidas.id"), nullable=False, index=True)
+    concepto_id = db.Column(db.Integer, db.ForeignKey("conceptos.id"), nullable=False, index=True)
     cantidad_obra = db.Column(db.Numeric(14, 4), nullable=False)
     precio_unitario_calculado = db.Column(db.Numeric(14, 4), nullable=False)
     costo_directo = db.Column(db.Numeric(14, 4), nullable=False, default=Decimal("0.0000"))
@@ -466,6 +423,75 @@ class DetallePresupuesto(db.Model):
             "costo_directo": float(self.costo_directo or 0),
         }
 
+class DistribucionPrecio(db.Model):
+    """Rango de precio cotizado para un insumo (mínimo, promedio y máximo)."""
+    __tablename__ = "distribuciones_precio"
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "tipo_insumo", "id_insumo", name="uq_distribucion_insumo"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
+    tipo_insumo = db.Column(db.String(20), nullable=False)
+    id_insumo = db.Column(db.Integer, nullable=False)
+    precio_min = db.Column(db.Numeric(12, 4), nullable=False)
+    precio_promedio = db.Column(db.Numeric(12, 4), nullable=False)
+    precio_max = db.Column(db.Numeric(12, 4), nullable=False)
+    fuente = db.Column(db.String(100), nullable=True)
+    fecha_actualizacion = db.Column(db.Date, default=date.today, nullable=False)
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "tipo_insumo": self.tipo_insumo,
+            "id_insumo": self.id_insumo,
+            "precio_min": float(self.precio_min),
+            "precio_promedio": float(self.precio_promedio),
+            "precio_max": float(self.precio_max),
+            "fuente": self.fuente,
+            "fecha_actualizacion": self.fecha_actualizacion.isoformat(),
+        }
+
+
+class HistorialPrecio(db.Model):
+    """Cambio de precio de un insumo del catálogo; precio_anterior es NULL si el insumo se creó."""
+    __tablename__ = "historial_precios"
+    __table_args__ = (
+        db.Index("ix_historial_precios_insumo", "tipo_insumo", "id_insumo", "fecha"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True, index=True)
+    tipo_insumo = db.Column(db.String(20), nullable=False)
+    id_insumo = db.Column(db.Integer, nullable=False)
+    precio_anterior = db.Column(db.Numeric(14, 4), nullable=True)
+    precio_nuevo = db.Column(db.Numeric(14, 4), nullable=False)
+    fuente = db.Column(db.String(50), nullable=False)
+    fecha = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "tipo_insumo": self.tipo_insumo,
+            "id_insumo": self.id_insumo,
+            "precio_anterior": float(self.precio_anterior) if self.precio_anterior is not None else None,
+            "precio_nuevo": float(self.precio_nuevo),
+            "fuente": self.fuente,
+            "fecha": self.fecha.isoformat(),
+        }
+
+
+class VersionRecurso(db.Model):
+    """Contador de versión por usuario y recurso; user_id 0 es el ámbito global (filas sin dueño)."""
+    __tablename__ = "versiones_recurso"
+    __table_args__ = (db.UniqueConstraint("user_id", "recurso", name="uq_version_usuario_recurso"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, default=0)
+    recurso = db.Column(db.String(50), nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
 class Feedback(db.Model):
     __tablename__ = "feedbacks"
 
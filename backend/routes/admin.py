@@ -1,7 +1,10 @@
 from flask import Blueprint, request, jsonify, session
+from backend.base_datos import reintentable
 from backend.models import User, Proyecto, Feedback, ConstantesFASAR, db
 from backend.routes.auth import trial_required
 from backend.services.notification_service import send_admin_notification
+from backend.services.cache_pu_service import cache_pu
+from backend.services.catalogo_cache_service import cache_catalogo
 from functools import wraps
 from datetime import datetime, timedelta
 
@@ -50,6 +53,7 @@ def list_users():
     return jsonify([u.to_dict() for u in users])
 
 @bp.route("/users/<int:user_id>/toggle_premium", methods=["POST"])
+@reintentable
 @admin_required
 def toggle_premium(user_id):
     user = User.query.get_or_404(user_id)
@@ -64,6 +68,7 @@ def list_feedback():
     return jsonify([f.to_dict() for f in feedbacks])
 
 @bp.route("/feedback", methods=["POST"])
+@reintentable
 def submit_feedback():
     data = request.get_json()
     if not data or not data.get("mensaje"):
@@ -93,9 +98,15 @@ def submit_feedback():
     return jsonify({"message": "Feedback enviado con éxito"}), 201
 
 @bp.route("/feedback/<int:fb_id>/resolver", methods=["POST"])
+@reintentable
 @admin_required
 def resolve_feedback(fb_id):
     fb = Feedback.query.get_or_404(fb_id)
     fb.estado = "resuelto"
     db.session.commit()
     return jsonify({"message": "Estado actualizado"})
+
+@bp.route("/cache", methods=["GET"])
+@admin_required
+def cache_stats():
+    return jsonify({"precio_unitario": cache_pu.estadisticas(), "catalogo": cache_catalogo.estadisticas()})
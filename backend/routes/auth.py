@@ -1,4 +1,5 @@
 from flask import Blueprint, request, jsonify, session
+from backend.base_datos import reintentable
 from backend.models import User
 from backend.extensions import db
 from datetime import datetime, timedelta
@@ -7,6 +8,7 @@ from functools import wraps
 bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 
 @bp.route("/register", methods=["POST"])
+@reintentable
 def register():
     try:
         data = request.get_json()
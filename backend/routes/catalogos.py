@@ -1,21 +1,57 @@
 from flask import Blueprint, request, jsonify, session
+from backend.base_datos import reintentable
 from backend.routes.auth import trial_required
+from backend.routes.etag import con_etag
 from datetime import date
 from decimal import Decimal
-from backend.models import Material, Equipo, Maquinaria, ManoObra, ConstantesFASAR
+from backend.models import Material, Equipo, Maquinaria, ManoObra, ConstantesFASAR, DistribucionPrecio
 from backend.extensions import db
-from backend.services.calculation_service import decimal_field
+from backend.services.busqueda_service import ORIGENES, LIMITE_BUSQUEDA, MAX_LIMITE_BUSQUEDA, buscar, buscar_con_tiempo, normalizar
+from backend.services.calculation_service import decimal_field, MODELOS_INSUMO
+from backend.services.recalculo_service import recalcular_proyectos_usuario, recalcular_por_insumos
+from backend.services.fasar_service import CAMPOS_CONSTANTES, obtener_constantes, recalcular_fasar_usuario
+from backend.services.dependencias_service import dependencias_de_insumo
+from backend.services.exportacion_service import ErrorExportacion, filas_catalogo, formato_pedido, respuesta_exportacion
+from backend.services.historial_service import MODELOS, deriva_de_precio
+from backend.services.importacion_service import ErrorImportacion, importar_catalogo
+from backend.services.listado_service import ErrorListado, listar_catalogo
+from backend.services.montecarlo_service import guardar_distribucion, validar_distribucion
+from backend.services.precios_service import ErrorPrecios, actualizar_precios
+from backend.services.versiones_service import RECURSO_CATALOGO, RECURSO_FASAR, RECURSO_MATRIZ, incrementar_version
 
 bp = Blueprint('catalogos', __name__, url_prefix='/api')
 
+
+def _listado(modelo, user_id):
+    try:
+        return jsonify(listar_catalogo(modelo, user_id, request.args))
+    except ErrorListado as e:
+        return jsonify({"error": str(e)}), 400
+
+
+EXPORTABLES = {"materiales": Material, "manoobra": ManoObra, "equipo": Equipo, "maquinaria": Maquinaria}
+
+
+@bp.route("/<any(materiales, manoobra, equipo, maquinaria):catalogo>/exportar", methods=["GET"])
+@trial_required
+def exportar_catalogo(catalogo: str):
+    try:
+        formato, comprimir = formato_pedido(request.args)
+        filas, columnas = filas_catalogo(EXPORTABLES[catalogo], session.get("user_id"), request.args)
+    except (ErrorExportacion, ErrorListado) as e:
+        return jsonify({"error": str(e)}), 400
+    return respuesta_exportacion(filas, columnas, catalogo, formato, comprimir)
+
+
 # --- Materiales ---
 @bp.route("/materiales", methods=["GET", "POST"])
+@reintentable
 @trial_required
+@con_etag(RECURSO_CATALOGO)
 def materiales_collection():
     user_id = session.get("user_id")
     if request.method == "GET":
-        materiales = Material.query.filter((Material.user_id == user_id) | (Material.user_id == None)).order_by(Material.nombre).all()
-        return jsonify([mat.to_dict() for mat in materiales])
+        return _listado(Material, user_id)
 
     payload = request.get_json(force=True)
     material = Material(
@@ -30,11 +66,14 @@ def materiales_collection():
         calidad=payload.get("calidad"),
     )
     db.session.add(material)
+    incrementar_version(RECURSO_CATALOGO, material.user_id)
     db.session.commit()
     return jsonify(material.to_dict()), 201
 
 @bp.route("/materiales/<int:material_id>", methods=["GET", "PUT", "DELETE"])
+@reintentable
 @trial_required
+@con_etag(RECURSO_CATALOGO)
 def material_detail(material_id: int):
     user_id = session.get("user_id")
     material = Material.query.filter(Material.id == material_id, (Material.user_id == user_id) | (Material.user_id == None)).first_or_404()
@@ -43,6 +82,8 @@ def material_detail(material_id: int):
 
     if request.method == "DELETE":
         db.session.delete(material)
+        recalcular_por_insumos([("Material", material.id)])
+        incrementar_version(RECURSO_CATALOGO, material.user_id)
         db.session.commit()
         return "", 204
 
@@ -61,17 +102,20 @@ def material_detail(material_id: int):
         material.porcentaje_merma = decimal_field(payload["porcentaje_merma"])
     if "precio_flete_unitario" in payload:
         material.precio_flete_unitario = decimal_field(payload["precio_flete_unitario"])
+    recalcular_por_insumos([("Material", material.id)])
+    incrementar_version(RECURSO_CATALOGO, material.user_id)
     db.session.commit()
     return jsonify(material.to_dict())
 
 # --- Mano Obra ---
 @bp.route("/manoobra", methods=["GET", "POST"])
+@reintentable
 @trial_required
+@con_etag(RECURSO_CATALOGO)
 def manoobra_collection():
     user_id = session.get("user_id")
     if request.method == "GET":
-        mano_obra = ManoObra.query.filter((ManoObra.user_id == user_id) | (ManoObra.user_id == None)).order_by(ManoObra.puesto).all()
-        return jsonify([mano.to_dict() for mano in mano_obra])
+        return _listado(ManoObra, user_id)
 
     payload = request.get_json(force=True)
     mano = ManoObra(
@@ -86,11 +130,14 @@ def manoobra_collection():
     )
     mano.refresh_fasar()
     db.session.add(mano)
+    incrementar_version(RECURSO_CATALOGO, mano.user_id)
     db.session.commit()
     return jsonify(mano.to_dict()), 201
 
 @bp.route("/manoobra/<int:mano_id>", methods=["GET", "PUT", "DELETE"])
+@reintentable
 @trial_required
+@con_etag(RECURSO_CATALOGO)
 def manoobra_detail(mano_id: int):
     user_id = session.get("user_id")
     mano = ManoObra.query.filter(ManoObra.id == mano_id, (ManoObra.user_id == user_id) | (ManoObra.user_id == None)).first_or_404()
@@ -99,6 +146,8 @@ def manoobra_detail(mano_id: int):
 
     if request.method == "DELETE":
         db.session.delete(mano)
+        recalcular_por_insumos([("ManoObra", mano.id)])
+        incrementar_version(RECURSO_CATALOGO, mano.user_id)
         db.session.commit()
         return "", 204
 
@@ -117,19 +166,24 @@ def manoobra_detail(mano_id: int):
     if "rendimiento_jornada" in payload:
         mano.rendimiento_jornada = decimal_field(payload["rendimiento_jornada"])
     mano.refresh_fasar()
+    recalcular_por_insumos([("ManoObra", mano.id)])
+    incrementar_version(RECURSO_CATALOGO, mano.user_id)
     db.session.commit()
     return jsonify(mano.to_dict())
 
 # --- Equipo ---
 @bp.route("/equipo", methods=["GET", "POST"])
+@reintentable
 @trial_required
+@con_etag(RECURSO_CATALOGO)
 def equipo_collection():
+    user_id = session.get("user_id")
     if request.method == "GET":
-        equipos = Equipo.query.order_by(Equipo.nombre).all()
-        return jsonify([e.to_dict() for e in equipos])
+        return _listado(Equipo, user_id)
 
     payload = request.get_json(force=True)
     equipo = Equipo(
+        user_id=user_id,
         nombre=payload["nombre"],
         unidad=payload["unidad"],
         disciplina=payload.get("disciplina"),
@@ -138,17 +192,23 @@ def equipo_collection():
         costo_hora_maq=decimal_field(payload["costo_hora_maq"]),
     )
     db.session.add(equipo)
+    incrementar_version(RECURSO_CATALOGO, equipo.user_id)
     db.session.commit()
     return jsonify(equipo.to_dict()), 201
 
 @bp.route("/equipo/<int:equipo_id>", methods=["GET", "PUT", "DELETE"])
+@reintentable
+@con_etag(RECURSO_CATALOGO)
 def equipo_detail(equipo_id: int):
-    equipo = Equipo.query.get_or_404(equipo_id)
+    user_id = session.get("user_id")
+    equipo = Equipo.query.filter(Equipo.id == equipo_id, (Equipo.user_id == user_id) | (Equipo.user_id == None)).first_or_404()
     if request.method == "GET":
         return jsonify(equipo.to_dict())
 
     if request.method == "DELETE":
         db.session.delete(equipo)
+        recalcular_por_insumos([("Equipo", equipo.id)])
+        incrementar_version(RECURSO_CATALOGO, equipo.user_id)
         db.session.commit()
         return "", 204
 
@@ -163,19 +223,24 @@ def equipo_detail(equipo_id: int):
         equipo.fecha_actualizacion = date.fromisoformat(payload["fecha_actualizacion"])
     if "costo_hora_maq" in payload:
         equipo.costo_hora_maq = decimal_field(payload["costo_hora_maq"])
+    recalcular_por_insumos([("Equipo", equipo.id)])
+    incrementar_version(RECURSO_CATALOGO, equipo.user_id)
     db.session.commit()
     return jsonify(equipo.to_dict())
 
 # --- Maquinaria ---
 @bp.route("/maquinaria", methods=["GET", "POST"])
+@reintentable
 @trial_required
+@con_etag(RECURSO_CATALOGO)
 def maquinaria_collection():
+    user_id = session.get("user_id")
     if request.method == "GET":
-        maquinas = Maquinaria.query.order_by(Maquinaria.nombre).all()
-        return jsonify([m.to_dict() for m in maquinas])
+        return _listado(Maquinaria, user_id)
 
     payload = request.get_json(force=True)
     maquinaria = Maquinaria(
+        user_id=user_id,
         nombre=payload["nombre"],
         costo_adquisicion=decimal_field(payload["costo_adquisicion"]),
         vida_util_horas=decimal_field(payload["vida_util_horas"]),
@@ -187,17 +252,23 @@ def maquinaria_collection():
     )
     maquinaria.actualizar_costo_posesion()
     db.session.add(maquinaria)
+    incrementar_version(RECURSO_CATALOGO, maquinaria.user_id)
     db.session.commit()
     return jsonify(maquinaria.to_dict()), 201
 
 @bp.route("/maquinaria/<int:maquinaria_id>", methods=["GET", "PUT", "DELETE"])
+@reintentable
+@con_etag(RECURSO_CATALOGO)
 def maquinaria_detail(maquinaria_id: int):
-    maquinaria = Maquinaria.query.get_or_404(maquinaria_id)
+    user_id = session.get("user_id")
+    maquinaria = Maquinaria.query.filter(Maquinaria.id == maquinaria_id, (Maquinaria.user_id == user_id) | (Maquinaria.user_id == None)).first_or_404()
     if request.method == "GET":
         return jsonify(maquinaria.to_dict())
 
     if request.method == "DELETE":
         db.session.delete(maquinaria)
+        recalcular_por_insumos([("Maquinaria", maquinaria.id)])
+        incrementar_version(RECURSO_CATALOGO, maquinaria.user_id)
         db.session.commit()
         return "", 204
 
@@ -218,9 +289,37 @@ def maquinaria_detail(maquinaria_id: int):
     if "rendimiento_horario" in payload:
         maquinaria.rendimiento_horario = decimal_field(payload["rendimiento_horario"])
     maquinaria.actualizar_costo_posesion()
+    recalcular_por_insumos([("Maquinaria", maquinaria.id)])
+    incrementar_version(RECURSO_CATALOGO, maquinaria.user_id)
     db.session.commit()
     return jsonify(maquinaria.to_dict())
 
+@bp.route("/buscar", methods=["GET"])
+@trial_required
+@con_etag(RECURSO_CATALOGO, RECURSO_MATRIZ)
+def buscar_catalogos():
+    consulta = request.args.get("q", "").strip()
+    if not consulta:
+        return jsonify({"error": "Falta el parámetro q"}), 400
+    tipos = [t.strip() for t in request.args.get("tipos", "").split(",") if t.strip()] or None
+    if tipos and any(t not in ORIGENES for t in tipos):
+        return jsonify({"error": f"'tipos' debe contener solo {list(ORIGENES)}"}), 400
+    try:
+        limite = min(int(request.args.get("limit", LIMITE_BUSQUEDA)), MAX_LIMITE_BUSQUEDA)
+    except ValueError:
+        return jsonify({"error": "limit debe ser un entero"}), 400
+    return jsonify(buscar_con_tiempo(consulta, session.get("user_id"), tipos, max(limite, 1)))
+
+@bp.route("/catalogos/dependencias/<tipo>/<int:insumo_id>", methods=["GET"])
+@trial_required
+def dependencias_insumo(tipo: str, insumo_id: int):
+    modelo = MODELOS_INSUMO.get(tipo)
+    if modelo is None:
+        return jsonify({"error": "Tipo de insumo inválido"}), 400
+    user_id = session.get("user_id")
+    modelo.query.filter(modelo.id == insumo_id, (modelo.user_id == user_id) | (modelo.user_id == None)).first_or_404()
+    return jsonify(dependencias_de_insumo(tipo, insumo_id, user_id))
+
 @bp.route("/catalogos/sugerir_precio_mercado", methods=["POST"])
 @trial_required
 def sugerir_precio_mercado():
@@ -235,29 +334,17 @@ def sugerir_precio_mercado():
         return jsonify({"error": "Falta el nombre del insumo"}), 400
 
     try:
-        # 1. Intentar encontrar coincidencia exacta en el catálogo
-        material = Material.query.filter(
-            db.func.lower(Material.nombre) == db.func.lower(nombre)
-        ).first()
-
-        if material and material.precio_unitario > 0:
-            return jsonify({
-                "precio_sugerido": float(material.precio_unitario),
-                "fuente": "catalogo_real"
-            }), 200
-
-        # 2. Intentar búsqueda difusa por nombre
-        from sqlalchemy import func
-        # Buscar por nombre similar (palabras clave)
-        similar_materials = Material.query.filter(
-            func.lower(Material.nombre).contains(func.lower(nombre.split()[0]) if nombre.split() else "")
-        ).limit(5).all()
-
-        for mat in similar_materials:
+        # 1. y 2. Buscar en el catálogo (índice FTS, sin acentos): primero la coincidencia
+        # exacta y si no, el material más parecido que tenga precio.
+        encontrados = buscar(nombre, session.get("user_id"), tipos=("Material",), limite=5, max_candidatos=None)
+        materiales = {m.id: m for m in Material.query.filter(Material.id.in_([r["id"] for r in encontrados]))}
+        candidatos = [materiales[r["id"]] for r in encontrados if r["id"] in materiales]
+        buscado = normalizar(nombre)
+        for mat in sorted(candidatos, key=lambda m: normalizar(m.nombre) != buscado):
             if mat.precio_unitario > 0:
                 return jsonify({
                     "precio_sugerido": float(mat.precio_unitario),
-                    "fuente": "catalogo_similar"
+                    "fuente": "catalogo_real" if normalizar(mat.nombre) == buscado else "catalogo_similar"
                 }), 200
 
         # 3. Usar tabla simulada de precios comunes
@@ -308,78 +395,87 @@ def sugerir_precio_mercado():
 
 
 @bp.route("/catalogos/actualizar_precios_masivo", methods=["POST"])
+@reintentable
 @trial_required
 def actualizar_precios_masivo():
-    updates = request.get_json(force=True)
-    if not isinstance(updates, list):
-        return jsonify({"error": "El payload debe ser una lista"}), 400
-
     try:
-        for item in updates:
-            insumo_id = item.get("insumo_id")
-            tipo = item.get("tipo")
-            nuevo_precio = decimal_field(item.get("nuevo_precio"))
-
-            if not all([insumo_id, tipo, item.get("nuevo_precio") is not None]):
-                continue
-
-            if tipo == "Material":
-                insumo = Material.query.get(insumo_id)
-                if insumo: insumo.precio_unitario = nuevo_precio
-            elif tipo == "ManoObra":
-                insumo = ManoObra.query.get(insumo_id)
-                if insumo:
-                    insumo.salario_base = nuevo_precio
-                    insumo.refresh_fasar()
-            elif tipo == "Equipo":
-                insumo = Equipo.query.get(insumo_id)
-                if insumo: insumo.costo_hora_maq = nuevo_precio
-            elif tipo == "Maquinaria":
-                insumo = Maquinaria.query.get(insumo_id)
-                if insumo:
-                    insumo.costo_adquisicion = nuevo_precio
-                    insumo.actualizar_costo_posesion()
+        reporte = actualizar_precios(request.get_json(force=True), session.get("user_id"))
+    except ErrorPrecios as e:
+        return jsonify({"error": str(e)}), 400
+    db.session.commit()
+    return jsonify({"mensaje": f"{reporte['actualizados']} precios actualizados", **reporte}), 200
 
-        db.session.commit()
-        return jsonify({"mensaje": "Precios actualizados"}), 200
-    except Exception as e:
+@bp.route("/catalogos/historial/<tipo>/<int:insumo_id>", methods=["GET"])
+@trial_required
+@con_etag(RECURSO_CATALOGO)
+def historial_precio_insumo(tipo: str, insumo_id: int):
+    modelo = MODELOS.get(tipo)
+    if modelo is None:
+        return jsonify({"error": f"tipo debe ser uno de: {', '.join(MODELOS)}"}), 400
+    user_id = session.get("user_id")
+    insumo = modelo.query.filter(modelo.id == insumo_id, (modelo.user_id == user_id) | (modelo.user_id == None)).first_or_404()
+    return jsonify(deriva_de_precio(tipo, insumo))
+
+@bp.route("/catalogos/importar", methods=["POST"])
+@trial_required
+def importar_catalogo_archivo():
+    archivo = request.files.get("archivo")
+    if archivo is None or not archivo.filename:
+        return jsonify({"error": "Falta el archivo (campo 'archivo')"}), 400
+    tipo = request.form.get("tipo") or request.args.get("tipo") or "Material"
+    try:
+        reporte = importar_catalogo(archivo.stream, archivo.filename, tipo, session.get("user_id"))
+    except ErrorImportacion as e:
         db.session.rollback()
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": str(e)}), 400
+    return jsonify(reporte), 400 if reporte["error"] else 200
+
+# --- Distribuciones de precio (rangos cotizados) ---
+@bp.route("/catalogos/distribuciones", methods=["GET", "PUT"])
+@reintentable
+@trial_required
+def distribuciones_precio():
+    user_id = session.get("user_id")
+    if request.method == "GET":
+        distribuciones = DistribucionPrecio.query.filter_by(user_id=user_id).order_by(DistribucionPrecio.tipo_insumo, DistribucionPrecio.id_insumo).all()
+        return jsonify([d.to_dict() for d in distribuciones])
+
+    items = request.get_json(force=True)
+    if not isinstance(items, list):
+        return jsonify({"error": "El payload debe ser una lista"}), 400
+    for item in items:
+        error = validar_distribucion(item)
+        if error:
+            return jsonify({"error": error, "item": item}), 400
+    guardadas = [guardar_distribucion(user_id, item, fuente="manual") for item in items]
+    db.session.commit()
+    return jsonify([d.to_dict() for d in guardadas])
 
 # --- Rutas de FASAR por Usuario ---
 @bp.route("/fasar", methods=["GET"])
 @trial_required
+@con_etag(RECURSO_FASAR)
 def get_user_fasar():
     user_id = session.get("user_id")
-    config = ConstantesFASAR.get_for_user(user_id)
-    return jsonify(config.to_dict())
+    return jsonify(obtener_constantes(user_id).to_dict())
 
 @bp.route("/fasar", methods=["POST"])
+@reintentable
 @trial_required
 def update_user_fasar():
     user_id = session.get("user_id")
     data = request.get_json(force=True)
     config = ConstantesFASAR.get_for_user(user_id)
     
-    fields = [
-        'valor_uma', 'salario_minimo_general', 'dias_del_anio', 
-        'dias_aguinaldo_minimos', 'prima_vacacional_porcentaje',
-        'dias_festivos_obligatorios', 'dias_festivos_costumbre',
-        'dias_mal_tiempo', 'dias_riesgo_trabajo_promedio',
-        'dias_permisos_sindicales', 'prima_riesgo_trabajo_patronal',
-        'impuesto_sobre_nomina'
-    ]
-    
-    for field in fields:
+    for field in CAMPOS_CONSTANTES:
         if field in data:
             setattr(config, field, Decimal(str(data[field])))
-            
-    db.session.commit()
-    
-    # Recalcular FASAR para los trabajadores de ESTE usuario
-    trabajadores = ManoObra.query.filter_by(user_id=user_id).all()
-    for t in trabajadores:
-        t.refresh_fasar()
+    incrementar_version(RECURSO_FASAR, user_id)
+
+    # Recalcular FASAR para los trabajadores de ESTE usuario; todo se guarda en un solo commit
+    fasar = recalcular_fasar_usuario(user_id)
+    recalculo = recalcular_proyectos_usuario(user_id)
+    incrementar_version(RECURSO_CATALOGO, user_id)
     db.session.commit()
     
-    return jsonify({"message": "FASAR actualizado correctamente", "config": config.to_dict()})
+    return jsonify({"message": "FASAR actualizado correctamente", "config": config.to_dict(), "fasar": fasar, "recalculo": recalculo})
@@ -1,36 +1,71 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, session
+from backend.base_datos import reintentable
 from backend.routes.auth import trial_required
-from backend.models import Concepto, MatrizInsumo
+from backend.routes.etag import con_etag
+from backend.models import Concepto, MatrizInsumo, DetallePresupuesto
 from backend.extensions import db
-from backend.services.calculation_service import decimal_field, calcular_precio_unitario, normalizar_factores
+from backend.services.calculation_service import decimal_field, calcular_precio_unitario, calcular_precio_unitario_lote, en_bloques, normalizar_factores, actualizar_plan_concepto, validar_matriz, ARITMETICAS, MODELOS_INSUMO
+from backend.services.cache_pu_service import calcular_precio_unitario_cacheado
+from backend.services.exportacion_service import ErrorExportacion, filas_conceptos, formato_pedido, respuesta_exportacion
+from backend.services.historial_service import ErrorHistorial, fecha_pedida
+from backend.services.listado_service import ErrorListado, consulta_filas, listar_catalogo, serializar_filas
+from backend.services.versiones_service import RECURSO_MATRIZ, incrementar_version
 
 bp = Blueprint('conceptos', __name__, url_prefix='/api')
 
 @bp.route("/conceptos", methods=["GET", "POST"])
+@reintentable
 @trial_required
+@con_etag(RECURSO_MATRIZ)
 def conceptos_collection():
+    user_id = session.get("user_id")
     if request.method == "GET":
-        conceptos = Concepto.query.order_by(Concepto.clave).all()
-        return jsonify([concepto.to_dict() for concepto in conceptos])
+        try:
+            return jsonify(listar_catalogo(Concepto, user_id, request.args))
+        except ErrorListado as e:
+            return jsonify({"error": str(e)}), 400
 
     payload = request.get_json(force=True)
     concepto = Concepto(
+        user_id=user_id,
         clave=payload["clave"],
         descripcion=payload["descripcion"],
         unidad_concepto=payload["unidad_concepto"],
     )
     db.session.add(concepto)
+    incrementar_version(RECURSO_MATRIZ, user_id)
     db.session.commit()
     return jsonify(concepto.to_dict()), 201
 
+@bp.route("/conceptos/exportar", methods=["GET"])
+@trial_required
+def conceptos_exportar():
+    try:
+        formato, comprimir = formato_pedido(request.args)
+    except ErrorExportacion as e:
+        return jsonify({"error": str(e)}), 400
+    filas, columnas = filas_conceptos(session.get("user_id"), formato)
+    return respuesta_exportacion(filas, columnas, "conceptos", formato, comprimir)
+
 @bp.route("/conceptos/<int:concepto_id>", methods=["GET", "PUT", "DELETE"])
+@reintentable
 @trial_required
+@con_etag(RECURSO_MATRIZ)
 def concepto_detail(concepto_id: int):
-    concepto = Concepto.query.get_or_404(concepto_id)
+    user_id = session.get("user_id")
+    concepto = Concepto.query.filter(Concepto.id == concepto_id, (Concepto.user_id == user_id) | (Concepto.user_id == None)).first_or_404()
     if request.method == "GET":
         return jsonify(concepto.to_dict())
     if request.method == "DELETE":
+        # Con foreign_keys activo la base rechaza borrar un concepto presupuestado
+        usos = db.session.query(DetallePresupuesto.id).filter(DetallePresupuesto.concepto_id == concepto.id).count()
+        if usos:
+            return jsonify({
+                "error": f"El concepto se usa en {usos} renglones de presupuesto; quítalo de los presupuestos antes de borrarlo",
+                "detalles": usos,
+            }), 409
         db.session.delete(concepto)
+        incrementar_version(RECURSO_MATRIZ, concepto.user_id)
         db.session.commit()
         return "", 204
 
@@ -38,21 +73,34 @@ def concepto_detail(concepto_id: int):
     concepto.clave = payload.get("clave", concepto.clave)
     concepto.descripcion = payload.get("descripcion", concepto.descripcion)
     concepto.unidad_concepto = payload.get("unidad_concepto", concepto.unidad_concepto)
+    incrementar_version(RECURSO_MATRIZ, concepto.user_id)
     db.session.commit()
     return jsonify(concepto.to_dict())
 
 @bp.route("/conceptos/<int:concepto_id>/matriz", methods=["GET"])
+@con_etag(RECURSO_MATRIZ)
 def concepto_matriz(concepto_id: int):
-    Concepto.query.get_or_404(concepto_id)
-    registros = MatrizInsumo.query.filter_by(concepto_id=concepto_id).all()
-    return jsonify([registro.to_dict() for registro in registros])
+    user_id = session.get("user_id")
+    Concepto.query.filter(Concepto.id == concepto_id, (Concepto.user_id == user_id) | (Concepto.user_id == None)).first_or_404()
+    consulta = consulta_filas(MatrizInsumo).filter(MatrizInsumo.concepto_id == concepto_id).order_by(MatrizInsumo.id)
+    return jsonify(serializar_filas(MatrizInsumo, consulta))
 
 @bp.route("/matriz", methods=["POST"])
+@reintentable
 @trial_required
 def matriz_create():
+    user_id = session.get("user_id")
     payload = request.get_json(force=True)
+    concepto = Concepto.query.filter(Concepto.id == payload["concepto"], (Concepto.user_id == user_id) | (Concepto.user_id == None)).first_or_404()
+    # El PU memoizado solo depende de las versiones del dueño del concepto y globales:
+    # la matriz no puede apuntar a insumos de otro catálogo.
+    modelo = MODELOS_INSUMO.get(payload["tipo_insumo"])
+    if modelo is not None and payload["id_insumo"]:
+        insumo = modelo.query.filter(modelo.id == payload["id_insumo"], (modelo.user_id == concepto.user_id) | (modelo.user_id == None)).first()
+        if insumo is None:
+            return jsonify({"error": "id_insumo debe ser un insumo del dueño del concepto o del catálogo global"}), 400
     registro = MatrizInsumo(
-        concepto_id=payload["concepto"],
+        concepto_id=concepto.id,
         tipo_insumo=payload["tipo_insumo"],
         id_insumo=payload["id_insumo"],
         cantidad=decimal_field(payload["cantidad"]),
@@ -64,15 +112,25 @@ def matriz_create():
         unidad_custom=payload.get("unidad_custom"),
     )
     db.session.add(registro)
+    incrementar_version(RECURSO_MATRIZ, concepto.user_id)
+    actualizar_plan_concepto(registro.concepto_id)
     db.session.commit()
     return jsonify(registro.to_dict()), 201
 
 @bp.route("/matriz/<int:registro_id>", methods=["PUT", "DELETE"])
+@reintentable
 @trial_required
 def matriz_update(registro_id: int):
-    registro = MatrizInsumo.query.get_or_404(registro_id)
+    user_id = session.get("user_id")
+    registro = (
+        MatrizInsumo.query.join(Concepto)
+        .filter(MatrizInsumo.id == registro_id, (Concepto.user_id == user_id) | (Concepto.user_id == None))
+        .first_or_404()
+    )
+    incrementar_version(RECURSO_MATRIZ, registro.concepto.user_id)
     if request.method == "DELETE":
         db.session.delete(registro)
+        actualizar_plan_concepto(registro.concepto_id)
         db.session.commit()
         return "", 204
     payload = request.get_json(force=True)
@@ -91,6 +149,7 @@ def matriz_update(registro_id: int):
     if "unidad_custom" in payload:
         registro.unidad_custom = payload["unidad_custom"]
 
+    actualizar_plan_concepto(registro.concepto_id)
     db.session.commit()
     return jsonify(registro.to_dict())
 
@@ -101,5 +160,67 @@ def calcular_pu_endpoint():
     concepto_id = payload.get("concepto_id")
     matriz = payload.get("matriz")
     factores = normalizar_factores(payload.get("factores"))
-    resultado = calcular_precio_unitario(concepto_id=concepto_id, matriz=matriz, factores=factores)
+    if matriz is not None:
+        error = validar_matriz(matriz)
+        if error:
+            return jsonify({"error": error}), 400
+    aritmetica = payload.get("aritmetica", "decimal")
+    if aritmetica not in ARITMETICAS:
+        return jsonify({"error": f"'aritmetica' debe ser una de {list(ARITMETICAS)}"}), 400
+    try:
+        fecha = fecha_pedida(payload.get("fecha"))
+    except ErrorHistorial as e:
+        return jsonify({"error": str(e)}), 400
+    user_id = session.get("user_id")
+    if matriz is None and concepto_id:
+        try:
+            concepto_id = int(concepto_id)
+        except (TypeError, ValueError):
+            return jsonify({"error": "concepto_id debe ser numérico"}), 400
+        Concepto.query.filter(Concepto.id == concepto_id, (Concepto.user_id == user_id) | (Concepto.user_id == None)).first_or_404()
+    if matriz is None and concepto_id and aritmetica == "decimal" and fecha is None:
+        resultado = calcular_precio_unitario_cacheado(concepto_id, factores, user_id)
+    else:
+        resultado = calcular_precio_unitario(concepto_id=concepto_id, matriz=matriz, factores=factores,
+                                             aritmetica=aritmetica, fecha=fecha, user_id=user_id)
     return jsonify(resultado)
+
+@bp.route("/conceptos/calcular_pu_lote", methods=["POST"])
+@trial_required
+def calcular_pu_lote_endpoint():
+    payload = request.get_json(force=True) or {}
+    conceptos = payload.get("conceptos") or []
+    matrices = payload.get("matrices") or []
+    if not isinstance(conceptos, list) or not isinstance(matrices, list):
+        return jsonify({"error": "'conceptos' y 'matrices' deben ser listas"}), 400
+    try:
+        concepto_ids = [int(cid) for cid in conceptos]
+    except (TypeError, ValueError):
+        return jsonify({"error": "'conceptos' debe contener ids numéricos"}), 400
+    for indice, matriz in enumerate(matrices):
+        error = validar_matriz(matriz, f"matrices[{indice}]")
+        if error:
+            return jsonify({"error": error}), 400
+
+    aritmetica = payload.get("aritmetica", "decimal")
+    if aritmetica not in ARITMETICAS:
+        return jsonify({"error": f"'aritmetica' debe ser una de {list(ARITMETICAS)}"}), 400
+
+    try:
+        fecha = fecha_pedida(payload.get("fecha"))
+    except ErrorHistorial as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Solo conceptos propios o globales
+    user_id = session.get("user_id")
+    visibles = set()
+    for bloque in en_bloques(sorted(set(concepto_ids))):
+        visibles.update(cid for (cid,) in db.session.query(Concepto.id).filter(
+            Concepto.id.in_(bloque), (Concepto.user_id == user_id) | (Concepto.user_id == None)))
+    no_encontrados = sorted(set(concepto_ids) - visibles)
+    concepto_ids = [cid for cid in concepto_ids if cid in visibles]
+
+    factores = normalizar_factores(payload.get("factores"))
+    resultados = calcular_precio_unitario_lote(concepto_ids=concepto_ids, matrices=matrices, factores=factores,
+                                               aritmetica=aritmetica, fecha=fecha, user_id=user_id)
+    return jsonify({"resultados": resultados, "total": len(resultados), "no_encontrados": no_encontrados})
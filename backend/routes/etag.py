@@ -0,0 +1,38 @@
+import hashlib
+from functools import wraps
+from flask import request, session, make_response
+from backend.services.versiones_service import ambito, huella_versiones
+
+# GET condicional. El ETag de una respuesta depende solo del usuario, de la URL (con su
+# query string) y de los contadores de versión de los recursos que la componen, así que
+# se calcula con una consulta a versiones_recurso; si coincide con If-None-Match se
+# responde 304 sin ejecutar la vista. Toda escritura que cambia esos datos incrementa
+# la versión en su misma transacción (ver versiones_service).
+
+
+def etag_de(user_id, recursos) -> str:
+    huella = huella_versiones(user_id, recursos)
+    contenido = f"{ambito(user_id)}|{request.full_path}|{huella}"
+    return hashlib.sha256(contenido.encode()).hexdigest()[:32]
+
+
+def con_etag(*recursos: str):
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            if request.method != "GET":
+                return vista(*args, **kwargs)
+
+            etag = etag_de(session.get("user_id"), recursos)
+            if request.if_none_match.contains(etag):
+                respuesta = make_response("", 304)
+            else:
+                respuesta = make_response(vista(*args, **kwargs))
+                if respuesta.status_code != 200:
+                    return respuesta
+            respuesta.set_etag(etag)
+            respuesta.headers["Cache-Control"] = "private, no-cache"
+            respuesta.vary.add("Cookie")
+            return respuesta
+        return envoltura
+    return decorador
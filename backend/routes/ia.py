@@ -10,6 +10,8 @@ from backend.services.gemini_service import (
 )
 from backend.services.clarification_service import generar_preguntas_clarificadoras
 from backend.models import Concepto
+from backend.extensions import db
+from backend.services.montecarlo_service import guardar_distribucion, validar_distribucion
 
 bp = Blueprint('ia', __name__, url_prefix='/api/ia')
 
@@ -94,6 +96,10 @@ def cotizar_material():
 def cotizar_multiples_materiales():
     data = request.get_json()
     materiales = data.get("materiales", [])
+    # Opcional: [{"nombre", "tipo_insumo", "id_insumo"}] para guardar los rangos por insumo
+    insumos = data.get("insumos") or []
+    if not materiales and insumos:
+        materiales = [i.get("nombre") for i in insumos if i.get("nombre")]
 
     if not materiales:
         return jsonify({"error": "Falta la lista de materiales"}), 400
@@ -101,7 +107,31 @@ def cotizar_multiples_materiales():
     # Usar el servicio optimizado de una sola llamada
     resultados = cotizar_multiples_con_gemini(materiales)
 
-    return jsonify({"resultados": resultados}), 200
+    guardadas = _guardar_rangos_cotizados(insumos, resultados)
+    return jsonify({"resultados": resultados, "distribuciones_guardadas": guardadas}), 200
+
+def _guardar_rangos_cotizados(insumos, resultados) -> int:
+    """Guarda rango_min/precio_promedio/rango_max como distribución de precio del insumo."""
+    por_nombre = {(r.get("material") or "").lower(): r for r in resultados if r.get("referencia")}
+    guardadas = 0
+    for insumo in insumos:
+        resultado = por_nombre.get((insumo.get("nombre") or "").lower())
+        if not resultado:
+            continue
+        item = {
+            "tipo_insumo": insumo.get("tipo_insumo", "Material"),
+            "id_insumo": insumo.get("id_insumo"),
+            "precio_min": resultado.get("precio1"),
+            "precio_promedio": resultado.get("precio2"),
+            "precio_max": resultado.get("precio3"),
+        }
+        if validar_distribucion(item):
+            continue
+        guardar_distribucion(session.get("user_id"), item, fuente="gemini")
+        guardadas += 1
+    if guardadas:
+        db.session.commit()
+    return guardadas
 
 @bp.route("/explicar_sugerencia", methods=["GET"])
 @trial_required
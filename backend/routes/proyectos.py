@@ -1,14 +1,28 @@
 from flask import Blueprint, request, jsonify, session
+from backend.base_datos import reintentable
 from backend.routes.auth import trial_required
+from backend.routes.etag import con_etag
 from datetime import date
-from backend.models import Proyecto, Partida, DetallePresupuesto
+from backend.models import Proyecto, Partida, DetallePresupuesto, Concepto
 from backend.extensions import db
-from backend.services.calculation_service import decimal_field, obtener_factores_de_proyecto, calcular_precio_unitario, aplicar_configuracion_proyecto
+from backend.services.calculation_service import decimal_field, obtener_factores_de_proyecto, aplicar_configuracion_proyecto, ARITMETICAS
+from backend.services.cache_pu_service import calcular_precio_unitario_cacheado
+from backend.services.escenarios_service import simular_escenarios, validar_escenarios
+from backend.services.explosion_service import explosion_insumos
+from backend.services.exportacion_service import ErrorExportacion, filas_presupuesto, formato_pedido, respuesta_exportacion
+from backend.services.historial_service import ErrorHistorial, fecha_pedida
+from backend.services.listado_service import consulta_filas, serializar_filas
+from backend.services.totales_service import actualizar_totales_partidas, arbol_presupuesto, arbol_totales, cotizacion_a_fecha
+from backend.services.montecarlo_service import simular_montecarlo, MAX_ITERACIONES
+from backend.services.recalculo_service import recalcular_proyecto, recalcular_proyectos_usuario
+from backend.services.versiones_service import RECURSO_PROYECTOS, RECURSOS_PROYECTOS, incrementar_version
 
 bp = Blueprint('proyectos', __name__, url_prefix='/api')
 
 @bp.route("/proyectos", methods=["GET", "POST"])
+@reintentable
 @trial_required
+@con_etag(*RECURSOS_PROYECTOS)
 def proyectos_collection():
     user_id = session.get("user_id")
     if request.method == "GET":
@@ -25,11 +39,14 @@ def proyectos_collection():
     )
     aplicar_configuracion_proyecto(proyecto, payload)
     db.session.add(proyecto)
+    incrementar_version(RECURSO_PROYECTOS, user_id)
     db.session.commit()
     return jsonify(proyecto.to_dict()), 201
 
 @bp.route("/proyectos/<int:proyecto_id>", methods=["GET", "PUT", "DELETE"])
+@reintentable
 @trial_required
+@con_etag(*RECURSOS_PROYECTOS)
 def proyecto_detail(proyecto_id: int):
     user_id = session.get("user_id")
     proyecto = Proyecto.query.filter_by(id=proyecto_id, user_id=user_id).first_or_404()
@@ -37,6 +54,7 @@ def proyecto_detail(proyecto_id: int):
         return jsonify(proyecto.to_dict())
     if request.method == "DELETE":
         db.session.delete(proyecto)
+        incrementar_version(RECURSO_PROYECTOS, user_id)
         db.session.commit()
         return "", 204
 
@@ -47,43 +65,167 @@ def proyecto_detail(proyecto_id: int):
     if "descripcion" in payload:
         proyecto.descripcion = payload["descripcion"]
     aplicar_configuracion_proyecto(proyecto, payload)
+    recalcular_proyecto(proyecto)
+    incrementar_version(RECURSO_PROYECTOS, user_id)
     db.session.commit()
     return jsonify(proyecto.to_dict())
 
+@bp.route("/proyectos/<int:proyecto_id>/recalcular", methods=["POST"])
+@reintentable
+@trial_required
+def proyecto_recalcular(proyecto_id: int):
+    user_id = session.get("user_id")
+    proyecto = Proyecto.query.filter_by(id=proyecto_id, user_id=user_id).first_or_404()
+    aritmetica = (request.get_json(silent=True) or {}).get("aritmetica", "decimal")
+    if aritmetica not in ARITMETICAS:
+        return jsonify({"error": f"'aritmetica' debe ser una de {list(ARITMETICAS)}"}), 400
+    reporte = recalcular_proyecto(proyecto, aritmetica)
+    incrementar_version(RECURSO_PROYECTOS, user_id)
+    db.session.commit()
+    return jsonify(reporte)
+
+@bp.route("/proyectos/<int:proyecto_id>/escenarios", methods=["POST"])
+@trial_required
+def proyecto_escenarios(proyecto_id: int):
+    user_id = session.get("user_id")
+    proyecto = Proyecto.query.filter_by(id=proyecto_id, user_id=user_id).first_or_404()
+    payload = request.get_json(force=True) or {}
+    escenarios = payload.get("escenarios")
+    error = validar_escenarios(escenarios)
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify(simular_escenarios(proyecto, escenarios))
+
+@bp.route("/proyectos/<int:proyecto_id>/montecarlo", methods=["POST"])
+@trial_required
+def proyecto_montecarlo(proyecto_id: int):
+    user_id = session.get("user_id")
+    proyecto = Proyecto.query.filter_by(id=proyecto_id, user_id=user_id).first_or_404()
+    payload = request.get_json(silent=True) or {}
+    try:
+        iteraciones = int(payload.get("iteraciones", 10000))
+        semilla = int(payload["semilla"]) if payload.get("semilla") is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "'iteraciones' y 'semilla' deben ser enteros"}), 400
+    if not 1 <= iteraciones <= MAX_ITERACIONES:
+        return jsonify({"error": f"'iteraciones' debe estar entre 1 y {MAX_ITERACIONES}"}), 400
+    return jsonify(simular_montecarlo(proyecto, user_id, iteraciones=iteraciones, semilla=semilla))
+
+@bp.route("/proyectos/<int:proyecto_id>/totales", methods=["GET"])
+@trial_required
+@con_etag(*RECURSOS_PROYECTOS)
+def proyecto_totales(proyecto_id: int):
+    user_id = session.get("user_id")
+    proyecto = Proyecto.query.filter_by(id=proyecto_id, user_id=user_id).first_or_404()
+    return jsonify(arbol_totales(proyecto))
+
+@bp.route("/proyectos/<int:proyecto_id>/arbol", methods=["GET"])
+@trial_required
+@con_etag(*RECURSOS_PROYECTOS)
+def proyecto_arbol(proyecto_id: int):
+    arbol = arbol_presupuesto(proyecto_id, session.get("user_id"))
+    if arbol is None:
+        return jsonify({"error": "Proyecto no encontrado"}), 404
+    return jsonify(arbol)
+
+@bp.route("/proyectos/<int:proyecto_id>/cotizacion", methods=["GET"])
+@trial_required
+@con_etag(*RECURSOS_PROYECTOS)
+def proyecto_cotizacion_a_fecha(proyecto_id: int):
+    proyecto = Proyecto.query.filter_by(id=proyecto_id, user_id=session.get("user_id")).first_or_404()
+    try:
+        fecha = fecha_pedida(request.args.get("fecha"))
+    except ErrorHistorial as e:
+        return jsonify({"error": str(e)}), 400
+    if fecha is None:
+        return jsonify({"error": "Falta el parámetro fecha"}), 400
+    return jsonify(cotizacion_a_fecha(proyecto, fecha))
+
+@bp.route("/proyectos/<int:proyecto_id>/explosion_insumos", methods=["GET"])
+@trial_required
+@con_etag(*RECURSOS_PROYECTOS)
+def proyecto_explosion_insumos(proyecto_id: int):
+    user_id = session.get("user_id")
+    proyecto = Proyecto.query.filter_by(id=proyecto_id, user_id=user_id).first_or_404()
+    return jsonify(explosion_insumos(proyecto))
+
+@bp.route("/proyectos/<int:proyecto_id>/exportar", methods=["GET"])
+@trial_required
+def proyecto_exportar(proyecto_id: int):
+    user_id = session.get("user_id")
+    proyecto = Proyecto.query.filter_by(id=proyecto_id, user_id=user_id).first_or_404()
+    try:
+        formato, comprimir = formato_pedido(request.args)
+    except ErrorExportacion as e:
+        return jsonify({"error": str(e)}), 400
+    filas, columnas = filas_presupuesto(proyecto)
+    return respuesta_exportacion(filas, columnas, f"presupuesto_{proyecto.id}", formato, comprimir)
+
+@bp.route("/proyectos/recalcular", methods=["POST"])
+@reintentable
+@trial_required
+def proyectos_recalcular():
+    user_id = session.get("user_id")
+    aritmetica = (request.get_json(silent=True) or {}).get("aritmetica", "decimal")
+    if aritmetica not in ARITMETICAS:
+        return jsonify({"error": f"'aritmetica' debe ser una de {list(ARITMETICAS)}"}), 400
+    reporte = recalcular_proyectos_usuario(user_id, aritmetica)
+    incrementar_version(RECURSO_PROYECTOS, user_id)
+    db.session.commit()
+    return jsonify(reporte)
+
 @bp.route("/proyectos/<int:proyecto_id>/partidas", methods=["GET"])
 @trial_required
+@con_etag(*RECURSOS_PROYECTOS)
 def partidas_por_proyecto(proyecto_id: int):
     user_id = session.get("user_id")
     proyecto = Proyecto.query.filter_by(id=proyecto_id, user_id=user_id).first_or_404()
-    partidas = Partida.query.filter_by(proyecto_id=proyecto.id).all()
-    return jsonify([p.to_dict() for p in partidas])
+    consulta = consulta_filas(Partida).filter(Partida.proyecto_id == proyecto.id).order_by(Partida.id)
+    return jsonify(serializar_filas(Partida, consulta))
 
 @bp.route("/partidas", methods=["POST"])
+@reintentable
 @trial_required
 def partidas_create():
     payload = request.get_json(force=True)
+    proyecto = Proyecto.query.filter_by(id=payload["proyecto"], user_id=session.get("user_id")).first_or_404()
     partida = Partida(
-        proyecto_id=payload["proyecto"],
+        proyecto_id=proyecto.id,
         nombre_partida=payload["nombre_partida"],
     )
     db.session.add(partida)
+    incrementar_version(RECURSO_PROYECTOS, proyecto.user_id)
     db.session.commit()
     return jsonify(partida.to_dict()), 201
 
 @bp.route("/partidas/<int:partida_id>/detalles", methods=["GET"])
+@con_etag(*RECURSOS_PROYECTOS)
 def detalles_por_partida(partida_id: int):
-    detalles = DetallePresupuesto.query.filter_by(partida_id=partida_id).all()
-    return jsonify([d.to_dict() for d in detalles])
+    user_id = session.get("user_id")
+    consulta = (
+        consulta_filas(DetallePresupuesto)
+        .join(Partida, DetallePresupuesto.partida_id == Partida.id).join(Proyecto, Partida.proyecto_id == Proyecto.id)
+        .filter(DetallePresupuesto.partida_id == partida_id, Proyecto.user_id == user_id)
+        .order_by(DetallePresupuesto.id)
+    )
+    return jsonify(serializar_filas(DetallePresupuesto, consulta))
 
 @bp.route("/detalles-presupuesto", methods=["POST"])
+@reintentable
 @trial_required
 def detalle_create():
+    user_id = session.get("user_id")
     payload = request.get_json(force=True)
-    concepto_id = payload["concepto"]
-    partida = Partida.query.get_or_404(payload["partida"])
+    partida = (
+        Partida.query.join(Proyecto)
+        .filter(Partida.id == payload["partida"], Proyecto.user_id == user_id)
+        .first_or_404()
+    )
+    concepto = Concepto.query.filter(Concepto.id == payload["concepto"], (Concepto.user_id == user_id) | (Concepto.user_id == None)).first_or_404()
+    concepto_id = concepto.id
 
     factores = obtener_factores_de_proyecto(partida.proyecto)
-    resultado_pu = calcular_precio_unitario(concepto_id=concepto_id, factores=factores)
+    resultado_pu = calcular_precio_unitario_cacheado(concepto_id, factores, user_id)
 
     detalle = DetallePresupuesto(
         partida_id=partida.id,
@@ -93,5 +235,33 @@ def detalle_create():
         costo_directo=decimal_field(resultado_pu["costo_directo"]),
     )
     db.session.add(detalle)
+    actualizar_totales_partidas([partida.id])
+    incrementar_version(RECURSO_PROYECTOS, partida.proyecto.user_id)
     db.session.commit()
     return jsonify(detalle.to_dict()), 201
+
+@bp.route("/detalles-presupuesto/<int:detalle_id>", methods=["PUT", "DELETE"])
+@reintentable
+@trial_required
+def detalle_detail(detalle_id: int):
+    user_id = session.get("user_id")
+    detalle = (
+        DetallePresupuesto.query.join(Partida).join(Proyecto)
+        .filter(DetallePresupuesto.id == detalle_id, Proyecto.user_id == user_id)
+        .first_or_404()
+    )
+    partida_id = detalle.partida_id
+    if request.method == "DELETE":
+        db.session.delete(detalle)
+        actualizar_totales_partidas([partida_id])
+        incrementar_version(RECURSO_PROYECTOS, user_id)
+        db.session.commit()
+        return "", 204
+
+    payload = request.get_json(force=True)
+    if "cantidad_obra" in payload:
+        detalle.cantidad_obra = decimal_field(payload["cantidad_obra"])
+    actualizar_totales_partidas([partida_id])
+    incrementar_version(RECURSO_PROYECTOS, user_id)
+    db.session.commit()
+    return jsonify(detalle.to_dict())
@@ -193,6 +193,7 @@ def _seed_concepto_prueba(
         concepto.unidad_concepto = "m2"
 
     MatrizInsumo.query.filter_by(concepto_id=concepto.id).delete(synchronize_session=False)
+    concepto.plan_costo = None  # se compila al vuelo en el siguiente cálculo
 
     matriz_registros = [
         ("Material", materiales["Cemento gris saco 50kg"].id, Decimal("7.5000"), None, None),
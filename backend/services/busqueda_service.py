@@ -0,0 +1,182 @@
+import re
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import event, text
+from backend.extensions import db
+
+# Búsqueda de texto completo con FTS5 sobre nombres de materiales, equipo y maquinaria,
+# puestos de mano de obra y clave + descripción de conceptos.
+#
+# Una sola tabla virtual para los cinco orígenes; el rowid codifica el origen
+# (id * 8 + código de tipo), así que los triggers borran y reescriben cada fila por
+# rowid sin recorrer el índice. Los de UPDATE solo se disparan si cambia el texto o el
+# dueño. unicode61 con remove_diacritics hace que "albanil" encuentre "albañil" y
+# "cemento" encuentre "CEMENTO". Los triggers se crean junto con las tablas
+# (create_all) y en la migración 8, que además indexa las filas existentes.
+#
+# El dueño también va indexado (columna dueno: "u<id>" o "g" para los globales), así que
+# el filtro por usuario se resuelve en el índice junto con los términos y el corte de
+# MAX_CANDIDATOS se toma sobre las coincidencias del usuario, no las de todos.
+
+TABLA_FTS = "busqueda_fts"
+
+# tipo -> (código en el rowid, tabla, expresión SQL del texto indexado, columnas que la afectan)
+ORIGENES = {
+    "Material": (1, "materiales", "{fila}.nombre", "nombre"),
+    "ManoObra": (2, "mano_obra", "{fila}.puesto", "puesto"),
+    "Equipo": (3, "equipos", "{fila}.nombre", "nombre"),
+    "Maquinaria": (4, "maquinaria", "{fila}.nombre", "nombre"),
+    "Concepto": (5, "conceptos", "{fila}.clave || ' ' || {fila}.descripcion", "clave, descripcion"),
+}
+TIPOS_POR_CODIGO = {codigo: tipo for tipo, (codigo, _, _, _) in ORIGENES.items()}
+_FACTOR_ROWID = 8
+
+LIMITE_BUSQUEDA = 20
+MAX_LIMITE_BUSQUEDA = 200
+# bm25 se calcula para cada coincidencia. Si hay hasta MAX_CANDIDATOS se ordenan todas;
+# con más (términos muy comunes o un prefijo de una letra) solo se ordenan las
+# MAX_CANDIDATOS más recientes (rowid mayor), para que el autocompletado siga cerca de
+# 10 ms en catálogos de 50k filas, y la respuesta lo indica con candidatos_recortados.
+# Ordenar todas cuesta de 25 a 80 ms en esos casos (ver benchmarks/bench_busqueda.py);
+# quien necesita el mejor resultado y no el más rápido pasa max_candidatos=None.
+MAX_CANDIDATOS = 1000
+DUENO_GLOBAL = "g"
+
+
+def _dueno_sql(fila: str) -> str:
+    return f"COALESCE('u' || {fila}.user_id, '{DUENO_GLOBAL}')"
+
+
+def _ddl() -> List[str]:
+    sentencias = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5("
+        "texto, dueno, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    ]
+    for codigo, tabla, expresion, columnas in ORIGENES.values():
+        nuevo = f"(new.id * {_FACTOR_ROWID} + {codigo}, {expresion.format(fila='new')}, {_dueno_sql('new')})"
+        borrar = f"DELETE FROM {TABLA_FTS} WHERE rowid = old.id * {_FACTOR_ROWID} + {codigo};"
+        insertar = f"INSERT INTO {TABLA_FTS} (rowid, texto, dueno) VALUES {nuevo};"
+        sentencias += [
+            f"CREATE TRIGGER IF NOT EXISTS fts_{tabla}_ai AFTER INSERT ON {tabla} BEGIN {insertar} END",
+            f"CREATE TRIGGER IF NOT EXISTS fts_{tabla}_ad AFTER DELETE ON {tabla} BEGIN {borrar} END",
+            f"CREATE TRIGGER IF NOT EXISTS fts_{tabla}_au AFTER UPDATE OF {columnas}, user_id ON {tabla} BEGIN {borrar} {insertar} END",
+        ]
+    return sentencias
+
+
+def crear_indice_busqueda(conn) -> None:
+    """Crea la tabla FTS5 y los triggers que la sincronizan (idempotente)."""
+    for sentencia in _ddl():
+        conn.execute(text(sentencia))
+
+
+def reconstruir_indice_busqueda(conn) -> None:
+    """Vuelve a indexar todas las filas de los catálogos y conceptos."""
+    conn.execute(text(f"DELETE FROM {TABLA_FTS}"))
+    for codigo, tabla, expresion, _ in ORIGENES.values():
+        conn.execute(text(
+            f"INSERT INTO {TABLA_FTS} (rowid, texto, dueno) "
+            f"SELECT id * {_FACTOR_ROWID} + {codigo}, {expresion.format(fila=tabla)}, {_dueno_sql(tabla)} FROM {tabla}"
+        ))
+
+
+@event.listens_for(db.metadata, "after_create")
+def _crear_al_crear_tablas(_metadata, conn, **_kw):
+    if conn.dialect.name == "sqlite":
+        crear_indice_busqueda(conn)
+
+
+@event.listens_for(db.metadata, "after_drop")
+def _borrar_al_borrar_tablas(_metadata, conn, **_kw):
+    if conn.dialect.name == "sqlite":
+        conn.execute(text(f"DROP TABLE IF EXISTS {TABLA_FTS}"))
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas y sin acentos, igual que el tokenizador del índice."""
+    sin_acentos = unicodedata.normalize("NFKD", texto or "")
+    return "".join(c for c in sin_acentos if not unicodedata.combining(c)).lower().strip()
+
+
+def _terminos(consulta: str) -> List[str]:
+    return [t for t in re.split(r"\W+", normalizar(consulta)) if t]
+
+
+def _expresion_match(terminos: List[str], operador: str) -> str:
+    # Cada término entre comillas (sin sintaxis FTS del usuario); solo el último como
+    # prefijo, que es el que se está escribiendo.
+    return f" {operador} ".join([f'"{t}"' for t in terminos[:-1]] + [f'"{terminos[-1]}"*'])
+
+
+def _consultar(expresion: str, user_id: Optional[int], codigos: List[int], limite: int,
+               max_candidatos: Optional[int]) -> Tuple[List[Dict], bool]:
+    # Términos solo sobre el texto y dueño en el mismo MATCH: el usuario y los globales
+    duenos = " OR ".join(f'"{d}"' for d in ([f"u{int(user_id)}"] if user_id else []) + [DUENO_GLOBAL])
+    filtros = f"{TABLA_FTS} MATCH :expresion"
+    if len(codigos) < len(ORIGENES):
+        filtros += f" AND rowid % {_FACTOR_ROWID} IN ({', '.join(str(c) for c in codigos)})"
+    parametros = {"expresion": f"texto : ({expresion}) AND dueno : ({duenos})", "limite": limite}
+
+    # Recorrer las coincidencias por rowid solo usa el índice; ordenar por relevancia lee
+    # cada fila, así que se hace después del corte.
+    corte = None
+    if max_candidatos:
+        # Solo hay corte si existe la coincidencia número max_candidatos + 1
+        corte = db.session.execute(
+            text(f"SELECT rowid FROM {TABLA_FTS} WHERE {filtros} ORDER BY rowid DESC LIMIT 1 OFFSET :offset"),
+            {**parametros, "offset": max_candidatos},
+        ).scalar()
+    if corte is not None:
+        filtros += " AND rowid > :corte"
+        parametros["corte"] = corte
+
+    # bm25 solo sobre el texto: la coincidencia del dueño no cuenta para la relevancia
+    filas = db.session.execute(
+        text(f"SELECT rowid, texto, bm25({TABLA_FTS}, 1.0, 0.0) AS rank FROM {TABLA_FTS} "
+             f"WHERE {filtros} ORDER BY rank LIMIT :limite"),
+        parametros,
+    )
+    resultados = [
+        {
+            "tipo": TIPOS_POR_CODIGO[rowid % _FACTOR_ROWID],
+            "id": rowid // _FACTOR_ROWID,
+            "texto": texto,
+            "rank": rank,
+        }
+        for rowid, texto, rank in filas
+    ]
+    return resultados, corte is not None
+
+
+def _buscar(consulta: str, user_id: Optional[int], tipos: Optional[Iterable[str]], limite: int,
+            max_candidatos: Optional[int]) -> Tuple[List[Dict], bool]:
+    terminos = _terminos(consulta)
+    if not terminos:
+        return [], False
+    codigos = [ORIGENES[tipo][0] for tipo in (tipos or ORIGENES)]
+    resultados, recortados = _consultar(_expresion_match(terminos, "AND"), user_id, codigos, limite, max_candidatos)
+    if not resultados and len(terminos) > 1:
+        resultados, recortados = _consultar(_expresion_match(terminos, "OR"), user_id, codigos, limite, max_candidatos)
+    return resultados, recortados
+
+
+def buscar(consulta: str, user_id: Optional[int], tipos: Optional[Iterable[str]] = None, limite: int = LIMITE_BUSQUEDA,
+           max_candidatos: Optional[int] = MAX_CANDIDATOS) -> List[Dict]:
+    """Resultados ordenados por relevancia (bm25) entre los registros del usuario y los globales.
+
+    Primero exige todos los términos (el último como prefijo); si no hay resultados y hay varios
+    términos, acepta cualquiera de ellos. tipos limita los orígenes (ver ORIGENES). Con más de
+    max_candidatos coincidencias solo se ordenan las más recientes; None las ordena todas.
+    """
+    return _buscar(consulta, user_id, tipos, limite, max_candidatos)[0]
+
+
+def buscar_con_tiempo(consulta: str, user_id: Optional[int], tipos: Optional[Iterable[str]], limite: int) -> Dict:
+    inicio = time.perf_counter()
+    resultados, recortados = _buscar(consulta, user_id, tipos, limite, MAX_CANDIDATOS)
+    return {
+        "resultados": resultados,
+        "candidatos_recortados": recortados,
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2),
+    }
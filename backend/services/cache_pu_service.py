@@ -0,0 +1,100 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Dict, Hashable, Optional
+from backend.config import Config
+from backend.extensions import db
+from backend.models import Concepto
+from backend.services.calculation_service import calcular_precio_unitario, obtener_factor_decimal
+from backend.services.versiones_service import RECURSO_CATALOGO, RECURSO_MATRIZ, huella_versiones
+
+# Memoización de calcular_precio_unitario por concepto guardado.
+#
+# La llave incluye las versiones de catálogo y matriz del dueño del concepto y del
+# ámbito global, leídas de la base en cada consulta; cualquier escritura que las
+# incremente hace que la siguiente consulta falle y recalcule, aun en otros workers.
+# Basta porque un concepto solo referencia insumos de su dueño o compartidos: POST
+# /matriz rechaza los demás.
+
+CLAVES_FACTORES = ("mano_obra", "indirectos", "financiamiento", "utilidad", "iva")
+
+
+def hash_factores(factores: Optional[Dict[str, Dict[str, Decimal]]]) -> str:
+    """Hash de los porcentajes efectivos: factores inactivos y ausentes cuentan como 0."""
+    factores = factores or {}
+    partes = [f"{clave}={obtener_factor_decimal(factores, clave).normalize()}" for clave in CLAVES_FACTORES]
+    return hashlib.sha1("|".join(partes).encode("utf-8")).hexdigest()
+
+
+class CacheLRU:
+    def __init__(self, capacidad: int):
+        self.capacidad = max(int(capacidad), 0)
+        self._datos: "OrderedDict[Hashable, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def obtener(self, llave: Hashable) -> Optional[Dict]:
+        with self._lock:
+            valor = self._datos.get(llave)
+            if valor is None:
+                self.misses += 1
+                return None
+            self._datos.move_to_end(llave)
+            self.hits += 1
+            return dict(valor)
+
+    def guardar(self, llave: Hashable, valor: Dict) -> None:
+        if self.capacidad == 0:
+            return
+        with self._lock:
+            self._datos[llave] = dict(valor)
+            self._datos.move_to_end(llave)
+            while len(self._datos) > self.capacidad:
+                self._datos.popitem(last=False)
+                self.evictions += 1
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._datos.clear()
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._datos),
+                "capacidad": self.capacidad,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+cache_pu = CacheLRU(Config.PU_CACHE_MAX_ENTRADAS)
+
+
+def calcular_precio_unitario_cacheado(
+    concepto_id: int,
+    factores: Optional[Dict[str, Dict[str, Decimal]]] = None,
+    user_id: Optional[int] = None,
+) -> Optional[Dict[str, float]]:
+    """PU de un concepto propio o global del usuario; None si no existe o es de otro usuario."""
+    concepto = db.session.query(Concepto.id, Concepto.user_id).filter(
+        Concepto.id == concepto_id, (Concepto.user_id == user_id) | Concepto.user_id.is_(None)
+    ).first()
+    if concepto is None:
+        return None
+    dueno = concepto.user_id
+    llave = (
+        concepto.id,
+        hash_factores(factores),
+        huella_versiones(dueno, (RECURSO_CATALOGO, RECURSO_MATRIZ)),
+    )
+    resultado = cache_pu.obtener(llave)
+    if resultado is None:
+        resultado = calcular_precio_unitario(concepto_id=concepto.id, factores=factores, user_id=dueno)
+        cache_pu.guardar(llave, resultado)
+    return resultado
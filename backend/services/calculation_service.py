@@ -1,5 +1,8 @@
-from decimal import Decimal
-from typing import Dict, List, Optional
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
 from backend.models import (
     Material,
     ManoObra,
@@ -7,10 +10,22 @@ from backend.models import (
     Maquinaria,
     Concepto,
     MatrizInsumo,
-    ConstantesFASAR,
     Proyecto
 )
 from backend.extensions import db
+from backend.services.catalogo_cache_service import instantanea_catalogo, registros_de
+from backend.services.fasar_service import obtener_constantes
+from backend.services.punto_fijo import sumar_plan_entero, aplicar_factores_entero
+
+# "decimal" es el cálculo de referencia; "entera" usa punto fijo (ver punto_fijo.py).
+ARITMETICAS = ("decimal", "entera")
+
+MODELOS_INSUMO = {
+    "Material": Material,
+    "ManoObra": ManoObra,
+    "Equipo": Equipo,
+    "Maquinaria": Maquinaria,
+}
 
 def decimal_field(value) -> Decimal:
     if value is None:
@@ -22,7 +37,7 @@ def decimal_field(value) -> Decimal:
     return Decimal(str(value))
 
 def calcular_fasar_valor(user_id: int) -> Decimal:
-    constantes = ConstantesFASAR.get_for_user(user_id)
+    constantes = obtener_constantes(user_id)
     dias_pagados = (
         Decimal(constantes.dias_del_anio)
         + Decimal(constantes.dias_aguinaldo_minimos)
@@ -166,40 +181,217 @@ def obtener_factor_decimal(factores: Dict[str, Dict[str, Decimal]], clave: str)
     return Decimal(porcentaje)
 
 
-def calcular_precio_unitario(
-    concepto_id: Optional[int] = None,
-    matriz: Optional[List[Dict]] = None,
-    factores: Optional[Dict[str, Dict[str, Decimal]]] = None,
-) -> Dict[str, float]:
-    registros: List[Dict]
-    if matriz is not None:
-        registros = matriz
-    elif concepto_id:
-        registros = [insumo.to_dict() for insumo in MatrizInsumo.query.filter_by(concepto_id=concepto_id)]
-    else:
-        registros = []
+# --- Planes de costo ---
+# Un plan es la matriz de un concepto ya resuelta: cada renglón queda como
+# (tipo, id_insumo, cantidad, costo_fijo, merma, flete, respaldo). Los renglones con
+# precio_custom llevan su costo unitario ya calculado en costo_fijo; los demás solo
+# guardan los overrides de merma/flete y el costo de respaldo para cuando el insumo ya
+# no existe. Así, costear un concepto es sumar cantidad × costo vigente del insumo,
+# con las mismas reglas y el mismo orden de operaciones que obtener_costo_insumo.
+VERSION_PLAN = 1
+
+
+class PlanCosto:
+    __slots__ = ("renglones", "enteros")
+
+    def __init__(self, renglones: Iterable[Tuple]):
+        self.renglones = tuple(renglones)
+        # Versión en punto fijo, la llena punto_fijo.renglones_enteros la primera vez.
+        self.enteros = None
+
+    def insumos(self) -> Iterable[Tuple[str, int]]:
+        """Insumos del catálogo cuyo precio vigente necesita el plan."""
+        return [(r[0], r[1]) for r in self.renglones if r[3] is None]
+
+    def a_texto(self) -> str:
+        def texto(valor):
+            return None if valor is None else str(valor)
+
+        renglones = [
+            [tipo, insumo_id, str(cantidad), texto(costo_fijo), texto(merma), texto(flete), str(respaldo)]
+            for tipo, insumo_id, cantidad, costo_fijo, merma, flete, respaldo in self.renglones
+        ]
+        return json.dumps({"v": VERSION_PLAN, "renglones": renglones}, separators=(",", ":"))
+
+
+PLAN_VACIO = PlanCosto(())
+
+
+def _decimal_opcional(valor) -> Optional[Decimal]:
+    return None if valor is None else Decimal(valor)
+
+
+@lru_cache(maxsize=4096)
+def plan_desde_texto(texto: str) -> Optional[PlanCosto]:
+    """Reconstruye un plan guardado; None si viene de otra versión del formato."""
+    datos = json.loads(texto)
+    if datos.get("v") != VERSION_PLAN:
+        return None
+    return PlanCosto(
+        (tipo, insumo_id, Decimal(cantidad), _decimal_opcional(costo_fijo), _decimal_opcional(merma),
+         _decimal_opcional(flete), Decimal(respaldo))
+        for tipo, insumo_id, cantidad, costo_fijo, merma, flete, respaldo in datos["renglones"]
+    )
+
+
+# Campos numéricos opcionales de un renglón de matriz en línea.
+CAMPOS_NUMERICOS_RENGLON = ("porcentaje_merma", "precio_flete_unitario", "rendimiento_jornada", "precio_custom", "precio_unitario_temp")
+
+
+def _es_numero(valor) -> bool:
+    if isinstance(valor, bool):
+        return False
+    try:
+        return decimal_field(valor).is_finite()
+    except (InvalidOperation, TypeError, ValueError):
+        return False
 
-    cd_base = Decimal("0")
-    costo_mano_obra = Decimal("0")
-    material_cache: Dict[int, Material] = {}
-    mano_obra_cache: Dict[int, ManoObra] = {}
-    equipo_cache: Dict[int, Equipo] = {}
-    maquinaria_cache: Dict[int, Maquinaria] = {}
 
+def validar_matriz(matriz, nombre: str = "matriz") -> Optional[str]:
+    """Revisa una matriz en línea antes de calcularla; devuelve el error o None."""
+    if not isinstance(matriz, list):
+        return f"'{nombre}' debe ser una lista de renglones"
+    for indice, renglon in enumerate(matriz):
+        lugar = f"{nombre}[{indice}]"
+        if not isinstance(renglon, dict):
+            return f"{lugar} debe ser un objeto"
+        if renglon.get("tipo_insumo") not in MODELOS_INSUMO:
+            return f"{lugar}.tipo_insumo debe ser uno de: {', '.join(MODELOS_INSUMO)}"
+        if renglon.get("cantidad") is None or not _es_numero(renglon["cantidad"]):
+            return f"{lugar}.cantidad debe ser numérica"
+        for campo in CAMPOS_NUMERICOS_RENGLON:
+            if renglon.get(campo) is not None and not _es_numero(renglon[campo]):
+                return f"{lugar}.{campo} debe ser numérico"
+    return None
+
+
+def compilar_plan(registros: Iterable[Dict]) -> PlanCosto:
+    renglones = []
     for registro in registros:
+        tipo = registro.get("tipo_insumo")
+        if tipo not in MODELOS_INSUMO:
+            continue  # obtener_costo_insumo les da costo 0
+        try:
+            insumo_id = int(registro.get("id_insumo") or 0)
+        except (TypeError, ValueError):
+            insumo_id = 0  # id no numérico: como un insumo inexistente, costo 0 salvo override
         cantidad = decimal_field(registro["cantidad"])
-        costo_unitario = obtener_costo_insumo(
-            registro,
-            material_cache,
-            mano_obra_cache,
-            equipo_cache,
-            maquinaria_cache,
-        )
-        importe = cantidad * costo_unitario
+        merma = flete = None
+        if tipo == "Material":
+            if registro.get("porcentaje_merma") is not None:
+                merma = decimal_field(registro.get("porcentaje_merma"))
+            if registro.get("precio_flete_unitario") is not None:
+                flete = decimal_field(registro.get("precio_flete_unitario"))
+
+        precio_override = decimal_field(registro.get("precio_custom") or registro.get("precio_unitario_temp"))
+        if precio_override > 0:
+            # Con override obtener_costo_insumo no consulta el catálogo.
+            costo = obtener_costo_insumo(registro, {}, {}, {}, {})
+            renglones.append((tipo, insumo_id, cantidad, costo, merma, flete, Decimal("0")))
+            continue
+        if not insumo_id:
+            continue
+
+        respaldo = decimal_field(registro.get("precio_custom")) if tipo in ("Equipo", "Maquinaria") else Decimal("0")
+        renglones.append((tipo, insumo_id, cantidad, None, merma, flete, respaldo))
+    return PlanCosto(renglones)
+
+
+def _insumo_de_cache(tipo: str, insumo_id: int, caches: Dict[str, Dict]):
+    cache = caches[tipo]
+    insumo = cache.get(insumo_id)
+    if insumo is None:
+        insumo = db.session.get(MODELOS_INSUMO[tipo], insumo_id)
+        if insumo:
+            cache[insumo_id] = insumo
+    return insumo
+
+
+def _costo_catalogo(tipo: str, insumo) -> Decimal:
+    if tipo == "Material":
+        base = decimal_field(insumo.precio_unitario)
+        merma = decimal_field(insumo.porcentaje_merma)
+        return base * (Decimal("1.0") + merma) + decimal_field(insumo.precio_flete_unitario)
+    if tipo == "ManoObra":
+        rendimiento = decimal_field(insumo.rendimiento_jornada or Decimal("1.0"))
+        if rendimiento <= 0:
+            rendimiento = Decimal("1.0")
+        return decimal_field(insumo.salario_base) * decimal_field(insumo.fasar) / rendimiento
+    if tipo == "Equipo":
+        return decimal_field(insumo.costo_hora_maq)
+    rendimiento = decimal_field(insumo.rendimiento_horario or Decimal("1.0"))
+    if rendimiento <= 0:
+        rendimiento = Decimal("1.0")
+    return decimal_field(insumo.costo_posesion_hora) / rendimiento
+
+
+def costo_renglon(renglon: Tuple, caches: Dict[str, Dict], costos: Optional[Dict] = None) -> Decimal:
+    """Costo unitario vigente de un renglón de plan; costos memoiza el costo de catálogo por insumo."""
+    tipo, insumo_id, _, costo_fijo, merma, flete, respaldo = renglon
+    if costo_fijo is not None:
+        return costo_fijo
+    if tipo == "Material" and (merma is not None or flete is not None):
+        material = _insumo_de_cache(tipo, insumo_id, caches)
+        if material is None:
+            return respaldo
+        merma = merma if merma is not None else decimal_field(material.porcentaje_merma)
+        flete = flete if flete is not None else decimal_field(material.precio_flete_unitario)
+        return decimal_field(material.precio_unitario) * (Decimal("1.0") + merma) + flete
+
+    llave = (tipo, insumo_id)
+    if costos is not None and llave in costos:
+        return costos[llave]
+    insumo = _insumo_de_cache(tipo, insumo_id, caches)
+    costo = _costo_catalogo(tipo, insumo) if insumo is not None else respaldo
+    if costos is not None:
+        costos[llave] = costo
+    return costo
+
+
+def _caches_por_tipo(material_cache, mano_obra_cache, equipo_cache, maquinaria_cache) -> Dict[str, Dict]:
+    return {
+        "Material": material_cache,
+        "ManoObra": mano_obra_cache,
+        "Equipo": equipo_cache,
+        "Maquinaria": maquinaria_cache,
+    }
+
+
+def _sumar_plan(
+    plan: PlanCosto,
+    material_cache: Dict[int, Material],
+    mano_obra_cache: Dict[int, ManoObra],
+    equipo_cache: Dict[int, Equipo],
+    maquinaria_cache: Dict[int, Maquinaria],
+    costos: Optional[Dict] = None,
+) -> Tuple[Decimal, Decimal]:
+    caches = _caches_por_tipo(material_cache, mano_obra_cache, equipo_cache, maquinaria_cache)
+    costos = costos if costos is not None else {}
+    cd_base = Decimal("0")
+    costo_mano_obra = Decimal("0")
+    for renglon in plan.renglones:
+        importe = renglon[2] * costo_renglon(renglon, caches, costos)
         cd_base += importe
-        if registro["tipo_insumo"] == "ManoObra":
+        if renglon[0] == "ManoObra":
             costo_mano_obra += importe
+    return cd_base, costo_mano_obra
+
+
+def _sumar_registros(
+    registros: Iterable[Dict],
+    material_cache: Dict[int, Material],
+    mano_obra_cache: Dict[int, ManoObra],
+    equipo_cache: Dict[int, Equipo],
+    maquinaria_cache: Dict[int, Maquinaria],
+) -> Tuple[Decimal, Decimal]:
+    return _sumar_plan(compilar_plan(registros), material_cache, mano_obra_cache, equipo_cache, maquinaria_cache)
 
+
+def _aplicar_factores(
+    cd_base: Decimal,
+    costo_mano_obra: Decimal,
+    factores: Optional[Dict[str, Dict[str, Decimal]]],
+) -> Dict[str, float]:
     factores = factores or {}
     factor_mano_obra = obtener_factor_decimal(factores, "mano_obra")
     ajuste_mano_obra = costo_mano_obra * factor_mano_obra
@@ -214,6 +406,191 @@ def calcular_precio_unitario(
         "precio_unitario": float(pu),
     }
 
+
+def calcular_precio_unitario(
+    concepto_id: Optional[int] = None,
+    matriz: Optional[List[Dict]] = None,
+    factores: Optional[Dict[str, Dict[str, Decimal]]] = None,
+    aritmetica: str = "decimal",
+    fecha: Optional[date] = None,
+    user_id: Optional[int] = None,
+) -> Dict[str, float]:
+    """PU de un concepto guardado o de una matriz en línea; con fecha, a los precios de ese día.
+
+    Con user_id los insumos se toman de la instantánea del catálogo de ese usuario.
+    """
+    if matriz is not None:
+        plan = compilar_plan(matriz)
+    elif concepto_id:
+        plan = cargar_planes([concepto_id]).get(int(concepto_id), PLAN_VACIO)
+    else:
+        plan = PLAN_VACIO
+
+    caches = caches_de_insumos([plan], fecha, user_id) if fecha or user_id else ({}, {}, {}, {})
+    motor = MotorCalculo(caches, aritmetica)
+    cd_base, costo_mano_obra = motor.sumar(plan)
+    return motor.aplicar_factores(cd_base, costo_mano_obra, factores)
+
+
+class MotorCalculo:
+    """Suma de renglones y aplicación de factores con la aritmética elegida.
+
+    Comparte los caches de insumos y los costos unitarios ya resueltos entre todos
+    los conceptos de un mismo cálculo por lotes.
+    """
+
+    def __init__(self, caches: Tuple[Dict, Dict, Dict, Dict], aritmetica: str = "decimal"):
+        self.caches = caches
+        self.entera = aritmetica == "entera"
+        self._costos: Dict = {}
+
+    def sumar(self, plan: PlanCosto):
+        if self.entera:
+            return sumar_plan_entero(plan, *self.caches, convertidos=self._costos)
+        return _sumar_plan(plan, *self.caches, costos=self._costos)
+
+    def aplicar_factores(self, cd_base, costo_mano_obra, factores) -> Dict[str, float]:
+        if self.entera:
+            return aplicar_factores_entero(cd_base, costo_mano_obra, factores)
+        return _aplicar_factores(cd_base, costo_mano_obra, factores)
+
+
+# --- Cálculo por lotes ---
+# SQLite limita el número de parámetros por sentencia; los IN (...) se parten en bloques.
+TAMANO_BLOQUE_IN = 500
+
+
+def en_bloques(ids: Iterable[int], tamano: int = TAMANO_BLOQUE_IN) -> Iterable[List[int]]:
+    lista = list(ids)
+    for inicio in range(0, len(lista), tamano):
+        yield lista[inicio:inicio + tamano]
+
+
+def cargar_matrices(concepto_ids: Iterable[int]) -> Dict[int, List[Dict]]:
+    """Carga los renglones de matriz de varios conceptos con una consulta por bloque."""
+    matrices: Dict[int, List[Dict]] = {}
+    ids = sorted({int(cid) for cid in concepto_ids if cid})
+    for bloque in en_bloques(ids):
+        filas = MatrizInsumo.query.filter(MatrizInsumo.concepto_id.in_(bloque)).order_by(MatrizInsumo.id)
+        for fila in filas:
+            matrices.setdefault(fila.concepto_id, []).append(fila.to_dict())
+    return matrices
+
+
+def _precargar_pares(
+    pares: Iterable[Tuple[str, int]],
+    material_cache: Optional[Dict[int, Material]] = None,
+    mano_obra_cache: Optional[Dict[int, ManoObra]] = None,
+    equipo_cache: Optional[Dict[int, Equipo]] = None,
+    maquinaria_cache: Optional[Dict[int, Maquinaria]] = None,
+    user_id: Optional[int] = None,
+) -> Tuple[Dict[int, Material], Dict[int, ManoObra], Dict[int, Equipo], Dict[int, Maquinaria]]:
+    caches = _caches_por_tipo(
+        material_cache if material_cache is not None else {},
+        mano_obra_cache if mano_obra_cache is not None else {},
+        equipo_cache if equipo_cache is not None else {},
+        maquinaria_cache if maquinaria_cache is not None else {},
+    )
+    pendientes: Dict[str, set] = {tipo: set() for tipo in caches}
+    for tipo, insumo_id in pares:
+        if tipo in pendientes and insumo_id and insumo_id not in caches[tipo]:
+            pendientes[tipo].add(insumo_id)
+
+    # Lo que no está en la instantánea (insumos de otros usuarios o ya borrados) va a la base.
+    instantanea = instantanea_catalogo(user_id) if user_id else None
+    for tipo, ids in pendientes.items():
+        if instantanea is not None and ids:
+            encontrados, ids = registros_de(instantanea, tipo, ids)
+            caches[tipo].update(encontrados)
+        modelo = MODELOS_INSUMO[tipo]
+        for bloque in en_bloques(sorted(ids)):
+            for insumo in modelo.query.filter(modelo.id.in_(bloque)):
+                caches[tipo][insumo.id] = insumo
+
+    return caches["Material"], caches["ManoObra"], caches["Equipo"], caches["Maquinaria"]
+
+
+def precargar_insumos(registros: Iterable[Dict], *caches: Dict, user_id: Optional[int] = None):
+    """Llena los caches de obtener_costo_insumo con un IN (...) por tabla de insumo.
+
+    Con user_id primero se toman de la instantánea del catálogo del usuario.
+    """
+    return _precargar_pares(((r.get("tipo_insumo"), r.get("id_insumo")) for r in registros), *caches, user_id=user_id)
+
+
+def precargar_insumos_de_planes(planes: Iterable[PlanCosto], *caches: Dict, user_id: Optional[int] = None):
+    """Igual que precargar_insumos, pero a partir de planes de costo."""
+    return _precargar_pares((par for plan in planes for par in plan.insumos()), *caches, user_id=user_id)
+
+
+def caches_de_insumos(planes: Iterable[PlanCosto], fecha: Optional[date] = None, user_id: Optional[int] = None):
+    """Precarga los insumos de los planes; con fecha, con los precios de ese día."""
+    # Los precios a una fecha se arman sobre los objetos del ORM (todas sus columnas).
+    caches = precargar_insumos_de_planes(planes, user_id=None if fecha else user_id)
+    if fecha is None:
+        return caches
+    from backend.services.historial_service import caches_a_fecha
+
+    return caches_a_fecha(caches, fecha)
+
+
+def cargar_planes(concepto_ids: Iterable[int]) -> Dict[int, PlanCosto]:
+    """Planes guardados de los conceptos; los que no tienen plan se compilan al vuelo."""
+    planes: Dict[int, PlanCosto] = {}
+    sin_plan: List[int] = []
+    ids = sorted({int(cid) for cid in concepto_ids if cid})
+    for bloque in en_bloques(ids):
+        for concepto_id, texto in db.session.query(Concepto.id, Concepto.plan_costo).filter(Concepto.id.in_(bloque)):
+            plan = plan_desde_texto(texto) if texto else None
+            if plan is None:
+                sin_plan.append(concepto_id)
+            else:
+                planes[concepto_id] = plan
+    if sin_plan:
+        for concepto_id, registros in cargar_matrices(sin_plan).items():
+            planes[concepto_id] = compilar_plan(registros)
+    return planes
+
+
+def actualizar_plan_concepto(concepto_id: int) -> None:
+    """Recompila y guarda el plan de un concepto tras editar su matriz. No hace commit."""
+    concepto = db.session.get(Concepto, concepto_id)
+    if concepto is None:
+        return
+    registros = cargar_matrices([concepto_id]).get(concepto_id, [])
+    concepto.plan_costo = compilar_plan(registros).a_texto()
+
+
+def calcular_precio_unitario_lote(
+    concepto_ids: Optional[List[int]] = None,
+    matrices: Optional[List[List[Dict]]] = None,
+    factores: Optional[Dict[str, Dict[str, Decimal]]] = None,
+    aritmetica: str = "decimal",
+    fecha: Optional[date] = None,
+    user_id: Optional[int] = None,
+) -> List[Dict]:
+    """Calcula el PU de muchos conceptos (o matrices en línea) compartiendo la precarga de insumos.
+
+    Da los mismos resultados que llamar a calcular_precio_unitario por cada concepto.
+    Con fecha se usan los precios del catálogo al cierre de ese día (historial de precios).
+    Con user_id los insumos se toman de la instantánea del catálogo de ese usuario.
+    """
+    concepto_ids = list(concepto_ids or [])
+    planes = cargar_planes(concepto_ids)
+    planes_en_linea = [compilar_plan(matriz) for matriz in matrices or []]
+    motor = MotorCalculo(caches_de_insumos([*planes.values(), *planes_en_linea], fecha, user_id), aritmetica)
+
+    resultados: List[Dict] = []
+    for concepto_id in concepto_ids:
+        cd_base, costo_mano_obra = motor.sumar(planes.get(concepto_id, PLAN_VACIO))
+        resultado = motor.aplicar_factores(cd_base, costo_mano_obra, factores)
+        resultados.append({"concepto_id": concepto_id, **resultado})
+    for indice, plan in enumerate(planes_en_linea):
+        cd_base, costo_mano_obra = motor.sumar(plan)
+        resultado = motor.aplicar_factores(cd_base, costo_mano_obra, factores)
+        resultados.append({"indice": indice, **resultado})
+    return resultados
+
 def normalizar_factores(payload: Optional[Dict]) -> Dict[str, Dict[str, Decimal]]:
     if not payload:
         return {}
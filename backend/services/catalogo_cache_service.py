@@ -0,0 +1,233 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+from sqlalchemy import event
+from backend.config import Config
+from backend.extensions import db
+from backend.models import Material, ManoObra, Equipo, Maquinaria
+from backend.services.versiones_service import RECURSO_CATALOGO, RECURSO_FASAR, ambito, huella_versiones
+
+# Instantánea compartida del catálogo de cada usuario (registros propios y globales).
+#
+# Precios, sugerencias de APU, emparejamiento de la IA y notas de venta leen los mismos
+# insumos; en lugar de pedirlos a la base (y construir objetos del ORM) cada vez, se lee
+# una instantánea por usuario con registros compactos de solo lectura (__slots__, solo
+# las columnas que esos servicios usan). La instantánea se guarda con la huella de
+# versiones de catálogo y FASAR del usuario y del ámbito global: cualquier escritura que
+# las incremente hace que la siguiente lectura la reconstruya, aun en otros workers.
+#
+# Si la transacción en curso ya escribió al catálogo (y todavía no hace commit) la
+# instantánea no se usa: los precios nuevos no se verían y una huella sin commit no debe
+# quedar en el cache. Quien la pide recibe None y lee de la base como antes.
+#
+# El cache es un LRU por memoria: CATALOGO_CACHE_MAX_MB limita el tamaño aproximado
+# (sys.getsizeof de registros y valores) de todas las instantáneas guardadas.
+
+RECURSOS_INSTANTANEA = (RECURSO_CATALOGO, RECURSO_FASAR)
+_ESCRITURA_CATALOGO = "escritura_catalogo"
+
+
+class _Registro:
+    __slots__ = ()
+
+    def __init__(self, *valores):
+        for campo, valor in zip(self.__slots__, valores):
+            object.__setattr__(self, campo, valor)
+
+    def __setattr__(self, campo, valor):
+        raise AttributeError(f"{type(self).__name__} es de solo lectura")
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} {self.id}>"
+
+
+class MaterialCompacto(_Registro):
+    __slots__ = ("id", "user_id", "nombre", "unidad", "precio_unitario", "porcentaje_merma", "precio_flete_unitario")
+
+
+class ManoObraCompacta(_Registro):
+    __slots__ = ("id", "user_id", "puesto", "salario_base", "fasar", "rendimiento_jornada")
+
+
+class EquipoCompacto(_Registro):
+    __slots__ = ("id", "user_id", "nombre", "unidad", "costo_hora_maq")
+
+
+class MaquinariaCompacta(_Registro):
+    __slots__ = ("id", "user_id", "nombre", "rendimiento_horario", "costo_posesion_hora")
+
+
+# tipo -> (modelo, clase del registro compacto)
+REGISTROS = {
+    "Material": (Material, MaterialCompacto),
+    "ManoObra": (ManoObra, ManoObraCompacta),
+    "Equipo": (Equipo, EquipoCompacto),
+    "Maquinaria": (Maquinaria, MaquinariaCompacta),
+}
+_TABLAS_CATALOGO = {modelo.__table__.name for modelo, _ in REGISTROS.values()}
+_MODELOS_CATALOGO = tuple(modelo for modelo, _ in REGISTROS.values())
+
+
+def _tamano(registro: _Registro) -> int:
+    return sys.getsizeof(registro) + sum(sys.getsizeof(getattr(registro, campo)) for campo in registro.__slots__)
+
+
+class InstantaneaCatalogo:
+    """Insumos de un usuario y los globales, por tipo y ordenados por id."""
+
+    def __init__(self, user_id: Optional[int], huella: Tuple = ()):
+        self.ambito = ambito(user_id)
+        self.huella = huella
+        self.por_tipo: Dict[str, Dict[int, _Registro]] = {}
+        self.tamano_bytes = 0
+        self._derivados: Dict[str, object] = {}
+        for tipo, (modelo, clase) in REGISTROS.items():
+            tabla = modelo.__table__.c
+            propios = tabla.user_id.is_(None) if not user_id else (tabla.user_id == user_id) | tabla.user_id.is_(None)
+            consulta = db.session.query(*(tabla[campo] for campo in clase.__slots__)).filter(propios).order_by(tabla.id)
+            registros = {}
+            for fila in consulta:
+                registro = clase(*fila)
+                registros[registro.id] = registro
+                self.tamano_bytes += _tamano(registro)
+            self.por_tipo[tipo] = registros
+            self.tamano_bytes += sys.getsizeof(registros)
+
+    def obtener(self, tipo: str, insumo_id: int) -> Optional[_Registro]:
+        registros = self.por_tipo.get(tipo)
+        return registros.get(insumo_id) if registros is not None else None
+
+    def registros(self, tipo: str) -> Iterable[_Registro]:
+        return self.por_tipo.get(tipo, {}).values()
+
+    def primero(self, tipo: str) -> Optional[_Registro]:
+        return next(iter(self.registros(tipo)), None)
+
+    def derivado(self, nombre: str, construir: Callable[["InstantaneaCatalogo"], object]):
+        """Estructura calculada a partir de la instantánea; vive y se invalida con ella."""
+        valor = self._derivados.get(nombre)
+        if valor is None:
+            valor = self._derivados.setdefault(nombre, construir(self))
+        return valor
+
+
+class CacheInstantaneas:
+    def __init__(self, presupuesto_mb: float):
+        self.presupuesto_bytes = max(int(presupuesto_mb * 1024 * 1024), 0)
+        self._datos: "OrderedDict[Hashable, InstantaneaCatalogo]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.omitidas = 0
+
+    def obtener(self, llave: Hashable, huella: Tuple) -> Optional[InstantaneaCatalogo]:
+        with self._lock:
+            instantanea = self._datos.get(llave)
+            if instantanea is None or instantanea.huella != huella:
+                self.misses += 1
+                return None
+            self._datos.move_to_end(llave)
+            self.hits += 1
+            return instantanea
+
+    def guardar(self, llave: Hashable, instantanea: InstantaneaCatalogo) -> None:
+        with self._lock:
+            anterior = self._datos.pop(llave, None)
+            if anterior is not None:
+                self._bytes -= anterior.tamano_bytes
+            if instantanea.tamano_bytes > self.presupuesto_bytes:
+                return  # no cabe ni sola: se usa para esta petición y se descarta
+            self._datos[llave] = instantanea
+            self._bytes += instantanea.tamano_bytes
+            while self._bytes > self.presupuesto_bytes:
+                _, desalojada = self._datos.popitem(last=False)
+                self._bytes -= desalojada.tamano_bytes
+                self.evictions += 1
+
+    def omitir(self) -> None:
+        with self._lock:
+            self.omitidas += 1
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._datos.clear()
+            self._bytes = 0
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._datos),
+                "bytes": self._bytes,
+                "presupuesto_bytes": self.presupuesto_bytes,
+                "registros": sum(len(r) for i in self._datos.values() for r in i.por_tipo.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "omitidas": self.omitidas,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+cache_catalogo = CacheInstantaneas(Config.CATALOGO_CACHE_MAX_MB)
+
+
+@event.listens_for(db.session, "after_flush")
+def _marcar_flush(session, _contexto):
+    if any(isinstance(objeto, _MODELOS_CATALOGO) for objeto in (*session.new, *session.dirty, *session.deleted)):
+        session.info[_ESCRITURA_CATALOGO] = True
+
+
+@event.listens_for(db.session, "do_orm_execute")
+def _marcar_dml(estado):
+    # UPDATE/INSERT/DELETE masivos (session.execute) no pasan por el flush
+    if estado.is_insert or estado.is_update or estado.is_delete:
+        tabla = getattr(estado.statement, "table", None)
+        if getattr(tabla, "name", None) in _TABLAS_CATALOGO:
+            estado.session.info[_ESCRITURA_CATALOGO] = True
+
+
+@event.listens_for(db.session, "after_transaction_end")
+def _fin_transaccion(session, transaccion):
+    if transaccion.parent is None:
+        session.info.pop(_ESCRITURA_CATALOGO, None)
+
+
+def construir_instantanea(user_id: Optional[int]) -> InstantaneaCatalogo:
+    """Instantánea leída de la base en la transacción actual, sin pasar por el cache."""
+    return InstantaneaCatalogo(user_id or None)
+
+
+def instantanea_catalogo(user_id: Optional[int]) -> Optional[InstantaneaCatalogo]:
+    """Instantánea vigente del usuario; None si la transacción ya escribió al catálogo."""
+    # La consulta de versiones hace autoflush, así que los cambios pendientes ya marcaron la sesión.
+    huella = huella_versiones(user_id, RECURSOS_INSTANTANEA)
+    if db.session.info.get(_ESCRITURA_CATALOGO):
+        cache_catalogo.omitir()
+        return None
+    llave = ambito(user_id)
+    instantanea = cache_catalogo.obtener(llave, huella)
+    if instantanea is None:
+        instantanea = InstantaneaCatalogo(user_id or None, huella)
+        cache_catalogo.guardar(llave, instantanea)
+    return instantanea
+
+
+def limpiar_instantaneas() -> None:
+    cache_catalogo.limpiar()
+
+
+def registros_de(instantanea: InstantaneaCatalogo, tipo: str, ids: Iterable[int]) -> Tuple[Dict[int, _Registro], List[int]]:
+    """Separa los ids en (registros de la instantánea, ids que no están en ella)."""
+    registros = instantanea.por_tipo.get(tipo, {})
+    encontrados, faltantes = {}, []
+    for insumo_id in ids:
+        registro = registros.get(insumo_id)
+        if registro is None:
+            faltantes.append(insumo_id)
+        else:
+            encontrados[insumo_id] = registro
+    return encontrados, faltantes
@@ -0,0 +1,88 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from backend.models import Concepto, MatrizInsumo, DetallePresupuesto, Partida, Proyecto
+from backend.extensions import db
+from backend.services.calculation_service import en_bloques
+
+# Índice inverso insumo -> conceptos -> detalles de presupuesto.
+# Se apoya en los índices ix_matriz_insumo_tipo_id y ix_detalle_presupuesto_concepto_id,
+# que SQLite mantiene en cada escritura de la matriz y de los presupuestos.
+
+
+def conceptos_que_usan(insumos: Iterable[Tuple[str, int]]) -> Set[int]:
+    """Devuelve los ids de concepto cuya matriz referencia alguno de los insumos (tipo, id)."""
+    por_tipo: Dict[str, Set[int]] = {}
+    for tipo, insumo_id in insumos:
+        if tipo and insumo_id:
+            por_tipo.setdefault(tipo, set()).add(int(insumo_id))
+
+    conceptos: Set[int] = set()
+    for tipo, ids in por_tipo.items():
+        for bloque in en_bloques(sorted(ids)):
+            filas = (
+                db.session.query(MatrizInsumo.concepto_id)
+                .filter(MatrizInsumo.tipo_insumo == tipo, MatrizInsumo.id_insumo.in_(bloque))
+                .distinct()
+            )
+            conceptos.update(concepto_id for (concepto_id,) in filas)
+    return conceptos
+
+
+def detalles_de_conceptos(concepto_ids: Iterable[int], user_id: Optional[int] = None) -> List[Tuple[int, int, int, int]]:
+    """Renglones (detalle_id, concepto_id, partida_id, proyecto_id) que usan esos conceptos.
+
+    Con user_id solo los de proyectos de ese usuario.
+    """
+    filas: List[Tuple[int, int, int, int]] = []
+    for bloque in en_bloques(sorted(set(concepto_ids))):
+        consulta = (
+            db.session.query(
+                DetallePresupuesto.id,
+                DetallePresupuesto.concepto_id,
+                DetallePresupuesto.partida_id,
+                Partida.proyecto_id,
+            )
+            .join(Partida, DetallePresupuesto.partida_id == Partida.id)
+            .filter(DetallePresupuesto.concepto_id.in_(bloque))
+        )
+        if user_id is not None:
+            consulta = consulta.join(Proyecto, Partida.proyecto_id == Proyecto.id).filter(Proyecto.user_id == user_id)
+        filas.extend(consulta.all())
+    return filas
+
+
+def proyectos_de_conceptos(concepto_ids: Iterable[int]) -> Set[int]:
+    """Ids de los proyectos con algún detalle que usa esos conceptos."""
+    proyectos: Set[int] = set()
+    for bloque in en_bloques(sorted(set(concepto_ids))):
+        filas = (
+            db.session.query(Partida.proyecto_id)
+            .join(DetallePresupuesto, DetallePresupuesto.partida_id == Partida.id)
+            .filter(DetallePresupuesto.concepto_id.in_(bloque))
+            .distinct()
+        )
+        proyectos.update(proyecto_id for (proyecto_id,) in filas)
+    return proyectos
+
+
+def dependencias_de_insumo(tipo: str, insumo_id: int, user_id: Optional[int]) -> Dict:
+    """Dependencias de un insumo que el usuario puede ver: sus conceptos y los globales, y
+    los renglones de sus propios proyectos."""
+    conceptos: List[int] = []
+    for bloque in en_bloques(sorted(conceptos_que_usan([(tipo, insumo_id)]))):
+        conceptos.extend(
+            concepto_id for (concepto_id,) in db.session.query(Concepto.id).filter(
+                Concepto.id.in_(bloque), (Concepto.user_id == user_id) | Concepto.user_id.is_(None)
+            )
+        )
+    conceptos.sort()
+    detalles = detalles_de_conceptos(conceptos, user_id)
+    return {
+        "tipo_insumo": tipo,
+        "id_insumo": insumo_id,
+        "conceptos": conceptos,
+        "detalles": [
+            {"id": detalle_id, "concepto": concepto_id, "partida": partida_id, "proyecto": proyecto_id}
+            for detalle_id, concepto_id, partida_id, proyecto_id in detalles
+        ],
+        "proyectos": sorted({fila[3] for fila in detalles}),
+    }
@@ -0,0 +1,184 @@
+import re
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from backend.models import Material, ManoObra, Equipo, Maquinaria
+from backend.services.busqueda_service import normalizar
+from backend.services.calculation_service import _costo_catalogo
+from backend.services.catalogo_cache_service import InstantaneaCatalogo, construir_instantanea, instantanea_catalogo
+
+# Emparejamiento de los insumos que sugiere la IA con el catálogo del usuario.
+#
+# Por usuario se arma en memoria un índice de trigramas por tipo de insumo (registros
+# propios y globales). Cada nombre sugerido cuenta sus trigramas compartidos con todo el
+# catálogo en una sola operación de numpy (bincount sobre las listas de postings) y solo
+# los mejores candidatos pasan a la comparación de palabras y unidades. El índice se
+# arma sobre la instantánea del catálogo del usuario y se guarda en ella: cualquier
+# escritura al catálogo, del usuario o global, hace que la siguiente consulta lo reconstruya.
+
+UMBRAL_CONFIANZA = 0.55
+CANDIDATOS_POR_CONSULTA = 8
+PESO_TRIGRAMAS = 0.7
+PESO_PALABRAS = 0.3
+FACTOR_UNIDAD_INCOMPATIBLE = 0.5
+
+_PALABRAS_VACIAS = {"de", "del", "la", "el", "los", "las", "para", "con", "y", "en", "a", "o", "al", "por", "tipo"}
+
+# tipo -> (modelo, columna del nombre, columna de unidad o unidad fija). El costo unitario
+# es el que cobra el cálculo de PU (con merma y flete, FASAR y rendimientos).
+FUENTES = {
+    "Material": (Material, "nombre", "unidad"),
+    "ManoObra": (ManoObra, "puesto", "jor"),
+    "Equipo": (Equipo, "nombre", "unidad"),
+    "Maquinaria": (Maquinaria, "nombre", "hr"),
+}
+
+# Unidad normalizada -> (unidad canónica, dimensión). Los empaques (bulto, cubeta, rollo...)
+# no tienen dimensión fija y nunca se consideran incompatibles.
+_UNIDADES = {
+    ("pza", "conteo"): ("pza", "pzas", "pz", "pzs", "pieza", "piezas", "u", "un", "unidad", "unidades"),
+    ("m", "longitud"): ("m", "ml", "mts", "metro", "metros", "metro lineal", "metros lineales"),
+    ("m2", "area"): ("m2", "mt2", "metro cuadrado", "metros cuadrados"),
+    ("m3", "volumen"): ("m3", "mt3", "metro cubico", "metros cubicos"),
+    ("lt", "volumen"): ("l", "lt", "lts", "litro", "litros"),
+    ("kg", "masa"): ("kg", "kgs", "kilo", "kilos", "kilogramo", "kilogramos"),
+    ("ton", "masa"): ("t", "ton", "tons", "tonelada", "toneladas"),
+    ("jor", "tiempo"): ("jor", "jornada", "jornadas", "jornal", "dia", "dias"),
+    ("hr", "tiempo"): ("h", "hr", "hrs", "hora", "horas"),
+    ("bto", None): ("bto", "btos", "bulto", "bultos", "saco", "sacos"),
+}
+EQUIVALENCIAS_UNIDAD = {alias: canonica for canonica, alias_unidad in _UNIDADES.items() for alias in alias_unidad}
+
+# La IA a veces escribe el tipo como "Mano de Obra" o "mano_obra".
+_TIPOS = {re.sub(r"[\s_]+", "", tipo.lower()): tipo for tipo in FUENTES}
+
+
+def normalizar_tipo(tipo: Optional[str]) -> str:
+    llave = re.sub(r"[\s_]+", "", re.sub(r"\bde\b", "", normalizar(tipo or "").replace("_", " ")))
+    return _TIPOS.get(llave, "Material")
+
+
+def normalizar_unidad(unidad: Optional[str]) -> Optional[Tuple[str, Optional[str]]]:
+    """(unidad canónica, dimensión) o None si la unidad no se reconoce."""
+    texto = re.sub(r"[.\s]+", " ", normalizar(unidad or "")).strip()
+    return EQUIVALENCIAS_UNIDAD.get(texto) or EQUIVALENCIAS_UNIDAD.get(texto.replace(" ", ""))
+
+
+def unidades_compatibles(unidad_a: Optional[str], unidad_b: Optional[str]) -> bool:
+    """Falso solo si ambas unidades se reconocen y miden dimensiones distintas."""
+    a, b = normalizar_unidad(unidad_a), normalizar_unidad(unidad_b)
+    if not a or not b or a[1] is None or b[1] is None:
+        return True
+    return a[1] == b[1]
+
+
+def palabras(texto: str) -> List[str]:
+    return [p for p in re.split(r"[^\w.]+|(?<!\d)\.|\.(?!\d)", normalizar(texto)) if p and p not in _PALABRAS_VACIAS]
+
+
+def trigramas(lista_palabras: List[str]) -> set:
+    # Como pg_trgm: cada palabra con dos espacios al inicio y uno al final.
+    resultado = set()
+    for palabra in lista_palabras:
+        relleno = f"  {palabra} "
+        resultado.update(relleno[i:i + 3] for i in range(len(relleno) - 2))
+    return resultado
+
+
+class _IndiceTipo:
+    def __init__(self, filas: List[Tuple]):
+        self.ids = [fila[0] for fila in filas]
+        self.nombres = [fila[1] for fila in filas]
+        self.unidades = [fila[2] for fila in filas]
+        self.costos = [float(fila[3] or 0) for fila in filas]
+        self.palabras = [set(palabras(nombre)) for nombre in self.nombres]
+
+        postings: Dict[str, List[int]] = {}
+        totales = np.zeros(len(filas), dtype=np.float64)
+        for posicion, lista in enumerate(self.palabras):
+            grams = trigramas(sorted(lista))
+            totales[posicion] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(posicion)
+        self.postings = {gram: np.asarray(pos, dtype=np.int32) for gram, pos in postings.items()}
+        self.totales = totales
+
+    def emparejar(self, nombre: str, unidad: Optional[str]) -> Dict:
+        lista = palabras(nombre)
+        grams = trigramas(lista)
+        listas = [self.postings[g] for g in grams if g in self.postings]
+        if not listas:
+            return _sin_coincidencia()
+
+        compartidos = np.bincount(np.concatenate(listas), minlength=len(self.ids))
+        dice = 2.0 * compartidos / (len(grams) + self.totales)
+        k = min(CANDIDATOS_POR_CONSULTA, len(dice))
+        candidatos = np.argpartition(-dice, k - 1)[:k]
+
+        consulta = set(lista)
+        mejor, mejor_puntaje = None, 0.0
+        for posicion in candidatos:
+            if compartidos[posicion] == 0:
+                continue
+            cobertura = len(consulta & self.palabras[posicion]) / len(consulta) if consulta else 0.0
+            puntaje = PESO_TRIGRAMAS * float(dice[posicion]) + PESO_PALABRAS * cobertura
+            if not unidades_compatibles(unidad, self.unidades[posicion]):
+                puntaje *= FACTOR_UNIDAD_INCOMPATIBLE
+            # Empates: el nombre más corto (más genérico) y luego el id menor
+            if mejor is None or (puntaje, -len(self.nombres[posicion]), -self.ids[posicion]) > (
+                mejor_puntaje, -len(self.nombres[mejor]), -self.ids[mejor]
+            ):
+                mejor, mejor_puntaje = int(posicion), puntaje
+
+        if mejor is None:
+            return _sin_coincidencia()
+        return {
+            "insumo_id": self.ids[mejor] if mejor_puntaje >= UMBRAL_CONFIANZA else None,
+            "nombre_catalogo": self.nombres[mejor],
+            "unidad_catalogo": self.unidades[mejor],
+            "costo_unitario": self.costos[mejor],
+            "confianza": round(min(mejor_puntaje, 1.0), 3),
+        }
+
+
+def _sin_coincidencia() -> Dict:
+    return {"insumo_id": None, "nombre_catalogo": None, "unidad_catalogo": None, "costo_unitario": None, "confianza": 0.0}
+
+
+class IndiceCatalogo:
+    """Índice de emparejamiento de los catálogos de un usuario (propios y globales)."""
+
+    def __init__(self, instantanea: InstantaneaCatalogo):
+        self.tipos: Dict[str, _IndiceTipo] = {}
+        for tipo, (modelo, columna_nombre, unidad) in FUENTES.items():
+            con_unidad = unidad in modelo.__table__.c
+            filas = [
+                (r.id, getattr(r, columna_nombre), getattr(r, unidad) if con_unidad else unidad, _costo_catalogo(tipo, r))
+                for r in instantanea.registros(tipo)
+            ]
+            self.tipos[tipo] = _IndiceTipo(filas)
+
+    def emparejar(self, tipo: str, nombre: str, unidad: Optional[str] = None) -> Dict:
+        indice = self.tipos.get(tipo)
+        if indice is None or not indice.ids or not (nombre or "").strip():
+            return _sin_coincidencia()
+        return indice.emparejar(nombre, unidad)
+
+    def resolver(self, insumos: List[Dict]) -> List[Dict]:
+        """Empareja una lista de insumos ({tipo_insumo, nombre, unidad}) en el mismo orden."""
+        return [
+            self.emparejar(normalizar_tipo(insumo.get("tipo_insumo")), insumo.get("nombre") or "", insumo.get("unidad"))
+            for insumo in insumos
+        ]
+
+
+def indice_catalogo(user_id: Optional[int]) -> IndiceCatalogo:
+    """Índice vigente del usuario; se arma la primera vez y cuando cambia la versión del catálogo."""
+    instantanea = instantanea_catalogo(user_id)
+    if instantanea is None:
+        # La transacción ya escribió al catálogo: índice de un solo uso con lo que ve la sesión
+        return IndiceCatalogo(construir_instantanea(user_id))
+    return instantanea.derivado("emparejamiento", IndiceCatalogo)
+
+
+def emparejar_insumos(user_id: Optional[int], insumos: List[Dict]) -> List[Dict]:
+    return indice_catalogo(user_id).resolver(insumos)
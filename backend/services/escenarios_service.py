@@ -0,0 +1,191 @@
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from backend.models import Proyecto, Partida, DetallePresupuesto
+from backend.extensions import db
+from backend.services.calculation_service import (
+    decimal_field,
+    cargar_planes,
+    precargar_insumos_de_planes,
+    costo_renglon,
+    obtener_factor_decimal,
+    obtener_factores_de_proyecto,
+)
+
+TIPOS_INSUMO = ("Material", "ManoObra", "Equipo", "Maquinaria")
+MAX_ESCENARIOS = 200
+
+
+def _flete_material(renglon: Tuple, material_cache: Dict) -> Decimal:
+    """Flete que el costo de un renglón Material incluye; no se escala con el precio."""
+    _, insumo_id, _, costo_fijo, _, flete, _ = renglon
+    if costo_fijo is not None:
+        return decimal_field(flete)
+    material = material_cache.get(insumo_id)
+    if material is None:
+        return Decimal("0")
+    if flete is not None:
+        return flete
+    return decimal_field(material.precio_flete_unitario)
+
+
+class ModeloCostos:
+    """Presupuesto de un proyecto expresado como total = W @ multiplicadores + constante.
+
+    Cada columna de W es un insumo (tipo, id) y cada renglón una partida. El valor es el
+    importe que aporta ese insumo a la partida con precios actuales, ya multiplicado por
+    cantidad_obra, el ajuste de mano de obra y los factores de sobrecosto del proyecto.
+    El flete de los materiales va en la constante porque no depende del precio del insumo.
+    """
+
+    def __init__(self, proyecto: Proyecto):
+        self.proyecto = proyecto
+        self.partidas: List[Tuple[int, str]] = [
+            (p.id, p.nombre_partida)
+            for p in Partida.query.filter_by(proyecto_id=proyecto.id).order_by(Partida.id)
+        ]
+        indice_partida = {pid: i for i, (pid, _) in enumerate(self.partidas)}
+
+        detalles = (
+            db.session.query(DetallePresupuesto.partida_id, DetallePresupuesto.concepto_id, DetallePresupuesto.cantidad_obra)
+            .join(Partida, DetallePresupuesto.partida_id == Partida.id)
+            .filter(Partida.proyecto_id == proyecto.id)
+            .all()
+        )
+        planes = cargar_planes({concepto_id for _, concepto_id, _ in detalles})
+        caches = precargar_insumos_de_planes(planes.values(), user_id=proyecto.user_id)
+        caches_por_tipo = dict(zip(TIPOS_INSUMO, caches))
+
+        factores = obtener_factores_de_proyecto(proyecto)
+        factor_mano_obra = float(obtener_factor_decimal(factores, "mano_obra"))
+        multiplicador = 1.0
+        for clave in ("indirectos", "financiamiento", "utilidad", "iva"):
+            multiplicador *= 1.0 + float(obtener_factor_decimal(factores, clave))
+
+        # Aportes por renglón del plan, calculados una sola vez por concepto.
+        aportes_concepto: Dict[int, List[Tuple[Tuple[str, int], float, float]]] = {}
+        self.slots: List[Tuple[str, int]] = []
+        indice_slot: Dict[Tuple[str, int], int] = {}
+        costos: Dict = {}
+        for concepto_id, plan in planes.items():
+            aportes = []
+            for renglon in plan.renglones:
+                tipo = renglon[0]
+                slot = (tipo, renglon[1])
+                costo = costo_renglon(renglon, caches_por_tipo, costos)
+                flete = _flete_material(renglon, caches[0]) if tipo == "Material" else Decimal("0")
+                cantidad = float(renglon[2])
+                ajuste = 1.0 + factor_mano_obra if tipo == "ManoObra" else 1.0
+                aportes.append((slot, cantidad * ajuste * float(costo - flete), cantidad * ajuste * float(flete)))
+                if slot not in indice_slot:
+                    indice_slot[slot] = len(self.slots)
+                    self.slots.append(slot)
+            aportes_concepto[concepto_id] = aportes
+
+        self.W = np.zeros((len(self.partidas), len(self.slots)))
+        self.constante = np.zeros(len(self.partidas))
+        for partida_id, concepto_id, cantidad_obra in detalles:
+            fila = indice_partida[partida_id]
+            escala = float(decimal_field(cantidad_obra)) * multiplicador
+            for slot, variable, fijo in aportes_concepto.get(concepto_id, []):
+                self.W[fila, indice_slot[slot]] += escala * variable
+                self.constante[fila] += escala * fijo
+
+        self.tipos_slot = np.array([tipo for tipo, _ in self.slots], dtype=object)
+        self.indice_slot = indice_slot
+
+    def multiplicadores(self, escenario: Dict) -> np.ndarray:
+        """Vector de multiplicadores por insumo: (1 + % por tipo) × (1 + % por insumo)."""
+        m = np.ones(len(self.slots))
+        for tipo, porcentaje in (escenario.get("tipos") or {}).items():
+            m[self.tipos_slot == tipo] *= 1.0 + float(decimal_field(porcentaje))
+        for item in escenario.get("insumos") or []:
+            slot = (item.get("tipo_insumo"), int(item.get("id_insumo") or 0))
+            indice = self.indice_slot.get(slot)
+            if indice is not None:
+                m[indice] *= 1.0 + float(decimal_field(item.get("porcentaje")))
+        return m
+
+    def evaluar(self, multiplicadores: np.ndarray) -> np.ndarray:
+        """Totales por partida para una matriz (escenarios × insumos) de multiplicadores."""
+        return multiplicadores @ self.W.T + self.constante
+
+
+def validar_escenarios(escenarios) -> Optional[str]:
+    if not isinstance(escenarios, list) or not escenarios:
+        return "'escenarios' debe ser una lista no vacía"
+    if len(escenarios) > MAX_ESCENARIOS:
+        return f"Máximo {MAX_ESCENARIOS} escenarios por llamada"
+    for escenario in escenarios:
+        if not isinstance(escenario, dict):
+            return "Cada escenario debe ser un objeto"
+        tipos = escenario.get("tipos") or {}
+        if not isinstance(tipos, dict) or any(t not in TIPOS_INSUMO for t in tipos):
+            return "'tipos' debe mapear Material, ManoObra, Equipo o Maquinaria a un porcentaje"
+        if not all(_es_porcentaje(p) for p in tipos.values()):
+            return "Los porcentajes de 'tipos' deben ser numéricos"
+        insumos = escenario.get("insumos") or []
+        if not isinstance(insumos, list):
+            return "'insumos' debe ser una lista"
+        for indice, item in enumerate(insumos):
+            if not isinstance(item, dict) or not _es_id(item.get("id_insumo")):
+                return f"insumos[{indice}] debe ser un objeto con id_insumo numérico"
+            if not _es_porcentaje(item.get("porcentaje")):
+                return f"insumos[{indice}].porcentaje debe ser numérico"
+    return None
+
+
+def _es_porcentaje(valor) -> bool:
+    if isinstance(valor, bool):
+        return False
+    try:
+        return decimal_field(valor).is_finite()
+    except (InvalidOperation, TypeError, ValueError):
+        return False
+
+
+def _es_id(valor) -> bool:
+    if isinstance(valor, bool) or (isinstance(valor, float) and not valor.is_integer()):
+        return False
+    try:
+        int(valor)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def simular_escenarios(proyecto: Proyecto, escenarios: List[Dict]) -> Dict:
+    inicio = time.perf_counter()
+    modelo = ModeloCostos(proyecto)
+    M = np.vstack([np.ones(len(modelo.slots))] + [modelo.multiplicadores(e) for e in escenarios])
+    totales = modelo.evaluar(M)
+    totales_proyecto = totales.sum(axis=1)
+
+    base_total = float(totales_proyecto[0])
+    resultado_escenarios = []
+    for k, escenario in enumerate(escenarios, start=1):
+        total = float(totales_proyecto[k])
+        resultado_escenarios.append({
+            "nombre": escenario.get("nombre") or f"Escenario {k}",
+            "total": total,
+            "variacion": total - base_total,
+            "variacion_porcentaje": (total - base_total) / base_total if base_total else 0.0,
+            "partidas": [
+                {"id": pid, "total": float(totales[k, i])} for i, (pid, _) in enumerate(modelo.partidas)
+            ],
+        })
+
+    return {
+        "proyecto_id": proyecto.id,
+        "base": {
+            "total": base_total,
+            "partidas": [
+                {"id": pid, "nombre_partida": nombre, "total": float(totales[0, i])}
+                for i, (pid, nombre) in enumerate(modelo.partidas)
+            ],
+        },
+        "escenarios": resultado_escenarios,
+        "insumos": len(modelo.slots),
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2),
+    }
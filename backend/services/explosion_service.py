@@ -0,0 +1,115 @@
+import time
+from typing import Dict, List
+from sqlalchemy import case, cast, func, literal
+from backend.models import Material, ManoObra, Equipo, Maquinaria, MatrizInsumo, DetallePresupuesto, Partida, Proyecto
+from backend.extensions import db
+from backend.services.escenarios_service import TIPOS_INSUMO
+
+# Explosión de insumos: cantidad total de cada insumo que pide un proyecto, agregada
+# en SQL. Los costos unitarios siguen las reglas de obtener_costo_insumo (override con
+# precio_custom, merma y flete del renglón, insumo borrado del catálogo); los importes
+# son a costo directo, sin ajuste de mano de obra ni factores de sobrecosto.
+
+
+def _real(expresion):
+    # SQLite divide enteros con división entera; los Numeric enteros se guardan como INTEGER.
+    return cast(expresion, db.Float)
+
+
+def _rendimiento(columna):
+    return case((func.coalesce(columna, 0) > 0, columna), else_=literal(1))
+
+
+def _expresiones(tipo: str):
+    """(modelo, nombre, unidad, costo unitario, merma) para el tipo de insumo."""
+    precio_custom = MatrizInsumo.precio_custom
+    con_override = func.coalesce(precio_custom, 0) > 0
+
+    if tipo == "Material":
+        merma_override = func.coalesce(MatrizInsumo.porcentaje_merma, 0)
+        merma_catalogo = func.coalesce(MatrizInsumo.porcentaje_merma, Material.porcentaje_merma, 0)
+        costo = case(
+            (con_override, precio_custom * (1 + merma_override) + func.coalesce(MatrizInsumo.precio_flete_unitario, 0)),
+            (Material.id.is_(None), literal(0)),
+            else_=Material.precio_unitario * (1 + merma_catalogo)
+            + func.coalesce(MatrizInsumo.precio_flete_unitario, Material.precio_flete_unitario, 0),
+        )
+        merma = case((con_override, merma_override), else_=merma_catalogo)
+        return Material, Material.nombre, Material.unidad, costo, merma
+
+    if tipo == "ManoObra":
+        costo = case(
+            (con_override, _real(precio_custom) / _rendimiento(MatrizInsumo.rendimiento_jornada)),
+            (ManoObra.id.is_(None), literal(0)),
+            else_=_real(ManoObra.salario_base * ManoObra.fasar) / _rendimiento(ManoObra.rendimiento_jornada),
+        )
+        return ManoObra, ManoObra.puesto, literal("jornada"), costo, literal(0)
+
+    if tipo == "Equipo":
+        costo = case(
+            (con_override, precio_custom),
+            (Equipo.id.is_(None), func.coalesce(precio_custom, 0)),
+            else_=Equipo.costo_hora_maq,
+        )
+        return Equipo, Equipo.nombre, Equipo.unidad, costo, literal(0)
+
+    costo = case(
+        (con_override, precio_custom),
+        (Maquinaria.id.is_(None), func.coalesce(precio_custom, 0)),
+        else_=_real(Maquinaria.costo_posesion_hora) / _rendimiento(Maquinaria.rendimiento_horario),
+    )
+    return Maquinaria, Maquinaria.nombre, literal("hora"), costo, literal(0)
+
+
+def _explosion_tipo(proyecto_id: int, tipo: str) -> List[Dict]:
+    modelo, nombre, unidad, costo, merma = _expresiones(tipo)
+    cantidad = _real(DetallePresupuesto.cantidad_obra * MatrizInsumo.cantidad)
+    filas = (
+        db.session.query(
+            MatrizInsumo.id_insumo,
+            nombre,
+            unidad,
+            func.sum(cantidad),
+            func.sum(cantidad * (1 + merma)),
+            func.sum(cantidad * costo),
+        )
+        .select_from(DetallePresupuesto)
+        .join(Partida, DetallePresupuesto.partida_id == Partida.id)
+        .join(MatrizInsumo, MatrizInsumo.concepto_id == DetallePresupuesto.concepto_id)
+        .outerjoin(modelo, modelo.id == MatrizInsumo.id_insumo)
+        .filter(Partida.proyecto_id == proyecto_id, MatrizInsumo.tipo_insumo == tipo)
+        .group_by(MatrizInsumo.id_insumo, nombre, unidad)
+    )
+    insumos = []
+    for insumo_id, nombre_insumo, unidad_insumo, cantidad_neta, cantidad_total, importe in filas:
+        cantidad_total = float(cantidad_total or 0)
+        importe = float(importe or 0)
+        insumos.append({
+            "tipo_insumo": tipo,
+            "id_insumo": insumo_id,
+            "nombre": nombre_insumo,
+            "unidad": unidad_insumo,
+            "cantidad": float(cantidad_neta or 0),
+            "cantidad_con_merma": cantidad_total,
+            "costo_unitario_promedio": importe / cantidad_total if cantidad_total else 0.0,
+            "importe": importe,
+        })
+    return insumos
+
+
+def explosion_insumos(proyecto: Proyecto) -> Dict:
+    """Una consulta agregada por tipo de insumo para todo el proyecto."""
+    inicio = time.perf_counter()
+    insumos: List[Dict] = []
+    totales_por_tipo: Dict[str, float] = {}
+    for tipo in TIPOS_INSUMO:
+        del_tipo = sorted(_explosion_tipo(proyecto.id, tipo), key=lambda i: -i["importe"])
+        totales_por_tipo[tipo] = sum(i["importe"] for i in del_tipo)
+        insumos.extend(del_tipo)
+    return {
+        "proyecto_id": proyecto.id,
+        "insumos": insumos,
+        "totales_por_tipo": totales_por_tipo,
+        "total": sum(totales_por_tipo.values()),
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2),
+    }
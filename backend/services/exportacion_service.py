@@ -0,0 +1,177 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date
+from decimal import Decimal
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from flask import Response, stream_with_context
+from sqlalchemy import and_, func
+from backend.models import Material, ManoObra, Equipo, Maquinaria, Concepto, MatrizInsumo, Proyecto, Partida, DetallePresupuesto
+from backend.extensions import db
+from backend.services.listado_service import consulta_catalogo, serializador
+
+# Exportaciones en streaming (CSV o NDJSON, opcionalmente gzip).
+#
+# Las consultas piden solo columnas y se recorren con yield_per, así que el driver entrega
+# las filas por bloques y nunca se arma la lista completa; la respuesta es un generador
+# que junta unos KiB de salida antes de cada envío. La sesión sigue abierta mientras dura
+# la descarga (stream_with_context).
+
+FILAS_POR_BLOQUE = 1000
+BYTES_POR_ENVIO = 64 * 1024
+FORMATOS = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+class ErrorExportacion(ValueError):
+    pass
+
+
+def formato_pedido(args: Dict) -> Tuple[str, bool]:
+    formato = (args.get("formato") or "csv").lower()
+    if formato not in FORMATOS:
+        raise ErrorExportacion("formato debe ser csv o ndjson")
+    return formato, (args.get("gzip") or "").lower() in ("1", "true", "si", "sí")
+
+
+def _valor_csv(valor):
+    if valor is None:
+        return ""
+    if isinstance(valor, bool):
+        return "true" if valor else "false"
+    return valor
+
+
+def _json_por_defecto(valor):
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, date):
+        return valor.isoformat()
+    raise TypeError(f"No serializable: {type(valor).__name__}")
+
+
+def _lineas(filas: Iterable[Dict], columnas: List[str], formato: str) -> Iterator[str]:
+    if formato == "ndjson":
+        for fila in filas:
+            yield json.dumps(fila, ensure_ascii=False, default=_json_por_defecto) + "\n"
+        return
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, lineterminator="\r\n")
+    escritor.writerow(columnas)
+    for fila in filas:
+        escritor.writerow([_valor_csv(fila.get(c)) for c in columnas])
+        if buffer.tell() >= BYTES_POR_ENVIO:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _bytes(lineas: Iterator[str], comprimir: bool) -> Iterator[bytes]:
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None  # wbits 31 = formato gzip
+    pendiente: List[bytes] = []
+    tamano = 0
+    for linea in lineas:
+        datos = linea.encode("utf-8")
+        if compresor:
+            datos = compresor.compress(datos)
+        if datos:
+            pendiente.append(datos)
+            tamano += len(datos)
+        if tamano >= BYTES_POR_ENVIO:
+            yield b"".join(pendiente)
+            pendiente, tamano = [], 0
+    if compresor:
+        pendiente.append(compresor.flush())
+    if pendiente:
+        yield b"".join(pendiente)
+
+
+def respuesta_exportacion(filas: Iterable[Dict], columnas: List[str], nombre: str, formato: str, comprimir: bool) -> Response:
+    """Respuesta de descarga que va generando el archivo conforme se leen las filas."""
+    extension = f"{formato}.gz" if comprimir else formato
+    respuesta = Response(
+        stream_with_context(_bytes(_lineas(filas, columnas, formato), comprimir)),
+        mimetype="application/gzip" if comprimir else FORMATOS[formato],
+    )
+    respuesta.headers["Content-Disposition"] = f'attachment; filename="{nombre}.{extension}"'
+    respuesta.headers["Cache-Control"] = "no-store"
+    return respuesta
+
+
+# --- Orígenes ---
+
+def filas_catalogo(modelo, user_id: Optional[int], args: Dict) -> Tuple[Iterator[Dict], List[str]]:
+    """Mismos campos y filtros que el listado del catálogo (fields, q, disciplina, calidad, obsoleto)."""
+    consulta, campos = consulta_catalogo(modelo, user_id, args)
+    return map(serializador(modelo, campos), consulta.yield_per(FILAS_POR_BLOQUE)), campos
+
+
+COLUMNAS_CONCEPTO = ["concepto_id", "clave", "descripcion", "unidad_concepto"]
+COLUMNAS_MATRIZ = ["renglon_id", "tipo_insumo", "id_insumo", "nombre_insumo", "cantidad", "porcentaje_merma",
+                   "precio_flete_unitario", "rendimiento_jornada", "factor_uso", "precio_custom", "unidad_custom"]
+
+
+def _consulta_conceptos(user_id: Optional[int]):
+    # Un renglón por insumo de la matriz (o uno vacío si el concepto no tiene matriz), con el
+    # nombre del insumo resuelto en la misma consulta.
+    uniones = [
+        (Material, Material.nombre, "Material"),
+        (ManoObra, ManoObra.puesto, "ManoObra"),
+        (Equipo, Equipo.nombre, "Equipo"),
+        (Maquinaria, Maquinaria.nombre, "Maquinaria"),
+    ]
+    consulta = db.session.query(
+        Concepto.id.label("concepto_id"), Concepto.clave, Concepto.descripcion, Concepto.unidad_concepto,
+        MatrizInsumo.id.label("renglon_id"), MatrizInsumo.tipo_insumo, MatrizInsumo.id_insumo,
+        func.coalesce(*(columna for _, columna, _ in uniones)).label("nombre_insumo"),
+        MatrizInsumo.cantidad, MatrizInsumo.porcentaje_merma, MatrizInsumo.precio_flete_unitario,
+        MatrizInsumo.rendimiento_jornada, MatrizInsumo.factor_uso, MatrizInsumo.precio_custom, MatrizInsumo.unidad_custom,
+    ).outerjoin(MatrizInsumo, MatrizInsumo.concepto_id == Concepto.id)
+    for modelo, _, tipo in uniones:
+        consulta = consulta.outerjoin(modelo, and_(MatrizInsumo.tipo_insumo == tipo, modelo.id == MatrizInsumo.id_insumo))
+    return consulta.filter(
+        (Concepto.user_id == user_id) | (Concepto.user_id.is_(None))
+    ).order_by(Concepto.clave, Concepto.id, MatrizInsumo.id)
+
+
+def filas_conceptos(user_id: Optional[int], formato: str) -> Tuple[Iterator[Dict], List[str]]:
+    """CSV: un renglón por insumo de la matriz. NDJSON: un concepto por línea con su "matriz"."""
+    filas = (dict(fila._mapping) for fila in _consulta_conceptos(user_id).yield_per(FILAS_POR_BLOQUE))
+    columnas = COLUMNAS_CONCEPTO + COLUMNAS_MATRIZ
+    if formato == "csv":
+        return filas, columnas
+
+    def agrupadas() -> Iterator[Dict]:
+        # Las filas vienen ordenadas por concepto, así que basta agrupar las consecutivas.
+        for _, renglones in groupby(filas, key=lambda f: f["concepto_id"]):
+            renglones = list(renglones)
+            concepto = {"id": renglones[0]["concepto_id"], **{c: renglones[0][c] for c in COLUMNAS_CONCEPTO[1:]}}
+            concepto["matriz"] = [
+                {"id": r["renglon_id"], **{c: r[c] for c in COLUMNAS_MATRIZ[1:]}}
+                for r in renglones if r["renglon_id"] is not None
+            ]
+            yield concepto
+
+    return agrupadas(), columnas
+
+
+COLUMNAS_PRESUPUESTO = ["partida_id", "nombre_partida", "detalle_id", "concepto_id", "clave", "descripcion",
+                        "unidad_concepto", "cantidad_obra", "precio_unitario_calculado", "costo_directo",
+                        "importe", "importe_costo_directo"]
+
+
+def filas_presupuesto(proyecto: Proyecto) -> Tuple[Iterator[Dict], List[str]]:
+    """Un renglón por concepto presupuestado, en el orden de partidas y detalles."""
+    consulta = db.session.query(
+        Partida.id.label("partida_id"), Partida.nombre_partida,
+        DetallePresupuesto.id.label("detalle_id"), Concepto.id.label("concepto_id"),
+        Concepto.clave, Concepto.descripcion, Concepto.unidad_concepto,
+        DetallePresupuesto.cantidad_obra, DetallePresupuesto.precio_unitario_calculado, DetallePresupuesto.costo_directo,
+        (DetallePresupuesto.cantidad_obra * DetallePresupuesto.precio_unitario_calculado).label("importe"),
+        (DetallePresupuesto.cantidad_obra * DetallePresupuesto.costo_directo).label("importe_costo_directo"),
+    ).join(DetallePresupuesto, DetallePresupuesto.partida_id == Partida.id).join(
+        Concepto, Concepto.id == DetallePresupuesto.concepto_id
+    ).filter(Partida.proyecto_id == proyecto.id).order_by(Partida.id, DetallePresupuesto.id)
+    return (dict(fila._mapping) for fila in consulta.yield_per(FILAS_POR_BLOQUE)), COLUMNAS_PRESUPUESTO
@@ -0,0 +1,216 @@
+import threading
+import time
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+from sqlalchemy import event, update
+from backend.models import ConstantesFASAR, ManoObra
+from backend.extensions import db
+from backend.services.versiones_service import RECURSO_FASAR, ambito, version_actual
+
+# Factor de Salario Real (FASAR) por trabajador, según la Ley del IMSS e INFONAVIT.
+#
+# Todo lo que depende solo de las constantes del usuario (UMA, tope de excedente,
+# prima de riesgo) o de los días de vacaciones (factor de integración, Tp/Ti) se
+# calcula una vez por ParametrosFASAR; por trabajador quedan solo las operaciones que
+# dependen del salario. El orden de las operaciones Decimal es el mismo que el cálculo
+# original, así que el resultado redondeado es idéntico.
+
+# Cuotas patronales sobre el SBC (prestaciones en dinero, gastos médicos, invalidez y
+# vida, guardería, INFONAVIT, SAR, cesantía y vejez), en el orden en que se suman.
+CUOTA_PRESTACIONES_DINERO = Decimal("0.007")
+CUOTA_GASTOS_MEDICOS = Decimal("0.0105")
+CUOTA_INVALIDEZ = Decimal("0.0175")
+CUOTA_GUARDERIA = Decimal("0.01")
+CUOTA_INFONAVIT = Decimal("0.05")
+CUOTA_SAR = Decimal("0.02")
+CUOTA_VEJEZ = Decimal("0.0315")
+DOMINGOS = 52
+
+
+# Días de vacaciones por años de antigüedad (Ley 2023): índice = años, hasta 20.
+# Menos de un año cuenta como el primero y más de 20 años da 30 días.
+TABLA_VACACIONES = (12, 12, 14, 16, 18, 20) + (22,) * 5 + (24,) * 5 + (26,) * 5
+VACACIONES_MAXIMAS = 30
+
+CAMPOS_CONSTANTES = (
+    "valor_uma", "salario_minimo_general", "dias_del_anio",
+    "dias_aguinaldo_minimos", "prima_vacacional_porcentaje",
+    "dias_festivos_obligatorios", "dias_festivos_costumbre",
+    "dias_mal_tiempo", "dias_riesgo_trabajo_promedio",
+    "dias_permisos_sindicales", "prima_riesgo_trabajo_patronal",
+    "impuesto_sobre_nomina",
+)
+
+# Cálculos memoizados por ParametrosFASAR antes de vaciar el memo.
+MAX_MEMO_FASAR = 10_000
+
+
+def dias_vacaciones(antiguedad_anios: Optional[int]) -> int:
+    antiguedad = 1 if antiguedad_anios is None else max(int(antiguedad_anios), 0)
+    if antiguedad < len(TABLA_VACACIONES):
+        return TABLA_VACACIONES[antiguedad]
+    return VACACIONES_MAXIMAS
+
+
+class ParametrosFASAR:
+    """Constantes de un usuario ya preparadas para calcular el FASAR de muchos trabajadores."""
+
+    def __init__(self, constantes: ConstantesFASAR):
+        self.constantes = constantes
+        self.uma = Decimal(constantes.valor_uma)
+        self.cuota_fija = self.uma * Decimal("0.204")  # 20.40% de la UMA
+        self.tope_excedente = self.uma * 3
+        self.prima_riesgo = Decimal(constantes.prima_riesgo_trabajo_patronal) / 100
+        self.impuesto_nomina = Decimal(constantes.impuesto_sobre_nomina)
+        self._por_vacaciones: Dict[int, Tuple[Decimal, Decimal]] = {}
+        self._memo: Dict[Tuple, Decimal] = {}
+
+    def factores_vacaciones(self, vac: int) -> Tuple[Decimal, Decimal]:
+        """(factor de integración, Tp/Ti) para unos días de vacaciones."""
+        if vac not in self._por_vacaciones:
+            c = self.constantes
+            # Factor de Integración Salarial: (365 + Aguinaldo + Prima Vacacional) / 365
+            dias_pagados_anio = Decimal(c.dias_del_anio) + Decimal(c.dias_aguinaldo_minimos) + (Decimal(vac) * Decimal(c.prima_vacacional_porcentaje))
+            factor_integracion = dias_pagados_anio / Decimal(c.dias_del_anio)
+            # Días realmente trabajados al año (Ti)
+            ti = (Decimal(c.dias_del_anio)
+                  - DOMINGOS
+                  - Decimal(vac)
+                  - Decimal(c.dias_festivos_obligatorios)
+                  - Decimal(c.dias_festivos_costumbre)
+                  - Decimal(c.dias_mal_tiempo)
+                  - Decimal(c.dias_riesgo_trabajo_promedio)
+                  - Decimal(c.dias_permisos_sindicales))
+            tp_ti = dias_pagados_anio / ti if ti > 0 else Decimal("1.0")
+            self._por_vacaciones[vac] = (factor_integracion, tp_ti)
+        return self._por_vacaciones[vac]
+
+    def fasar(self, salario_base, antiguedad_anios: Optional[int]) -> Decimal:
+        """FASAR de un trabajador; es función pura del salario y del tramo de vacaciones."""
+        vac = dias_vacaciones(antiguedad_anios)
+        llave = (Decimal(salario_base), vac)
+        resultado = self._memo.get(llave)
+        if resultado is None:
+            if len(self._memo) >= MAX_MEMO_FASAR:
+                self._memo.clear()
+            resultado = self._memo[llave] = self._calcular(llave[0], vac)
+        return resultado
+
+    def _calcular(self, salario: Decimal, vac: int) -> Decimal:
+        factor_integracion, tp_ti = self.factores_vacaciones(vac)
+        sbc = salario * factor_integracion  # Salario Base de Cotización
+
+        # Excedente (1.10% de lo que exceda 3 UMAs)
+        exc = Decimal("0")
+        if sbc > self.tope_excedente:
+            exc = (sbc - self.tope_excedente) * Decimal("0.011")
+
+        cargas_sociales_dia = (
+            self.cuota_fija + exc
+            + sbc * CUOTA_PRESTACIONES_DINERO
+            + sbc * CUOTA_GASTOS_MEDICOS
+            + sbc * self.prima_riesgo
+            + sbc * CUOTA_INVALIDEZ
+            + sbc * CUOTA_GUARDERIA
+            + sbc * CUOTA_INFONAVIT
+            + sbc * CUOTA_SAR
+            + sbc * CUOTA_VEJEZ
+            + salario * self.impuesto_nomina
+        )
+        # FSR = (CargasSocialesDia / SalarioBase) + (DíasPagados / DíasTrabajados)
+        fsr = (cargas_sociales_dia / salario) + tp_ti
+        return fsr.quantize(Decimal("0.0001"))
+
+
+# --- Lectura sin efectos secundarios ---
+# Las constantes de cada usuario se guardan en memoria junto con su versión
+# (RECURSO_FASAR en versiones_service); POST /fasar incrementa la versión y la
+# siguiente lectura, en cualquier worker, vuelve a cargarlas. Leer nunca inserta:
+# si el usuario no tiene fila se usan los valores por defecto del modelo.
+#
+# Si la transacción en curso ya cambió las constantes (POST /fasar recalcula antes de
+# hacer commit) se leen de la sesión sin guardarlas: la versión todavía puede
+# deshacerse y quedaría en el cache con valores que nunca se guardaron.
+_cache_parametros: Dict[int, Tuple[int, ParametrosFASAR]] = {}
+_lock_cache = threading.Lock()
+_ESCRITURA_FASAR = "escritura_fasar"
+
+
+@event.listens_for(db.session, "after_flush")
+def _marcar_flush(session, _contexto):
+    if any(isinstance(objeto, ConstantesFASAR) for objeto in (*session.new, *session.dirty, *session.deleted)):
+        session.info[_ESCRITURA_FASAR] = True
+
+
+@event.listens_for(db.session, "after_transaction_end")
+def _fin_transaccion(session, transaccion):
+    if transaccion.parent is None:
+        session.info.pop(_ESCRITURA_FASAR, None)
+
+
+def _copia_constantes(user_id: Optional[int], fila: Optional[ConstantesFASAR]) -> ConstantesFASAR:
+    """Instancia transitoria (fuera de la sesión) con los valores de la fila o los por defecto."""
+    if fila is None:
+        columnas = ConstantesFASAR.__table__.c
+        valores = {campo: columnas[campo].default.arg for campo in CAMPOS_CONSTANTES}
+        return ConstantesFASAR(id=None, user_id=user_id, **valores)
+    return ConstantesFASAR(id=fila.id, user_id=fila.user_id, **{campo: getattr(fila, campo) for campo in CAMPOS_CONSTANTES})
+
+
+def parametros_fasar(user_id: Optional[int]) -> ParametrosFASAR:
+    user_ambito = ambito(user_id)
+    # La consulta de la versión hace autoflush, así que los cambios pendientes ya marcaron la sesión.
+    version = version_actual(RECURSO_FASAR, user_id)
+    if db.session.info.get(_ESCRITURA_FASAR):
+        fila = ConstantesFASAR.query.filter_by(user_id=user_id or None).order_by(ConstantesFASAR.id).first()
+        return ParametrosFASAR(_copia_constantes(user_id or None, fila))
+    with _lock_cache:
+        guardado = _cache_parametros.get(user_ambito)
+    if guardado is not None and guardado[0] == version:
+        return guardado[1]
+
+    fila = ConstantesFASAR.query.filter_by(user_id=user_id or None).order_by(ConstantesFASAR.id).first()
+    parametros = ParametrosFASAR(_copia_constantes(user_id or None, fila))
+    with _lock_cache:
+        _cache_parametros[user_ambito] = (version, parametros)
+    return parametros
+
+
+def limpiar_cache_fasar() -> None:
+    with _lock_cache:
+        _cache_parametros.clear()
+
+
+def obtener_constantes(user_id: Optional[int]) -> ConstantesFASAR:
+    """Constantes FASAR vigentes del usuario, de solo lectura. No escribe en la base."""
+    return parametros_fasar(user_id).constantes
+
+
+def recalcular_fasar_usuario(user_id: Optional[int]) -> Dict:
+    """Recalcula el FASAR de toda la mano de obra del usuario con un UPDATE masivo.
+
+    Las constantes salen del cache por usuario y los trabajadores con el mismo salario y
+    tramo de vacaciones comparten el cálculo. Solo se escriben los que cambian. No hace commit.
+    """
+    inicio = time.perf_counter()
+    parametros = parametros_fasar(user_id)
+    filas = db.session.query(ManoObra.id, ManoObra.salario_base, ManoObra.antiguedad_anios, ManoObra.fasar).filter(
+        ManoObra.user_id == user_id
+    )
+
+    cambios = []
+    trabajadores = 0
+    for mano_id, salario_base, antiguedad, fasar_actual in filas:
+        trabajadores += 1
+        nuevo = parametros.fasar(salario_base, antiguedad)
+        if fasar_actual is None or Decimal(fasar_actual).quantize(Decimal("0.0001")) != nuevo:
+            cambios.append({"id": mano_id, "fasar": nuevo})
+
+    if cambios:
+        db.session.execute(update(ManoObra), cambios)
+
+    return {
+        "trabajadores": trabajadores,
+        "actualizados": len(cambios),
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2),
+    }
@@ -3,6 +3,10 @@ import re
 import google.genai as genai
 from typing import Optional, Dict, List
 from backend.models import Material, ManoObra, Equipo, Maquinaria
+from backend.extensions import db
+from backend.services.busqueda_service import buscar
+from backend.services.catalogo_cache_service import instantanea_catalogo
+from backend.services.emparejamiento_service import emparejar_insumos, normalizar_tipo
 from backend.config import Config
 import sys
 
@@ -408,35 +412,22 @@ def construir_sugerencia_apu(descripcion: str, user_id: int, concepto_id: Option
     texto = descripcion_original.lower()
     sugerencias: List[Dict] = []
 
-    materiales = list(Material.query.filter((Material.user_id == user_id) | (Material.user_id == None)).all())
-    mano_obra = list(ManoObra.query.filter((ManoObra.user_id == user_id) | (ManoObra.user_id == None)).all())
-    equipo = list(Equipo.query.filter((Equipo.user_id == user_id) | (Equipo.user_id == None)).all())
-    maquinaria = list(Maquinaria.query.filter((Maquinaria.user_id == user_id) | (Maquinaria.user_id == None)).all())
+    # Los insumos se buscan en el índice FTS en lugar de recorrer los catálogos completos;
+    # si la palabra no aparece se usa el primer registro del catálogo, como antes. Los
+    # registros salen de la instantánea del catálogo del usuario.
+    instantanea = instantanea_catalogo(user_id)
 
-    # Helper functions within scope
     def match_material(keyword: str) -> Optional[Material]:
-        if not materiales: return None
-        for item in materiales:
-            if keyword in item.nombre.lower(): return item
-        return materiales[0]
+        return _buscar_insumo(Material, "Material", keyword, user_id, instantanea)
 
     def match_mano_obra(keyword: str) -> Optional[ManoObra]:
-        if not mano_obra: return None
-        for item in mano_obra:
-            if keyword in (item.puesto or "").lower(): return item
-        return mano_obra[0]
+        return _buscar_insumo(ManoObra, "ManoObra", keyword, user_id, instantanea)
 
     def match_equipo(keyword: str) -> Optional[Equipo]:
-        if not equipo: return None
-        for item in equipo:
-            if keyword in item.nombre.lower(): return item
-        return equipo[0]
+        return _buscar_insumo(Equipo, "Equipo", keyword, user_id, instantanea)
 
     def match_maquinaria(keyword: str) -> Optional[Maquinaria]:
-        if not maquinaria: return None
-        for item in maquinaria:
-            if keyword in item.nombre.lower(): return item
-        return maquinaria[0]
+        return _buscar_insumo(Maquinaria, "Maquinaria", keyword, user_id, instantanea)
 
     # Heuristics (Simplified for brevity but functional based on original)
     # ... (Logic copied/adapted from app.py) ...
@@ -459,11 +450,26 @@ def construir_sugerencia_apu(descripcion: str, user_id: int, concepto_id: Option
 
     # Generic Fallback
     if not sugerencias:
-        if materiales: sugerencias.append(_make_sugerencia("Material", materiales[0], 1, "Material Genérico"))
-        if mano_obra: sugerencias.append(_make_sugerencia("ManoObra", mano_obra[0], 0.1, "Mano de Obra Genérica"))
+        material = _primer_insumo(Material, "Material", user_id, instantanea)
+        if material: sugerencias.append(_make_sugerencia("Material", material, 1, "Material Genérico"))
+        mano = _primer_insumo(ManoObra, "ManoObra", user_id, instantanea)
+        if mano: sugerencias.append(_make_sugerencia("ManoObra", mano, 0.1, "Mano de Obra Genérica"))
 
     return sugerencias
 
+def _primer_insumo(modelo, tipo: str, user_id: int, instantanea=None):
+    if instantanea is not None:
+        return instantanea.primero(tipo)
+    return modelo.query.filter((modelo.user_id == user_id) | (modelo.user_id == None)).order_by(modelo.id).first()
+
+def _buscar_insumo(modelo, tipo: str, keyword: str, user_id: int, instantanea=None):
+    # Un solo resultado: se ordenan todas las coincidencias, no solo las más recientes
+    for resultado in buscar(keyword, user_id, tipos=(tipo,), limite=1, max_candidatos=None):
+        insumo = instantanea.obtener(tipo, resultado["id"]) if instantanea is not None else db.session.get(modelo, resultado["id"])
+        if insumo:
+            return insumo
+    return _primer_insumo(modelo, tipo, user_id, instantanea)
+
 def _make_sugerencia(tipo, obj, cantidad, justificacion, rendimiento=None):
     insumo_id = obj.id
     nombre = getattr(obj, "nombre", getattr(obj, "puesto", ""))
@@ -491,21 +497,24 @@ def construir_matriz_desde_gemini(data_gemini: Dict, user_id: int) -> List[Dict]
     insumos_ia = data_gemini.get("insumos") or []
     sugerencias = []
 
-    materiales = list(Material.query.filter((Material.user_id == user_id) | (Material.user_id == None)).all())
-    # ... load others ...
-
-    # Logic to fuzzy match existing catalog items to Gemini's suggestion
-    # For now, we return the raw suggestions from Gemini with ID=0 if not found
+    # Cada insumo sugerido se empareja con el catálogo del usuario en una sola pasada;
+    # si la confianza no alcanza el umbral se devuelve con insumo_id 0 como sugerencia.
+    coincidencias = emparejar_insumos(user_id, insumos_ia)
 
-    for item in insumos_ia:
+    for item, coincidencia in zip(insumos_ia, coincidencias):
+        existe = coincidencia["insumo_id"] is not None
         sugerencias.append({
-            "tipo_insumo": item.get("tipo_insumo", "Material"),
-            "insumo_id": 0, # Should try to match
+            "tipo_insumo": normalizar_tipo(item.get("tipo_insumo")),
+            "insumo_id": coincidencia["insumo_id"] if existe else 0,
             "nombre": item.get("nombre"),
             "unidad": item.get("unidad"),
             "cantidad": item.get("cantidad"),
             "precio_unitario_temp": item.get("precio_sugerido") or 0,
-            "justificacion_breve": "Sugerido por IA"
+            "justificacion_breve": "Sugerido por IA",
+            "existe_en_catalogo": existe,
+            "confianza": coincidencia["confianza"],
+            "nombre_catalogo": coincidencia["nombre_catalogo"],
+            "costo_unitario": coincidencia["costo_unitario"] if existe else None,
         })
 
     return sugerencias
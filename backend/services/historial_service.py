@@ -0,0 +1,194 @@
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import case, event, func, inspect, insert, select, text
+from backend.models import Material, ManoObra, Equipo, Maquinaria, HistorialPrecio, costo_posesion_por_hora
+from backend.extensions import db
+from backend.services.calculation_service import en_bloques
+from backend.services.fasar_service import parametros_fasar
+
+# Historial de precios del catálogo. Cada tipo de insumo tiene una columna de precio de
+# referencia, la misma que actualizar_precios_masivo recibe como "nuevo_precio".
+#
+# La tabla es de solo inserción (triggers de SQLite rechazan UPDATE y DELETE). Las
+# escrituras masivas (importación, actualización masiva) arman sus filas con
+# cambio_de_precio; las ediciones por ORM se registran solas en after_flush.
+
+COLUMNA_PRECIO = {
+    "Material": "precio_unitario",
+    "ManoObra": "salario_base",
+    "Equipo": "costo_hora_maq",
+    "Maquinaria": "costo_adquisicion",
+}
+MODELOS = {"Material": Material, "ManoObra": ManoObra, "Equipo": Equipo, "Maquinaria": Maquinaria}
+TIPOS_POR_MODELO = {modelo: tipo for tipo, modelo in MODELOS.items()}
+FUENTE_EDICION = "edicion"
+ESCALA_COSTO_POSESION = Decimal("0.0001")
+
+_TRIGGERS_SOLO_INSERCION = [
+    f"CREATE TRIGGER IF NOT EXISTS historial_precios_sin_{operacion.lower()} BEFORE {operacion} ON historial_precios "
+    "BEGIN SELECT RAISE(ABORT, 'historial_precios es de solo inserción'); END"
+    for operacion in ("UPDATE", "DELETE")
+]
+
+
+class ErrorHistorial(ValueError):
+    pass
+
+
+def fecha_pedida(valor) -> Optional[date]:
+    """Fecha AAAA-MM-DD de un parámetro opcional ("a la fecha")."""
+    if not valor:
+        return None
+    try:
+        return date.fromisoformat(str(valor))
+    except ValueError:
+        raise ErrorHistorial("fecha debe tener formato AAAA-MM-DD")
+
+
+def proteger_historial(conn) -> None:
+    """Crea los triggers que hacen el historial de solo inserción (idempotente)."""
+    for sentencia in _TRIGGERS_SOLO_INSERCION:
+        conn.execute(text(sentencia))
+
+
+@event.listens_for(HistorialPrecio.__table__, "after_create")
+def _proteger_al_crear_tabla(_tabla, conn, **_kw):
+    if conn.dialect.name == "sqlite":
+        proteger_historial(conn)
+
+
+def cambio_de_precio(user_id: Optional[int], tipo: str, insumo_id: int, anterior: Optional[Decimal], nuevo: Decimal,
+                     fuente: str, fecha: Optional[datetime] = None) -> Optional[Dict]:
+    """Fila de historial si el precio cambió (o si el insumo es nuevo); None si quedó igual."""
+    if anterior is not None and Decimal(anterior) == Decimal(nuevo):
+        return None
+    return {
+        "user_id": user_id,
+        "tipo_insumo": tipo,
+        "id_insumo": insumo_id,
+        "precio_anterior": anterior,
+        "precio_nuevo": nuevo,
+        "fuente": fuente,
+        "fecha": fecha or datetime.utcnow(),
+    }
+
+
+def registrar_cambios(cambios: List[Dict]) -> int:
+    """Inserta las filas de historial con un solo executemany. No hace commit."""
+    if cambios:
+        db.session.execute(insert(HistorialPrecio), cambios)
+    return len(cambios)
+
+
+@event.listens_for(db.session, "after_flush")
+def _registrar_ediciones(session, _contexto):
+    # Altas y cambios de precio hechos con el ORM (rutas CRUD, semillas, IA). En after_flush
+    # los objetos ya tienen id y el historial de atributos todavía no se reinicia.
+    ahora = datetime.utcnow()
+    cambios = []
+    for insumo in list(session.new) + list(session.dirty):
+        tipo = TIPOS_POR_MODELO.get(type(insumo))
+        if tipo is None:
+            continue
+        historia = inspect(insumo).attrs[COLUMNA_PRECIO[tipo]].history
+        if insumo not in session.new and not historia.has_changes():
+            continue
+        anterior = historia.deleted[0] if historia.deleted else None
+        nuevo = getattr(insumo, COLUMNA_PRECIO[tipo])
+        if nuevo is None:
+            continue
+        registro = cambio_de_precio(insumo.user_id, tipo, insumo.id, anterior, nuevo, FUENTE_EDICION, ahora)
+        if registro:
+            cambios.append(registro)
+    if cambios:
+        session.connection().execute(insert(HistorialPrecio.__table__), cambios)
+
+
+def historial_de_insumo(tipo: str, insumo_id: int) -> List[Dict]:
+    """Cambios de precio de un insumo, del más antiguo al más reciente."""
+    filas = HistorialPrecio.query.filter_by(tipo_insumo=tipo, id_insumo=insumo_id).order_by(
+        HistorialPrecio.fecha, HistorialPrecio.id
+    )
+    return [fila.to_dict() for fila in filas]
+
+
+def deriva_de_precio(tipo: str, insumo) -> Dict:
+    """Historial de un insumo y cuánto se movió su precio desde el primer valor registrado."""
+    cambios = historial_de_insumo(tipo, insumo.id)
+    actual = float(getattr(insumo, COLUMNA_PRECIO[tipo]) or 0)
+    inicial = None
+    if cambios:
+        primero = cambios[0]
+        inicial = primero["precio_anterior"] if primero["precio_anterior"] is not None else primero["precio_nuevo"]
+    variacion = actual - inicial if inicial is not None else 0.0
+    return {
+        "tipo_insumo": tipo,
+        "id_insumo": insumo.id,
+        "precio_actual": actual,
+        "precio_inicial": inicial,
+        "variacion": variacion,
+        "variacion_porcentaje": variacion / inicial if inicial else 0.0,
+        "cambios": cambios,
+    }
+
+
+def _limite(fecha: date) -> datetime:
+    # "A la fecha X" incluye todos los cambios de ese día
+    return datetime.combine(fecha + timedelta(days=1), time.min)
+
+
+def precios_a_fecha(tipo: str, insumo_ids: Iterable[int], fecha: date) -> Dict[int, Decimal]:
+    """Precio de referencia de cada insumo al cierre de fecha, con una consulta por bloque de ids.
+
+    Es el precio_nuevo del último cambio hasta esa fecha o, si todos los cambios son
+    posteriores, el precio_anterior del primero. Los insumos sin historial (o creados
+    después de la fecha) no aparecen: su precio es el vigente.
+    """
+    h = HistorialPrecio
+    antes = h.fecha < _limite(fecha)
+    posicion = func.row_number().over(
+        partition_by=h.id_insumo,
+        order_by=(case((antes, 0), else_=1), case((antes, h.fecha)).desc(), h.fecha,
+                  case((antes, h.id), else_=-h.id).desc()),
+    )
+    precios: Dict[int, Decimal] = {}
+    for bloque in en_bloques(sorted(set(insumo_ids))):
+        candidatos = select(
+            h.id_insumo, case((antes, h.precio_nuevo), else_=h.precio_anterior).label("precio"), posicion.label("posicion")
+        ).where(h.tipo_insumo == tipo, h.id_insumo.in_(bloque)).subquery()
+        filas = db.session.execute(
+            select(candidatos.c.id_insumo, candidatos.c.precio).where(candidatos.c.posicion == 1)
+        )
+        precios.update({insumo_id: Decimal(precio) for insumo_id, precio in filas if precio is not None})
+    return precios
+
+
+def _insumo_a_fecha(tipo: str, insumo, precio: Decimal) -> SimpleNamespace:
+    # Copia de solo lectura con el precio histórico y sus derivados; el objeto del ORM no se toca.
+    valores = {columna.key: getattr(insumo, columna.key) for columna in insumo.__table__.columns}
+    valores[COLUMNA_PRECIO[tipo]] = precio
+    if tipo == "ManoObra":
+        valores["fasar"] = parametros_fasar(insumo.user_id).fasar(precio, insumo.antiguedad_anios)
+    elif tipo == "Maquinaria":
+        valores["costo_posesion_hora"] = costo_posesion_por_hora(
+            precio, insumo.vida_util_horas, insumo.tasa_interes_anual
+        ).quantize(ESCALA_COSTO_POSESION)
+    return SimpleNamespace(**valores)
+
+
+def caches_a_fecha(caches: Iterable[Dict], fecha: date) -> tuple:
+    """Caches de insumos (Material, ManoObra, Equipo, Maquinaria) con los precios a esa fecha.
+
+    FASAR y costo de posesión se recalculan con el precio histórico y las constantes y
+    parámetros vigentes del insumo.
+    """
+    resultado = []
+    for tipo, cache in zip(MODELOS, caches):
+        historicos = precios_a_fecha(tipo, cache.keys(), fecha) if cache else {}
+        resultado.append({
+            insumo_id: _insumo_a_fecha(tipo, insumo, historicos[insumo_id]) if insumo_id in historicos else insumo
+            for insumo_id, insumo in cache.items()
+        })
+    return tuple(resultado)
@@ -0,0 +1,404 @@
+import csv
+import io
+import itertools
+import re
+import time
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import ParseError, iterparse
+from sqlalchemy import Integer, Numeric, insert, update
+from backend.models import ManoObra, Maquinaria, costo_posesion_por_hora
+from backend.extensions import db
+from backend.services.busqueda_service import normalizar
+from backend.services.fasar_service import parametros_fasar
+from backend.services.historial_service import COLUMNA_PRECIO, MODELOS, cambio_de_precio, registrar_cambios
+from backend.services.recalculo_service import recalcular_por_insumos
+from backend.services.versiones_service import RECURSO_CATALOGO, incrementar_version
+
+# Importación masiva de listas de precios de proveedores (CSV o XLSX).
+#
+# El archivo se lee fila por fila (csv.reader sobre el stream; el XLSX con iterparse
+# sobre el XML de la hoja, sin cargarla) y se procesa en lotes de TAMANO_LOTE filas:
+# cada lote consulta los insumos que ya existen, inserta los nuevos y actualiza los que
+# cambiaron con un executemany, recalcula FASAR y costo de posesión, deja una fila de
+# historial por precio modificado y hace commit. La llave es el nombre normalizado (sin
+# acentos ni mayúsculas) dentro del catálogo del usuario; en memoria solo se guarda ese
+# mapa nombre -> id, no las filas del archivo.
+
+TAMANO_LOTE = 1000
+MAX_ERRORES_REPORTADOS = 500
+FUENTE_IMPORTACION = "importacion"
+FORMATOS = {".csv": "csv", ".txt": "csv", ".xlsx": "xlsx"}
+
+# tipo -> (columnas obligatorias, columnas opcionales); la primera obligatoria es el nombre.
+CAMPOS_IMPORTACION = {
+    "Material": (("nombre", "unidad", "precio_unitario"),
+                 ("disciplina", "calidad", "porcentaje_merma", "precio_flete_unitario")),
+    "ManoObra": (("puesto", "salario_base"), ("antiguedad_anios", "rendimiento_jornada", "disciplina", "calidad")),
+    "Equipo": (("nombre", "unidad", "costo_hora_maq"), ("disciplina", "calidad")),
+    "Maquinaria": (("nombre", "costo_adquisicion", "vida_util_horas"),
+                   ("tasa_interes_anual", "rendimiento_horario", "disciplina", "calidad")),
+}
+# Encabezados alternativos comunes en listas de proveedores.
+ALIAS_ENCABEZADOS = {"precio": "precio", "costo": "precio", "salario": "precio", "descripcion": "nombre", "insumo": "nombre"}
+
+
+class ErrorImportacion(ValueError):
+    pass
+
+
+def nombre_normalizado(nombre: str) -> str:
+    return " ".join(normalizar(nombre).split())
+
+
+# --- Lectura en streaming ---
+
+def _filas_csv(archivo: BinaryIO) -> Iterator[Tuple[int, List[str]]]:
+    texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", newline="")
+    try:
+        primera = texto.readline()
+        # Excel en español exporta con punto y coma
+        delimitador = max(",;\t", key=primera.count) if primera else ","
+        lector = csv.reader(itertools.chain([primera], texto), delimiter=delimitador)
+        for numero, valores in enumerate(lector, start=1):
+            yield numero, valores
+    except UnicodeDecodeError:
+        raise ErrorImportacion("El CSV debe estar codificado en UTF-8")
+    finally:
+        texto.detach()
+
+
+_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_PAQUETE = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+
+def _cadenas_compartidas(libro: zipfile.ZipFile) -> List[str]:
+    if "xl/sharedStrings.xml" not in libro.namelist():
+        return []
+    cadenas = []
+    with libro.open("xl/sharedStrings.xml") as contenido:
+        for _, elem in iterparse(contenido):
+            if elem.tag == _NS + "si":
+                partes = elem.findall(_NS + "t") + elem.findall(f"{_NS}r/{_NS}t")
+                cadenas.append("".join(t.text or "" for t in partes))
+                elem.clear()
+    return cadenas
+
+
+def _primera_hoja(libro: zipfile.ZipFile) -> str:
+    try:
+        with libro.open("xl/workbook.xml") as contenido:
+            hoja = next(e for _, e in iterparse(contenido) if e.tag == _NS + "sheet")
+        with libro.open("xl/_rels/workbook.xml.rels") as contenido:
+            destinos = {e.get("Id"): e.get("Target") for _, e in iterparse(contenido) if e.tag == _NS_PAQUETE + "Relationship"}
+        destino = destinos[hoja.get(_NS_REL + "id")]
+    except (KeyError, StopIteration):
+        return "xl/worksheets/sheet1.xml"
+    return destino.lstrip("/") if destino.startswith("/") else f"xl/{destino}"
+
+
+def _indice_columna(referencia: str) -> int:
+    indice = 0
+    for letra in re.match(r"[A-Z]+", referencia).group():
+        indice = indice * 26 + ord(letra) - ord("A") + 1
+    return indice - 1
+
+
+def _valor_celda(celda, compartidas: List[str]) -> str:
+    tipo = celda.get("t")
+    if tipo == "inlineStr":
+        return "".join(t.text or "" for t in celda.iter(_NS + "t"))
+    valor = celda.findtext(_NS + "v") or ""
+    if tipo == "s" and valor:
+        return compartidas[int(valor)]
+    return valor
+
+
+def _filas_xlsx(archivo: BinaryIO) -> Iterator[Tuple[int, List[str]]]:
+    try:
+        libro = zipfile.ZipFile(archivo)
+    except zipfile.BadZipFile:
+        raise ErrorImportacion("El archivo XLSX no es válido")
+    with libro:
+        try:
+            compartidas = _cadenas_compartidas(libro)
+            with libro.open(_primera_hoja(libro)) as hoja:
+                datos = None
+                for evento, elem in iterparse(hoja, events=("start", "end")):
+                    if evento == "start":
+                        if elem.tag == _NS + "sheetData":
+                            datos = elem
+                        continue
+                    if elem.tag != _NS + "row":
+                        continue
+                    valores: List[str] = []
+                    for celda in elem.iter(_NS + "c"):
+                        referencia = celda.get("r")
+                        columna = _indice_columna(referencia) if referencia else len(valores)
+                        valores.extend([""] * (columna - len(valores)))
+                        valores.append(_valor_celda(celda, compartidas))
+                    yield int(elem.get("r")), valores
+                    # Las filas ya leídas se sueltan para que la memoria no crezca con la hoja
+                    if datos is not None:
+                        datos.clear()
+        except (KeyError, ParseError):
+            raise ErrorImportacion("El archivo XLSX no es válido")
+
+
+# --- Validación ---
+
+def _encabezado(valor: str) -> str:
+    return re.sub(r"[\s\-/]+", "_", nombre_normalizado(valor))
+
+
+def _columnas_del_archivo(tipo: str, encabezados: List[str]) -> Tuple[Dict[int, str], List[str]]:
+    obligatorias, opcionales = CAMPOS_IMPORTACION[tipo]
+    alias = {"precio": COLUMNA_PRECIO[tipo], "nombre": obligatorias[0]}
+    conocidas = set(obligatorias) | set(opcionales)
+    columnas, ignoradas = {}, []
+    for posicion, valor in enumerate(encabezados):
+        nombre = _encabezado(valor)
+        nombre = alias.get(ALIAS_ENCABEZADOS.get(nombre, nombre), nombre)
+        if nombre in conocidas and nombre not in columnas.values():
+            columnas[posicion] = nombre
+        elif valor.strip():
+            ignoradas.append(valor.strip())
+    faltantes = [c for c in obligatorias if c not in columnas.values()]
+    if faltantes:
+        raise ErrorImportacion(f"Faltan columnas: {', '.join(faltantes)}")
+    return columnas, ignoradas
+
+
+def _decimal(valor: str) -> Decimal:
+    texto = valor.replace("$", "").replace(" ", "").strip()
+    if "," in texto and "." in texto:
+        # El separador que aparece primero es el de miles: 1,234.50 o 1.234,50
+        miles, decimal = (",", ".") if texto.index(",") < texto.index(".") else (".", ",")
+        texto = texto.replace(miles, "").replace(decimal, ".")
+    elif texto.count(",") == 1 and not re.search(r",\d{3}$", texto):
+        texto = texto.replace(",", ".")
+    else:
+        texto = texto.replace(",", "")
+    return Decimal(texto)
+
+
+def _convertir(valor: str, columna) -> object:
+    if isinstance(columna.type, Numeric):
+        numero = _decimal(valor)
+        if not numero.is_finite() or numero < 0:
+            raise ValueError(f"{columna.name} debe ser un número no negativo")
+        if columna.type.scale is not None:
+            numero = numero.quantize(Decimal(1).scaleb(-columna.type.scale))
+        return numero
+    if isinstance(columna.type, Integer):
+        numero = _decimal(valor)
+        if numero != numero.to_integral_value() or numero < 0:
+            raise ValueError(f"{columna.name} debe ser un entero no negativo")
+        return int(numero)
+    texto = valor.strip()
+    if columna.type.length and len(texto) > columna.type.length:
+        raise ValueError(f"{columna.name} excede {columna.type.length} caracteres")
+    return texto
+
+
+def _validar_fila(valores: List[str], columnas: Dict[int, str], tabla, obligatorias) -> Dict:
+    fila = {}
+    for posicion, nombre in columnas.items():
+        valor = valores[posicion].strip() if posicion < len(valores) else ""
+        if not valor:
+            continue
+        try:
+            fila[nombre] = _convertir(valor, tabla[nombre])
+        except InvalidOperation:
+            raise ValueError(f"{nombre} no es un número válido: {valor}")
+    faltantes = [c for c in obligatorias if c not in fila]
+    if faltantes:
+        raise ValueError(f"Falta {', '.join(faltantes)}")
+    return fila
+
+
+# --- Escritura por lotes ---
+
+class _Importacion:
+    def __init__(self, tipo: str, user_id: Optional[int], fuente: str):
+        self.tipo = tipo
+        self.user_id = user_id
+        self.fuente = fuente
+        self.modelo = MODELOS[tipo]
+        self.tabla = self.modelo.__table__.c
+        self.obligatorias, self.opcionales = CAMPOS_IMPORTACION[tipo]
+        self.columna_nombre = self.obligatorias[0]
+        self.columna_precio = COLUMNA_PRECIO[tipo]
+        self.nombre_unico = bool(self.tabla[self.columna_nombre].unique)
+        self.parametros = parametros_fasar(user_id) if self.modelo is ManoObra else None
+
+        self.existentes: Dict[str, int] = {}
+        nombres = db.session.query(self.tabla.id, self.tabla[self.columna_nombre]).filter(
+            self.tabla.user_id.is_(None) if user_id is None else self.tabla.user_id == user_id
+        ).order_by(self.tabla.id)
+        for insumo_id, nombre in nombres:
+            self.existentes.setdefault(nombre_normalizado(nombre), insumo_id)
+
+        self.modificados = set()
+        self.reporte = {"filas": 0, "insertados": 0, "actualizados": 0, "sin_cambios": 0, "repetidos": 0,
+                        "con_error": 0, "historial": 0, "errores": []}
+
+    def error(self, numero: int, mensaje: str) -> None:
+        self.reporte["con_error"] += 1
+        if len(self.reporte["errores"]) < MAX_ERRORES_REPORTADOS:
+            self.reporte["errores"].append({"fila": numero, "error": mensaje})
+
+    def _derivados(self, valores: Dict) -> None:
+        if self.modelo is ManoObra:
+            valores["fasar"] = self.parametros.fasar(valores["salario_base"], valores["antiguedad_anios"])
+        elif self.modelo is Maquinaria:
+            valores["costo_posesion_hora"] = costo_posesion_por_hora(
+                valores["costo_adquisicion"], valores["vida_util_horas"], valores["tasa_interes_anual"]
+            ).quantize(Decimal("0.0001"))
+
+    def _por_defecto(self, valores: Dict) -> Dict:
+        for columna in self.opcionales:
+            if columna not in valores:
+                default = self.tabla[columna].default
+                valores[columna] = default.arg if default is not None and default.is_scalar else None
+        return valores
+
+    def aplicar_lote(self, lote: Dict[str, Tuple[int, Dict]]) -> None:
+        ahora, hoy = datetime.utcnow(), date.today()
+        columnas = ["id", *self.obligatorias, *self.opcionales]
+        if self.modelo is ManoObra:
+            columnas.append("fasar")
+        elif self.modelo is Maquinaria:
+            columnas.append("costo_posesion_hora")
+        ids = [self.existentes[llave] for llave in lote if llave in self.existentes]
+        actuales = {
+            fila.id: dict(fila._mapping)
+            for fila in db.session.query(*(self.tabla[c] for c in columnas)).filter(self.tabla.id.in_(ids))
+        } if ids else {}
+
+        ocupados = set()
+        nuevos_nombres = [valores[self.columna_nombre] for llave, (_, valores) in lote.items() if llave not in self.existentes]
+        if self.nombre_unico and nuevos_nombres:
+            # El nombre es único en toda la tabla: puede pertenecer a otro usuario o al catálogo global
+            ocupados = {n for (n,) in db.session.query(self.tabla[self.columna_nombre]).filter(
+                self.tabla[self.columna_nombre].in_(nuevos_nombres))}
+
+        actualizaciones, inserciones, historial = [], [], []
+        for llave, (numero, valores) in lote.items():
+            insumo_id = self.existentes.get(llave)
+            if insumo_id is None or insumo_id not in actuales:
+                if valores[self.columna_nombre] in ocupados:
+                    self.error(numero, f"Ya existe un insumo llamado '{valores[self.columna_nombre]}' en otro catálogo")
+                    continue
+                nuevo = self._por_defecto(dict(valores))
+                self._derivados(nuevo)
+                nuevo.update(user_id=self.user_id, fecha_actualizacion=hoy)
+                inserciones.append((llave, nuevo))
+                continue
+
+            actual = actuales[insumo_id]
+            combinado = {**actual, **{c: v for c, v in valores.items() if c != self.columna_nombre}}
+            self._derivados(combinado)
+            cambios = {c: v for c, v in combinado.items() if c != "id" and actual.get(c) != v}
+            if not cambios:
+                self.reporte["sin_cambios"] += 1
+                continue
+            actualizaciones.append({"id": insumo_id, "fecha_actualizacion": hoy, **cambios})
+            self.reporte["actualizados"] += 1
+            if set(cambios) - {"disciplina", "calidad", "unidad"}:
+                self.modificados.add(insumo_id)
+            registro = cambio_de_precio(self.user_id, self.tipo, insumo_id, actual[self.columna_precio],
+                                        combinado[self.columna_precio], self.fuente, ahora)
+            if registro:
+                historial.append(registro)
+
+        if actualizaciones:
+            db.session.execute(update(self.modelo), actualizaciones)
+        if inserciones:
+            filas = db.session.execute(
+                insert(self.modelo).returning(self.modelo.id, sort_by_parameter_order=True),
+                [valores for _, valores in inserciones],
+            )
+            for (llave, valores), insumo_id in zip(inserciones, filas.scalars()):
+                self.existentes[llave] = insumo_id
+                historial.append(cambio_de_precio(self.user_id, self.tipo, insumo_id, None,
+                                                  valores[self.columna_precio], self.fuente, ahora))
+            self.reporte["insertados"] += len(inserciones)
+        self.reporte["historial"] += registrar_cambios(historial)
+
+        if actualizaciones or inserciones:
+            incrementar_version(RECURSO_CATALOGO, self.user_id)
+        db.session.commit()
+
+
+def importar_catalogo(archivo: BinaryIO, nombre_archivo: str, tipo: str, user_id: Optional[int],
+                      fuente: str = FUENTE_IMPORTACION) -> Dict:
+    """Importa (inserta o actualiza) un catálogo desde un CSV o XLSX y devuelve el reporte.
+
+    La primera fila es el encabezado (ver CAMPOS_IMPORTACION). Las filas inválidas se
+    reportan con su número y no detienen la importación. Cada lote hace commit; al final
+    se recalculan los presupuestos que usan los insumos cuyo precio cambió. Si el archivo
+    se corrompe a la mitad, lo leído hasta ahí queda importado y recalculado, y el reporte
+    trae el motivo en "error".
+    """
+    inicio = time.perf_counter()
+    if tipo not in CAMPOS_IMPORTACION:
+        raise ErrorImportacion(f"tipo debe ser uno de: {', '.join(CAMPOS_IMPORTACION)}")
+    extension = ("." + nombre_archivo.rsplit(".", 1)[-1].lower()) if "." in (nombre_archivo or "") else ""
+    formato = FORMATOS.get(extension)
+    if formato is None:
+        raise ErrorImportacion("El archivo debe ser .csv o .xlsx")
+    if archivo.seekable():
+        archivo.seek(0)
+
+    filas = _filas_csv(archivo) if formato == "csv" else _filas_xlsx(archivo)
+    primera = next(filas, None)
+    if primera is None:
+        raise ErrorImportacion("El archivo está vacío")
+    importacion = _Importacion(tipo, user_id, fuente)
+    columnas, ignoradas = _columnas_del_archivo(tipo, primera[1])
+
+    lote: Dict[str, Tuple[int, Dict]] = {}
+    error = None
+    try:
+        for numero, valores in filas:
+            if not any(v.strip() for v in valores):
+                continue
+            importacion.reporte["filas"] += 1
+            try:
+                fila = _validar_fila(valores, columnas, importacion.tabla, importacion.obligatorias)
+            except ValueError as e:
+                importacion.error(numero, str(e))
+                continue
+            llave = nombre_normalizado(fila[importacion.columna_nombre])
+            if llave in lote:
+                # Nombre repetido dentro del lote: cuenta la última fila
+                importacion.reporte["repetidos"] += 1
+                lote.pop(llave)
+            lote[llave] = (numero, fila)
+            if len(lote) >= TAMANO_LOTE:
+                importacion.aplicar_lote(lote)
+                lote = {}
+    except ErrorImportacion as e:
+        # Los lotes anteriores ya hicieron commit: se termina con lo leído para no dejar
+        # precios cambiados sin recalcular los presupuestos
+        error = str(e)
+    if lote:
+        importacion.aplicar_lote(lote)
+
+    recalculo = None
+    if importacion.modificados:
+        recalculo = recalcular_por_insumos([(tipo, insumo_id) for insumo_id in sorted(importacion.modificados)])
+        db.session.commit()
+
+    return {
+        "tipo": tipo,
+        **importacion.reporte,
+        "columnas_ignoradas": ignoradas,
+        "recalculo": recalculo,
+        "error": error,
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2),
+    }
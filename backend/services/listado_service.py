@@ -0,0 +1,262 @@
+import base64
+import json
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from sqlalchemy import Date, Numeric, Row, or_
+from sqlalchemy.orm import Query
+from backend.models import (Material, ManoObra, Equipo, Maquinaria, Concepto, MatrizInsumo, Partida, DetallePresupuesto,
+                            PRECIOS_OBSOLETOS_DIAS)
+from backend.extensions import db
+
+# Listados de catálogos con paginación por cursor (keyset) sobre (nombre, id), filtros en
+# SQL y proyección de columnas. Se consultan solo las columnas pedidas, sin hidratar
+# objetos ORM; cada fila se serializa igual que el to_dict() del modelo.
+
+LIMITE_POR_DEFECTO = 100
+LIMITE_MAXIMO = 1000
+
+
+class ErrorListado(ValueError):
+    pass
+
+
+# Campos expuestos por modelo, en el orden de to_dict(). "obsoleto" se deriva de fecha_actualizacion.
+CAMPOS = {
+    Material: ("id", "nombre", "unidad", "precio_unitario", "fecha_actualizacion", "disciplina", "calidad",
+               "obsoleto", "porcentaje_merma", "precio_flete_unitario"),
+    ManoObra: ("id", "puesto", "salario_base", "antiguedad_anios", "fasar", "rendimiento_jornada",
+               "disciplina", "calidad", "fecha_actualizacion", "obsoleto"),
+    Equipo: ("id", "nombre", "unidad", "disciplina", "calidad", "fecha_actualizacion", "obsoleto", "costo_hora_maq"),
+    Maquinaria: ("id", "nombre", "disciplina", "calidad", "fecha_actualizacion", "obsoleto", "costo_adquisicion",
+                 "vida_util_horas", "tasa_interes_anual", "rendimiento_horario", "costo_posesion_hora"),
+    Concepto: ("id", "clave", "descripcion", "unidad_concepto"),
+}
+
+# Columna de orden (el "nombre" del keyset) y columnas donde busca el filtro de texto.
+ORDEN = {Material: "nombre", ManoObra: "puesto", Equipo: "nombre", Maquinaria: "nombre", Concepto: "clave"}
+BUSQUEDA = {
+    Material: ("nombre",),
+    ManoObra: ("puesto",),
+    Equipo: ("nombre",),
+    Maquinaria: ("nombre",),
+    Concepto: ("clave", "descripcion"),
+}
+
+
+def _codificar_cursor(nombre: str, ultimo_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([nombre, ultimo_id]).encode()).decode()
+
+
+def _decodificar_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        nombre, ultimo_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(nombre), int(ultimo_id)
+    except (ValueError, TypeError):
+        raise ErrorListado("cursor inválido")
+
+
+def _fecha_limite_obsoleto() -> date:
+    return date.today() - timedelta(days=PRECIOS_OBSOLETOS_DIAS)
+
+
+def _booleano(valor: str) -> bool:
+    valor = valor.strip().lower()
+    if valor in ("1", "true", "si", "sí"):
+        return True
+    if valor in ("0", "false", "no"):
+        return False
+    raise ErrorListado("obsoleto debe ser true o false")
+
+
+def _campos_pedidos(modelo, fields: Optional[str]) -> List[str]:
+    disponibles = CAMPOS[modelo]
+    if not fields:
+        return list(disponibles)
+    pedidos = [campo.strip() for campo in fields.split(",") if campo.strip()]
+    desconocidos = [campo for campo in pedidos if campo not in disponibles]
+    if desconocidos:
+        raise ErrorListado(f"Campos desconocidos: {', '.join(desconocidos)}")
+    return pedidos
+
+
+def _numero_o_cero(valor) -> float:
+    return 0.0 if valor is None else float(valor)
+
+
+def _numero_o_nulo(valor) -> Optional[float]:
+    return None if valor is None else float(valor)
+
+
+def _fecha_iso(valor) -> Optional[str]:
+    return None if valor is None else valor.isoformat()
+
+
+def _conversion(columna) -> Optional[Callable]:
+    if isinstance(columna.type, Numeric):
+        return _numero_o_cero
+    if isinstance(columna.type, Date):
+        return _fecha_iso
+    return None
+
+
+@lru_cache(maxsize=256)
+def _conversiones(modelo, campos: Tuple[str, ...]) -> Tuple[Tuple[str, Optional[Callable]], ...]:
+    # La conversión de cada campo se decide una vez por combinación de campos, no por valor
+    tabla = modelo.__table__.c
+    return tuple((campo, None if campo == "obsoleto" else _conversion(tabla[campo])) for campo in campos)
+
+
+def consulta_catalogo(modelo, user_id: Optional[int], args: Dict) -> Tuple[Query, List[str]]:
+    """Consulta de columnas del catálogo con los filtros de la URL, ordenada por (nombre, id).
+
+    Devuelve también los campos pedidos; las filas se convierten con serializador().
+    """
+    campos = _campos_pedidos(modelo, args.get("fields"))
+    tabla = modelo.__table__.c
+    tiene_fecha = "fecha_actualizacion" in tabla
+
+    # Siempre se leen id y la columna de orden (para el cursor) y la fecha si se pide "obsoleto".
+    columnas = {"id", ORDEN[modelo]} | {c for c in campos if c != "obsoleto"}
+    if "obsoleto" in campos:
+        columnas.add("fecha_actualizacion")
+    columnas = sorted(columnas)
+
+    consulta = db.session.query(*(tabla[c] for c in columnas)).filter(
+        (tabla.user_id == user_id) | (tabla.user_id.is_(None))
+    )
+
+    if args.get("q"):
+        patron = f"%{args['q'].strip()}%"
+        consulta = consulta.filter(or_(*(tabla[c].ilike(patron) for c in BUSQUEDA[modelo])))
+    for filtro in ("disciplina", "calidad"):
+        if args.get(filtro):
+            if filtro not in tabla:
+                raise ErrorListado(f"El catálogo no admite el filtro {filtro}")
+            consulta = consulta.filter(tabla[filtro] == args[filtro])
+    if args.get("obsoleto"):
+        if not tiene_fecha:
+            raise ErrorListado("El catálogo no admite el filtro obsoleto")
+        limite_fecha = _fecha_limite_obsoleto()
+        if _booleano(args["obsoleto"]):
+            consulta = consulta.filter(tabla.fecha_actualizacion < limite_fecha)
+        else:
+            consulta = consulta.filter(tabla.fecha_actualizacion >= limite_fecha)
+
+    return consulta.order_by(tabla[ORDEN[modelo]], tabla.id), campos
+
+
+def serializador(modelo, campos: List[str]) -> Callable[[Row], Dict]:
+    """Convierte las filas de consulta_catalogo en diccionarios como los de to_dict()."""
+    conversiones = _conversiones(modelo, tuple(campos))
+    limite_fecha = _fecha_limite_obsoleto() if "obsoleto" in campos else None
+
+    def serializar(fila: Row) -> Dict:
+        valores = fila._mapping
+        item = {}
+        for campo, convertir in conversiones:
+            if campo == "obsoleto":
+                fecha = valores["fecha_actualizacion"]
+                item[campo] = bool(fecha) and fecha < limite_fecha
+            else:
+                valor = valores[campo]
+                item[campo] = convertir(valor) if convertir else valor
+        return item
+
+    return serializar
+
+
+def listar_catalogo(modelo, user_id: Optional[int], args: Dict) -> Union[List[Dict], Dict]:
+    """Lista un catálogo del usuario (y los registros globales) según los parámetros de la URL.
+
+    Parámetros: limit, cursor, fields, q, disciplina, calidad, obsoleto. Con limit o cursor
+    devuelve {"items", "siguiente_cursor"}; sin ellos, la lista completa como antes.
+    """
+    consulta, campos = consulta_catalogo(modelo, user_id, args)
+    tabla = modelo.__table__.c
+    orden = tabla[ORDEN[modelo]]
+
+    paginado = "limit" in args or "cursor" in args
+    if args.get("cursor"):
+        nombre, ultimo_id = _decodificar_cursor(args["cursor"])
+        consulta = consulta.filter(or_(orden > nombre, (orden == nombre) & (tabla.id > ultimo_id)))
+
+    limite = None
+    if paginado:
+        try:
+            limite = int(args.get("limit", LIMITE_POR_DEFECTO))
+        except (TypeError, ValueError):
+            raise ErrorListado("limit debe ser un entero")
+        if limite < 1:
+            raise ErrorListado("limit debe ser mayor a cero")
+        limite = min(limite, LIMITE_MAXIMO)
+        consulta = consulta.limit(limite + 1)
+
+    filas = consulta.all()
+    siguiente_cursor = None
+    if limite is not None and len(filas) > limite:
+        filas = filas[:limite]
+        ultima = filas[-1]._mapping
+        siguiente_cursor = _codificar_cursor(ultima[ORDEN[modelo]], ultima["id"])
+
+    items = list(map(serializador(modelo, campos), filas))
+    if not paginado:
+        return items
+    return {"items": items, "siguiente_cursor": siguiente_cursor}
+
+
+# Listas de presupuestos y matrices sin hidratar objetos: (llave de to_dict(), columna,
+# conversión) por modelo, con el mismo resultado que to_dict().
+FILAS = {
+    Partida: (
+        ("id", "id", None),
+        ("proyecto", "proyecto_id", None),
+        ("nombre_partida", "nombre_partida", None),
+        ("total", "total", _numero_o_cero),
+        ("total_costo_directo", "total_costo_directo", _numero_o_cero),
+    ),
+    DetallePresupuesto: (
+        ("id", "id", None),
+        ("partida", "partida_id", None),
+        ("concepto", "concepto_id", None),
+        ("cantidad_obra", "cantidad_obra", float),
+        ("precio_unitario_calculado", "precio_unitario_calculado", float),
+        ("costo_directo", "costo_directo", _numero_o_cero),
+    ),
+    MatrizInsumo: (
+        ("id", "id", None),
+        ("concepto", "concepto_id", None),
+        ("tipo_insumo", "tipo_insumo", None),
+        ("id_insumo", "id_insumo", None),
+        ("cantidad", "cantidad", float),
+        ("porcentaje_merma", "porcentaje_merma", _numero_o_nulo),
+        ("precio_flete_unitario", "precio_flete_unitario", _numero_o_nulo),
+        ("rendimiento_jornada", "rendimiento_jornada", _numero_o_nulo),
+        ("factor_uso", "factor_uso", _numero_o_nulo),
+        ("precio_custom", "precio_custom", _numero_o_nulo),
+        ("unidad_custom", "unidad_custom", None),
+    ),
+}
+
+
+def _serializador_de_filas(especificacion: Tuple) -> Callable[[Row], Dict]:
+    llaves = tuple(llave for llave, _, _ in especificacion)
+    conversiones = tuple(convertir for _, _, convertir in especificacion)
+
+    def serializar(fila: Row) -> Dict:
+        return {llave: convertir(valor) if convertir else valor for llave, convertir, valor in zip(llaves, conversiones, fila)}
+
+    return serializar
+
+
+SERIALIZADORES = {modelo: _serializador_de_filas(especificacion) for modelo, especificacion in FILAS.items()}
+
+
+def consulta_filas(modelo) -> Query:
+    """SELECT de las columnas de FILAS[modelo], en ese orden; el llamador agrega joins y filtros."""
+    tabla = modelo.__table__.c
+    return db.session.query(*(tabla[columna] for _, columna, _ in FILAS[modelo]))
+
+
+def serializar_filas(modelo, consulta: Query) -> List[Dict]:
+    return list(map(SERIALIZADORES[modelo], consulta))
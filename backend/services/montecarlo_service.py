@@ -0,0 +1,160 @@
+import time
+from datetime import date
+from decimal import InvalidOperation
+from typing import Dict, List, Optional
+import numpy as np
+from backend.models import Proyecto, DistribucionPrecio
+from backend.extensions import db
+from backend.services.calculation_service import decimal_field, MODELOS_INSUMO
+from backend.services.escenarios_service import ModeloCostos, TIPOS_INSUMO
+
+MAX_ITERACIONES = 200_000
+# Tamaño máximo (iteraciones × insumos) de cada bloque de sorteos, para acotar memoria.
+ELEMENTOS_POR_BLOQUE = 4_000_000
+
+
+ERROR_INSUMO = "Cada distribución requiere tipo_insumo e id_insumo válidos"
+
+
+def validar_distribucion(item: Dict) -> Optional[str]:
+    if not isinstance(item, dict) or item.get("tipo_insumo") not in TIPOS_INSUMO:
+        return ERROR_INSUMO
+    valor = item.get("id_insumo")
+    if isinstance(valor, bool) or (isinstance(valor, float) and not valor.is_integer()):
+        return ERROR_INSUMO
+    try:
+        if int(valor) <= 0:
+            return ERROR_INSUMO
+    except (TypeError, ValueError):
+        return ERROR_INSUMO
+    try:
+        minimo = decimal_field(item.get("precio_min"))
+        promedio = decimal_field(item.get("precio_promedio"))
+        maximo = decimal_field(item.get("precio_max"))
+    except (InvalidOperation, TypeError, ValueError):
+        return "precio_min, precio_promedio y precio_max deben ser numéricos"
+    if not all(precio.is_finite() for precio in (minimo, promedio, maximo)):
+        return "precio_min, precio_promedio y precio_max deben ser numéricos"
+    if promedio <= 0 or minimo < 0 or not (minimo <= promedio <= maximo):
+        return "Se requiere 0 <= precio_min <= precio_promedio <= precio_max y precio_promedio > 0"
+    return None
+
+
+def guardar_distribucion(user_id: Optional[int], item: Dict, fuente: Optional[str] = None) -> DistribucionPrecio:
+    """Crea o reemplaza el rango de precio de un insumo para el usuario. No hace commit."""
+    distribucion = DistribucionPrecio.query.filter_by(
+        user_id=user_id, tipo_insumo=item["tipo_insumo"], id_insumo=int(item["id_insumo"])
+    ).first()
+    if distribucion is None:
+        distribucion = DistribucionPrecio(user_id=user_id, tipo_insumo=item["tipo_insumo"], id_insumo=int(item["id_insumo"]))
+        db.session.add(distribucion)
+    distribucion.precio_min = decimal_field(item.get("precio_min"))
+    distribucion.precio_promedio = decimal_field(item.get("precio_promedio"))
+    distribucion.precio_max = decimal_field(item.get("precio_max"))
+    distribucion.fuente = item.get("fuente") or fuente
+    distribucion.fecha_actualizacion = date.today()
+    return distribucion
+
+
+def _nombres_insumos(slots: List) -> Dict:
+    nombres = {}
+    por_tipo: Dict[str, List[int]] = {}
+    for tipo, insumo_id in slots:
+        por_tipo.setdefault(tipo, []).append(insumo_id)
+    for tipo, ids in por_tipo.items():
+        modelo = MODELOS_INSUMO.get(tipo)
+        if modelo is None:
+            continue
+        columna = modelo.puesto if tipo == "ManoObra" else modelo.nombre
+        for insumo_id, nombre in db.session.query(modelo.id, columna).filter(modelo.id.in_(ids)):
+            nombres[(tipo, insumo_id)] = nombre
+    return nombres
+
+
+def simular_montecarlo(
+    proyecto: Proyecto,
+    user_id: Optional[int],
+    iteraciones: int = 10_000,
+    semilla: Optional[int] = None,
+    max_impulsores: int = 10,
+) -> Dict:
+    """Distribución del costo total del proyecto a partir de los rangos de precio guardados.
+
+    Cada insumo con distribución se modela como triangular(min, promedio, max) relativa a su
+    promedio, es decir, como multiplicador sobre el precio vigente del catálogo. El total
+    del proyecto es lineal en esos multiplicadores (ver ModeloCostos), así que cada sorteo
+    es un producto punto y todos se evalúan en bloque.
+    """
+    inicio = time.perf_counter()
+    modelo = ModeloCostos(proyecto)
+    pesos = modelo.W.sum(axis=0)
+    base = float(pesos.sum() + modelo.constante.sum())
+
+    distribuciones = {
+        (d.tipo_insumo, d.id_insumo): d
+        for d in DistribucionPrecio.query.filter_by(user_id=user_id)
+    }
+    indices, izquierda, derecha = [], [], []
+    for slot, indice in modelo.indice_slot.items():
+        d = distribuciones.get(slot)
+        if d is None or pesos[indice] == 0:
+            continue
+        promedio = float(d.precio_promedio)
+        indices.append(indice)
+        izquierda.append(min(float(d.precio_min) / promedio, 1.0))
+        derecha.append(max(float(d.precio_max) / promedio, 1.0))
+
+    indices_arr = np.array(indices, dtype=int)
+    a = np.array(izquierda)
+    c = np.array(derecha)
+    w = pesos[indices_arr] if indices else np.zeros(0)
+    fijo = base - float(w.sum())
+
+    rng = np.random.default_rng(semilla)
+    totales = np.empty(iteraciones)
+    variables = c > a
+    bloque = max(1, ELEMENTOS_POR_BLOQUE // max(1, int(variables.sum())))
+    for desde in range(0, iteraciones, bloque):
+        hasta = min(desde + bloque, iteraciones)
+        sorteos = np.ones((hasta - desde, len(indices)))
+        if variables.any():
+            sorteos[:, variables] = rng.triangular(
+                a[variables], 1.0, c[variables], size=(hasta - desde, int(variables.sum()))
+            )
+        totales[desde:hasta] = fijo + sorteos @ w
+
+    # Varianza de una triangular(a, 1, c): (a² + 1 + c² - a - c - ac) / 18
+    varianzas = (a ** 2 + 1 + c ** 2 - a - c - a * c) / 18.0
+    contribuciones = (w ** 2) * varianzas
+    varianza_total = float(contribuciones.sum())
+    orden = np.argsort(-contribuciones)[:max_impulsores]
+    slots_top = [modelo.slots[indices_arr[i]] for i in orden if contribuciones[i] > 0]
+    nombres = _nombres_insumos(slots_top)
+    impulsores = []
+    for i in orden:
+        if contribuciones[i] <= 0:
+            continue
+        slot = modelo.slots[indices_arr[i]]
+        impulsores.append({
+            "tipo_insumo": slot[0],
+            "id_insumo": slot[1],
+            "nombre": nombres.get(slot, ""),
+            "importe_base": float(w[i]),
+            "desviacion": float(np.sqrt(contribuciones[i])),
+            "participacion_varianza": float(contribuciones[i] / varianza_total) if varianza_total else 0.0,
+        })
+
+    p50, p80, p95 = (float(v) for v in np.percentile(totales, [50, 80, 95]))
+    return {
+        "proyecto_id": proyecto.id,
+        "iteraciones": iteraciones,
+        "base": base,
+        "media": float(totales.mean()),
+        "desviacion": float(totales.std()),
+        "p50": p50,
+        "p80": p80,
+        "p95": p95,
+        "insumos_con_distribucion": len(indices),
+        "impulsores": impulsores,
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2),
+    }
@@ -0,0 +1,161 @@
+import time
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import update
+from backend.models import ManoObra, Maquinaria, costo_posesion_por_hora
+from backend.extensions import db
+from backend.services.calculation_service import en_bloques
+from backend.services.dependencias_service import conceptos_que_usan, proyectos_de_conceptos
+from backend.services.fasar_service import parametros_fasar
+from backend.services.historial_service import COLUMNA_PRECIO, MODELOS, cambio_de_precio, registrar_cambios
+from backend.services.recalculo_service import recalcular_conceptos
+from backend.services.versiones_service import RECURSO_CATALOGO, incrementar_version
+
+# Actualización masiva de precios del catálogo.
+#
+# Los cambios se agrupan por tipo de insumo; cada tabla se lee con una consulta IN por
+# bloque (solo los registros del usuario) y se escribe con un UPDATE masivo por llave
+# primaria. FASAR y costo de posesión se recalculan en memoria con las constantes ya
+# cargadas, sin instanciar los modelos.
+
+FUENTE_MASIVA = "masivo"
+MAX_ERRORES_REPORTADOS = 500
+
+# Columnas adicionales que se leen para recalcular los campos derivados del precio
+_COLUMNAS_DERIVADOS = {
+    "ManoObra": ("antiguedad_anios", "fasar"),
+    "Maquinaria": ("vida_util_horas", "tasa_interes_anual", "costo_posesion_hora"),
+}
+
+
+class ErrorPrecios(ValueError):
+    pass
+
+
+def _escala(columna) -> Decimal:
+    return Decimal(1).scaleb(-(columna.type.scale or 0))
+
+
+def _validar(item) -> Tuple[str, int, Decimal]:
+    if not isinstance(item, dict):
+        raise ValueError("Cada elemento debe ser un objeto")
+    tipo = item.get("tipo")
+    if tipo not in MODELOS:
+        raise ValueError(f"tipo debe ser uno de: {', '.join(MODELOS)}")
+    try:
+        insumo_id = int(item.get("insumo_id"))
+    except (TypeError, ValueError):
+        raise ValueError("insumo_id inválido")
+    if insumo_id <= 0:
+        raise ValueError("insumo_id inválido")
+    valor = item.get("nuevo_precio")
+    if valor is None or isinstance(valor, bool):
+        raise ValueError("Falta nuevo_precio")
+    try:
+        precio = Decimal(str(valor))
+    except InvalidOperation:
+        raise ValueError("nuevo_precio inválido")
+    if not precio.is_finite() or precio < 0:
+        raise ValueError("nuevo_precio debe ser un número mayor o igual a cero")
+    return tipo, insumo_id, precio
+
+
+def _aplicar_tipo(tipo: str, precios: Dict[int, Decimal], user_id: Optional[int], fuente: str,
+                  ahora: datetime) -> Tuple[List[int], List[int], List[Dict]]:
+    """Aplica los precios de un tipo. Devuelve (ids modificados, ids no encontrados, historial)."""
+    modelo = MODELOS[tipo]
+    tabla = modelo.__table__.c
+    columna_precio = COLUMNA_PRECIO[tipo]
+    escala = _escala(tabla[columna_precio])
+    columnas = [tabla.id, tabla[columna_precio], *(tabla[c] for c in _COLUMNAS_DERIVADOS.get(tipo, ()))]
+    propios = tabla.user_id.is_(None) if user_id is None else tabla.user_id == user_id
+
+    actuales: Dict[int, Dict] = {}
+    for bloque in en_bloques(sorted(precios)):
+        for fila in db.session.query(*columnas).filter(tabla.id.in_(bloque), propios):
+            actuales[fila.id] = dict(fila._mapping)
+
+    parametros = parametros_fasar(user_id) if modelo is ManoObra else None
+    hoy = date.today()
+    actualizaciones, historial = [], []
+    for insumo_id, precio in precios.items():
+        actual = actuales.get(insumo_id)
+        if actual is None:
+            continue
+        nuevo = precio.quantize(escala)
+        registro = cambio_de_precio(user_id, tipo, insumo_id, actual[columna_precio], nuevo, fuente, ahora)
+        if registro is None:
+            continue
+        cambios = {"id": insumo_id, columna_precio: nuevo, "fecha_actualizacion": hoy}
+        if modelo is ManoObra:
+            cambios["fasar"] = parametros.fasar(nuevo, actual["antiguedad_anios"])
+        elif modelo is Maquinaria:
+            cambios["costo_posesion_hora"] = costo_posesion_por_hora(
+                nuevo, actual["vida_util_horas"], actual["tasa_interes_anual"]
+            ).quantize(_escala(tabla["costo_posesion_hora"]))
+        actualizaciones.append(cambios)
+        historial.append(registro)
+
+    if actualizaciones:
+        db.session.execute(update(modelo), actualizaciones)
+    no_encontrados = sorted(set(precios) - set(actuales))
+    return [cambios["id"] for cambios in actualizaciones], no_encontrados, historial
+
+
+def actualizar_precios(items: List, user_id: Optional[int], fuente: str = FUENTE_MASIVA) -> Dict:
+    """Aplica una lista de {insumo_id, tipo, nuevo_precio} sobre el catálogo del usuario.
+
+    Los elementos inválidos y los insumos que no son del usuario se reportan sin detener
+    el resto. Registra el historial, recalcula los presupuestos afectados y reporta los
+    conceptos y proyectos cuyos precios se movieron. No hace commit.
+    """
+    if not isinstance(items, list):
+        raise ErrorPrecios("El payload debe ser una lista")
+    inicio = time.perf_counter()
+    ahora = datetime.utcnow()
+
+    errores: List[Dict] = []
+    con_error = 0
+    por_tipo: Dict[str, Dict[int, Decimal]] = {}
+    for indice, item in enumerate(items):
+        try:
+            tipo, insumo_id, precio = _validar(item)
+        except ValueError as e:
+            con_error += 1
+            if len(errores) < MAX_ERRORES_REPORTADOS:
+                errores.append({"indice": indice, "error": str(e)})
+            continue
+        # Si un insumo viene repetido cuenta el último precio
+        por_tipo.setdefault(tipo, {})[insumo_id] = precio
+
+    modificados: List[Tuple[str, int]] = []
+    no_encontrados: List[Dict] = []
+    historial: List[Dict] = []
+    for tipo, precios in por_tipo.items():
+        ids, faltantes, registros = _aplicar_tipo(tipo, precios, user_id, fuente, ahora)
+        modificados.extend((tipo, insumo_id) for insumo_id in ids)
+        no_encontrados.extend({"tipo": tipo, "insumo_id": insumo_id} for insumo_id in faltantes)
+        historial.extend(registros)
+
+    recibidos = sum(len(precios) for precios in por_tipo.values())
+    reporte = {
+        "recibidos": len(items),
+        "actualizados": len(modificados),
+        "sin_cambios": recibidos - len(modificados) - len(no_encontrados),
+        "no_encontrados": no_encontrados,
+        "con_error": con_error,
+        "errores": errores,
+        "historial": registrar_cambios(historial),
+        "conceptos_afectados": [],
+        "proyectos_afectados": [],
+        "recalculo": None,
+    }
+    if modificados:
+        conceptos = conceptos_que_usan(modificados)
+        reporte["conceptos_afectados"] = sorted(conceptos)
+        reporte["proyectos_afectados"] = sorted(proyectos_de_conceptos(conceptos))
+        reporte["recalculo"] = recalcular_conceptos(conceptos)
+        incrementar_version(RECURSO_CATALOGO, user_id)
+    reporte["duracion_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+    return reporte
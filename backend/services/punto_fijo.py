@@ -0,0 +1,160 @@
+"""Aritmética de punto fijo para el cálculo de precios unitarios.
+
+Los montos se representan como enteros escalados a millonésimas (ESCALA = 10**6). Cada
+producto y cada división se redondea a la millonésima (mitad hacia arriba); las sumas son
+exactas. Trabaja sobre los mismos planes de costo que el camino Decimal y difiere de él
+solo por esos redondeos intermedios.
+"""
+from decimal import Decimal, ROUND_HALF_EVEN
+from typing import Dict, Optional, Tuple
+
+ESCALA = 10 ** 6
+# Por debajo de este valor absoluto, float * ESCALA conserva la millonésima al redondear.
+_LIMITE_FLOAT = 1e9
+
+
+def a_entero(valor) -> int:
+    if valor is None:
+        return 0
+    if isinstance(valor, float) and abs(valor) < _LIMITE_FLOAT:
+        return int(round(valor * ESCALA))
+    if isinstance(valor, int) and not isinstance(valor, bool):
+        return valor * ESCALA
+    if isinstance(valor, str):
+        if not valor.strip():
+            return 0
+        valor = Decimal(valor.strip())
+    elif not isinstance(valor, Decimal):
+        valor = Decimal(str(valor))
+    return int(valor.scaleb(6).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def a_float(valor: int) -> float:
+    return valor / ESCALA
+
+
+def _dividir_redondeo(numerador: int, denominador: int) -> int:
+    if denominador < 0:
+        numerador, denominador = -numerador, -denominador
+    return (2 * numerador + denominador) // (2 * denominador)
+
+
+def multiplicar(a: int, b: int) -> int:
+    return _dividir_redondeo(a * b, ESCALA)
+
+
+def dividir(a: int, b: int) -> int:
+    return _dividir_redondeo(a * ESCALA, b)
+
+
+def _convertir_insumo(tipo: str, insumo) -> Tuple[int, ...]:
+    """Valores del catálogo ya escalados; el último elemento es el costo unitario sin overrides."""
+    if tipo == "Material":
+        precio = a_entero(insumo.precio_unitario)
+        merma = a_entero(insumo.porcentaje_merma)
+        flete = a_entero(insumo.precio_flete_unitario)
+        return precio, merma, flete, multiplicar(precio, ESCALA + merma) + flete
+    if tipo == "ManoObra":
+        rendimiento = a_entero(insumo.rendimiento_jornada or Decimal("1.0"))
+        if rendimiento <= 0:
+            rendimiento = ESCALA
+        salario_real = multiplicar(a_entero(insumo.salario_base), a_entero(insumo.fasar))
+        return (dividir(salario_real, rendimiento),)
+    if tipo == "Equipo":
+        return (a_entero(insumo.costo_hora_maq),)
+    rendimiento = a_entero(insumo.rendimiento_horario or Decimal("1.0"))
+    if rendimiento <= 0:
+        rendimiento = ESCALA
+    return (dividir(a_entero(insumo.costo_posesion_hora), rendimiento),)
+
+
+def _insumo_entero(tipo: str, insumo_id: int, caches: Dict[str, Dict], convertidos: Dict) -> Optional[Tuple[int, ...]]:
+    llave = (tipo, insumo_id)
+    if llave in convertidos:
+        return convertidos[llave]
+    # Misma búsqueda que el camino Decimal; calculation_service importa este módulo.
+    from backend.services.calculation_service import _insumo_de_cache
+
+    insumo = _insumo_de_cache(tipo, insumo_id, caches)
+    convertidos[llave] = _convertir_insumo(tipo, insumo) if insumo else None
+    return convertidos[llave]
+
+
+def renglones_enteros(plan) -> Tuple[Tuple, ...]:
+    """Renglones del plan (ver calculation_service.PlanCosto) ya escalados; se convierten una vez por plan."""
+    if plan.enteros is None:
+        plan.enteros = tuple(
+            (
+                tipo,
+                insumo_id,
+                a_entero(cantidad),
+                None if costo_fijo is None else a_entero(costo_fijo),
+                None if merma is None else a_entero(merma),
+                None if flete is None else a_entero(flete),
+                a_entero(respaldo),
+            )
+            for tipo, insumo_id, cantidad, costo_fijo, merma, flete, respaldo in plan.renglones
+        )
+    return plan.enteros
+
+
+def costo_renglon_entero(renglon: Tuple, caches: Dict[str, Dict], convertidos: Dict) -> int:
+    tipo, insumo_id, _, costo_fijo, merma, flete, respaldo = renglon
+    if costo_fijo is not None:
+        return costo_fijo
+    catalogo = _insumo_entero(tipo, insumo_id, caches, convertidos)
+    if catalogo is None:
+        return respaldo
+    if tipo == "Material":
+        precio, merma_catalogo, flete_catalogo, costo_catalogo = catalogo
+        if merma is None and flete is None:
+            return costo_catalogo
+        merma = merma if merma is not None else merma_catalogo
+        flete = flete if flete is not None else flete_catalogo
+        return multiplicar(precio, ESCALA + merma) + flete
+    return catalogo[0]
+
+
+def sumar_plan_entero(
+    plan,
+    material_cache: Dict,
+    mano_obra_cache: Dict,
+    equipo_cache: Dict,
+    maquinaria_cache: Dict,
+    convertidos: Optional[Dict] = None,
+) -> Tuple[int, int]:
+    caches = {
+        "Material": material_cache,
+        "ManoObra": mano_obra_cache,
+        "Equipo": equipo_cache,
+        "Maquinaria": maquinaria_cache,
+    }
+    convertidos = convertidos if convertidos is not None else {}
+    cd_base = 0
+    costo_mano_obra = 0
+    for renglon in renglones_enteros(plan):
+        importe = multiplicar(renglon[2], costo_renglon_entero(renglon, caches, convertidos))
+        cd_base += importe
+        if renglon[0] == "ManoObra":
+            costo_mano_obra += importe
+    return cd_base, costo_mano_obra
+
+
+def _factor_entero(factores: Dict, clave: str) -> int:
+    config = factores.get(clave) or {}
+    if not config.get("activo"):
+        return 0
+    return a_entero(config.get("porcentaje", 0))
+
+
+def aplicar_factores_entero(cd_base: int, costo_mano_obra: int, factores: Optional[Dict]) -> Dict[str, float]:
+    factores = factores or {}
+    cd_total = cd_base + multiplicar(costo_mano_obra, _factor_entero(factores, "mano_obra"))
+    multiplicador = ESCALA
+    for clave in ("indirectos", "financiamiento", "utilidad", "iva"):
+        multiplicador = multiplicar(multiplicador, ESCALA + _factor_entero(factores, clave))
+    pu = multiplicar(cd_total, multiplicador)
+    return {
+        "costo_directo": a_float(cd_total),
+        "precio_unitario": a_float(pu),
+    }
@@ -0,0 +1,143 @@
+import time
+from decimal import Decimal
+from typing import Dict, Iterable, List, Set, Tuple
+from sqlalchemy import update
+from backend.models import Proyecto, Partida, DetallePresupuesto
+from backend.extensions import db
+from backend.services.calculation_service import (
+    decimal_field,
+    en_bloques,
+    cargar_planes,
+    precargar_insumos_de_planes,
+    PLAN_VACIO,
+    obtener_factores_de_proyecto,
+    MotorCalculo,
+)
+from backend.services.dependencias_service import conceptos_que_usan
+from backend.services.totales_service import actualizar_totales_partidas
+
+# Escala con la que se guardan precio_unitario_calculado y costo_directo (Numeric(14, 4)).
+ESCALA_DETALLE = Decimal("0.0001")
+
+
+def _consulta_detalles():
+    return db.session.query(
+        DetallePresupuesto.id,
+        DetallePresupuesto.concepto_id,
+        DetallePresupuesto.precio_unitario_calculado,
+        DetallePresupuesto.costo_directo,
+        Partida.proyecto_id,
+        DetallePresupuesto.partida_id,
+    ).join(Partida, DetallePresupuesto.partida_id == Partida.id)
+
+
+def _cargar_detalles(proyecto_ids: Iterable[int]) -> List[Tuple]:
+    filas: List[Tuple] = []
+    for bloque in en_bloques(sorted(set(proyecto_ids))):
+        filas.extend(_consulta_detalles().filter(Partida.proyecto_id.in_(bloque)).all())
+    return filas
+
+
+def _cargar_detalles_de_conceptos(concepto_ids: Iterable[int]) -> List[Tuple]:
+    filas: List[Tuple] = []
+    for bloque in en_bloques(sorted(set(concepto_ids))):
+        filas.extend(_consulta_detalles().filter(DetallePresupuesto.concepto_id.in_(bloque)).all())
+    return filas
+
+
+def _sin_cambio(actual, nuevo: Decimal) -> bool:
+    if actual is None:
+        return False
+    return decimal_field(actual).quantize(ESCALA_DETALLE) == nuevo.quantize(ESCALA_DETALLE)
+
+
+def _recalcular_filas(filas: List[Tuple], factores_por_proyecto: Dict[int, Dict], aritmetica: str = "decimal") -> Dict:
+    inicio = time.perf_counter()
+    planes = cargar_planes({fila[1] for fila in filas})
+    motor = MotorCalculo(precargar_insumos_de_planes(planes.values()), aritmetica)
+
+    sumas: Dict[int, Tuple] = {}
+    resultados: Dict[Tuple[int, int], Dict[str, float]] = {}
+    cambios: List[Dict] = []
+    partidas_cambiadas = set()
+    for detalle_id, concepto_id, pu_actual, cd_actual, proyecto_id, partida_id in filas:
+        clave = (concepto_id, proyecto_id)
+        if clave not in resultados:
+            if concepto_id not in sumas:
+                sumas[concepto_id] = motor.sumar(planes.get(concepto_id, PLAN_VACIO))
+            cd_base, costo_mano_obra = sumas[concepto_id]
+            resultados[clave] = motor.aplicar_factores(cd_base, costo_mano_obra, factores_por_proyecto[proyecto_id])
+        resultado = resultados[clave]
+
+        precio_unitario = decimal_field(resultado["precio_unitario"])
+        costo_directo = decimal_field(resultado["costo_directo"])
+        if _sin_cambio(pu_actual, precio_unitario) and _sin_cambio(cd_actual, costo_directo):
+            continue
+        cambios.append({
+            "id": detalle_id,
+            "precio_unitario_calculado": precio_unitario,
+            "costo_directo": costo_directo,
+        })
+        partidas_cambiadas.add(partida_id)
+
+    if cambios:
+        db.session.execute(update(DetallePresupuesto), cambios)
+        actualizar_totales_partidas(partidas_cambiadas)
+
+    return {
+        "proyectos": len({fila[4] for fila in filas}),
+        "conceptos": len(sumas),
+        "detalles": len(filas),
+        "actualizados": len(cambios),
+        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 2),
+    }
+
+
+def recalcular_detalles(proyectos: List[Proyecto], aritmetica: str = "decimal") -> Dict:
+    """Recalcula precio_unitario_calculado y costo_directo de los detalles de los proyectos dados.
+
+    Los insumos se precargan una sola vez para todos los conceptos involucrados y los
+    resultados se escriben con un UPDATE masivo por llave primaria, y los subtotales
+    de las partidas que cambiaron se recalculan en SQL. No hace commit:
+    el llamador decide el alcance de la transacción.
+    """
+    inicio = time.perf_counter()
+    factores_por_proyecto = {p.id: obtener_factores_de_proyecto(p) for p in proyectos}
+    reporte = _recalcular_filas(_cargar_detalles(factores_por_proyecto.keys()), factores_por_proyecto, aritmetica)
+    reporte["proyectos"] = len(factores_por_proyecto)
+    reporte["duracion_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+    return reporte
+
+
+def recalcular_por_insumos(insumos: Iterable[Tuple[str, int]]) -> Dict:
+    """Recalcula solo los detalles cuyos conceptos usan alguno de los insumos (tipo, id).
+
+    Usa el índice inverso de la matriz, así que editar un precio del catálogo no
+    obliga a recorrer todos los presupuestos. Tampoco hace commit.
+    """
+    return recalcular_conceptos(conceptos_que_usan(insumos))
+
+
+def recalcular_conceptos(conceptos: Set[int]) -> Dict:
+    """Recalcula los detalles de presupuesto de esos conceptos, en todos los proyectos. No hace commit."""
+    inicio = time.perf_counter()
+    filas = _cargar_detalles_de_conceptos(conceptos) if conceptos else []
+    proyecto_ids = {fila[4] for fila in filas}
+    proyectos: List[Proyecto] = []
+    for bloque in en_bloques(sorted(proyecto_ids)):
+        proyectos.extend(Proyecto.query.filter(Proyecto.id.in_(bloque)).all())
+    factores_por_proyecto = {p.id: obtener_factores_de_proyecto(p) for p in proyectos}
+
+    reporte = _recalcular_filas(filas, factores_por_proyecto)
+    reporte["conceptos"] = len(conceptos)
+    reporte["duracion_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+    return reporte
+
+
+def recalcular_proyecto(proyecto: Proyecto, aritmetica: str = "decimal") -> Dict:
+    return recalcular_detalles([proyecto], aritmetica)
+
+
+def recalcular_proyectos_usuario(user_id: int, aritmetica: str = "decimal") -> Dict:
+    proyectos = Proyecto.query.filter_by(user_id=user_id).all()
+    return recalcular_detalles(proyectos, aritmetica)
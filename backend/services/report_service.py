@@ -1,4 +1,5 @@
 import io
+from typing import Optional
 from flask import send_file
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
@@ -7,18 +8,18 @@ from reportlab.platypus import Table, TableStyle, SimpleDocTemplate, Spacer, Par
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from backend.models import Concepto, MatrizInsumo, Material, ManoObra, Equipo, Maquinaria
-from backend.services.calculation_service import calcular_precio_unitario, obtener_costo_insumo, decimal_field
+from backend.services.calculation_service import obtener_costo_insumo, decimal_field, precargar_insumos
+from backend.services.cache_pu_service import calcular_precio_unitario_cacheado
 
-def generar_pdf_nota_venta(concepto_id: int):
-    concepto = Concepto.query.get_or_404(concepto_id)
+def generar_pdf_nota_venta(concepto_id: int, user_id: Optional[int] = None):
+    concepto = Concepto.query.filter(
+        Concepto.id == concepto_id, (Concepto.user_id == user_id) | (Concepto.user_id == None)
+    ).first_or_404()
     registros = [r.to_dict() for r in MatrizInsumo.query.filter_by(concepto_id=concepto_id).all()]
 
-    # Construir matriz detallada
+    # Construir matriz detallada; los insumos vienen de la instantánea del catálogo del usuario
     matriz_detalle = []
-    material_cache = {}
-    mano_cache = {}
-    equipo_cache = {}
-    maquinaria_cache = {}
+    material_cache, mano_cache, equipo_cache, maquinaria_cache = precargar_insumos(registros, user_id=user_id)
 
     for registro in registros:
         cantidad = decimal_field(registro.get('cantidad'))
@@ -49,7 +50,7 @@ def generar_pdf_nota_venta(concepto_id: int):
             'importe': float(importe),
         })
 
-    resultado = calcular_precio_unitario(concepto_id=concepto_id)
+    resultado = calcular_precio_unitario_cacheado(concepto_id, user_id=user_id)
     costo_directo = resultado['costo_directo']
     precio_unitario = resultado['precio_unitario']
     sobrecosto = precio_unitario - costo_directo
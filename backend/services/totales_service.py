@@ -0,0 +1,166 @@
+from datetime import date
+from typing import Iterable, Optional, Set
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import selectinload
+from backend.models import Proyecto, Partida, DetallePresupuesto
+from backend.extensions import db
+from backend.services.calculation_service import calcular_precio_unitario_lote, en_bloques, obtener_factores_de_proyecto
+
+# Subtotales materializados: Partida.total / total_costo_directo suman
+# cantidad_obra × precio_unitario_calculado (y × costo_directo) de sus detalles, y
+# Proyecto.total / total_costo_directo suman los de sus partidas. Se recalculan en SQL
+# solo para las partidas tocadas, en la misma transacción que la escritura.
+
+
+def _actualizar_partidas(partida_ids: Iterable[int]) -> None:
+    total = (
+        select(func.coalesce(func.sum(DetallePresupuesto.cantidad_obra * DetallePresupuesto.precio_unitario_calculado), 0))
+        .where(DetallePresupuesto.partida_id == Partida.id)
+        .scalar_subquery()
+    )
+    costo_directo = (
+        select(func.coalesce(func.sum(DetallePresupuesto.cantidad_obra * DetallePresupuesto.costo_directo), 0))
+        .where(DetallePresupuesto.partida_id == Partida.id)
+        .scalar_subquery()
+    )
+    for bloque in en_bloques(sorted(partida_ids)):
+        db.session.execute(
+            update(Partida).where(Partida.id.in_(bloque)).values(total=total, total_costo_directo=costo_directo),
+            execution_options={"synchronize_session": "fetch"},
+        )
+
+
+def actualizar_totales_proyectos(proyecto_ids: Iterable[int]) -> None:
+    total = (
+        select(func.coalesce(func.sum(Partida.total), 0))
+        .where(Partida.proyecto_id == Proyecto.id)
+        .scalar_subquery()
+    )
+    costo_directo = (
+        select(func.coalesce(func.sum(Partida.total_costo_directo), 0))
+        .where(Partida.proyecto_id == Proyecto.id)
+        .scalar_subquery()
+    )
+    for bloque in en_bloques(sorted(set(proyecto_ids))):
+        db.session.execute(
+            update(Proyecto).where(Proyecto.id.in_(bloque)).values(total=total, total_costo_directo=costo_directo),
+            execution_options={"synchronize_session": "fetch"},
+        )
+
+
+def actualizar_totales_partidas(partida_ids: Iterable[int]) -> None:
+    """Recalcula los totales de las partidas dadas y de sus proyectos. No hace commit."""
+    ids: Set[int] = {int(pid) for pid in partida_ids if pid}
+    if not ids:
+        return
+    db.session.flush()
+    _actualizar_partidas(ids)
+    proyecto_ids: Set[int] = set()
+    for bloque in en_bloques(sorted(ids)):
+        proyecto_ids.update(pid for (pid,) in db.session.query(Partida.proyecto_id).filter(Partida.id.in_(bloque)))
+    actualizar_totales_proyectos(proyecto_ids)
+
+
+def arbol_totales(proyecto: Proyecto) -> dict:
+    """Proyecto con los totales de cada partida, leídos de las columnas materializadas en una consulta."""
+    partidas = (
+        db.session.query(Partida.id, Partida.nombre_partida, Partida.total, Partida.total_costo_directo)
+        .filter(Partida.proyecto_id == proyecto.id)
+        .order_by(Partida.id)
+        .all()
+    )
+    return {
+        **proyecto.to_dict(),
+        "partidas": [
+            {
+                "id": partida_id,
+                "nombre_partida": nombre,
+                "total": float(total or 0),
+                "total_costo_directo": float(costo_directo or 0),
+            }
+            for partida_id, nombre, total, costo_directo in partidas
+        ],
+    }
+
+
+def arbol_presupuesto(proyecto_id: int, user_id: Optional[int]) -> Optional[dict]:
+    """Proyecto con sus partidas, detalles y conceptos en cuatro consultas, sin importar el tamaño.
+
+    selectinload trae cada nivel con un SELECT ... WHERE id IN (...) en lugar de una
+    carga perezosa por partida o por detalle.
+    """
+    proyecto = (
+        Proyecto.query.options(
+            selectinload(Proyecto.partidas).selectinload(Partida.detalles).selectinload(DetallePresupuesto.concepto)
+        )
+        .filter_by(id=proyecto_id, user_id=user_id)
+        .first()
+    )
+    if proyecto is None:
+        return None
+
+    partidas = []
+    for partida in sorted(proyecto.partidas, key=lambda p: p.id):
+        detalles = []
+        for detalle in sorted(partida.detalles, key=lambda d: d.id):
+            concepto = detalle.concepto
+            detalles.append({
+                **detalle.to_dict(),
+                "clave": concepto.clave,
+                "descripcion": concepto.descripcion,
+                "unidad_concepto": concepto.unidad_concepto,
+                "importe": float(detalle.cantidad_obra * detalle.precio_unitario_calculado),
+            })
+        partidas.append({**partida.to_dict(), "detalles": detalles})
+    return {**proyecto.to_dict(), "partidas": partidas}
+
+
+def cotizacion_a_fecha(proyecto: Proyecto, fecha: date) -> dict:
+    """Presupuesto del proyecto con los precios del catálogo al cierre de fecha.
+
+    Solo calcula: los precios guardados en los detalles no cambian. Los conceptos se
+    costean juntos, con una consulta de historial por tipo de insumo.
+    """
+    filas = (
+        db.session.query(Partida.id, Partida.nombre_partida, DetallePresupuesto.id, DetallePresupuesto.concepto_id,
+                         DetallePresupuesto.cantidad_obra)
+        .outerjoin(DetallePresupuesto, DetallePresupuesto.partida_id == Partida.id)
+        .filter(Partida.proyecto_id == proyecto.id)
+        .order_by(Partida.id, DetallePresupuesto.id)
+        .all()
+    )
+    concepto_ids = sorted({fila[3] for fila in filas if fila[3] is not None})
+    precios = {
+        resultado["concepto_id"]: resultado
+        for resultado in calcular_precio_unitario_lote(concepto_ids, factores=obtener_factores_de_proyecto(proyecto), fecha=fecha)
+    }
+
+    partidas = {}
+    for partida_id, nombre, detalle_id, concepto_id, cantidad in filas:
+        partida = partidas.setdefault(partida_id, {
+            "id": partida_id, "nombre_partida": nombre, "total": 0.0, "total_costo_directo": 0.0, "detalles": [],
+        })
+        if detalle_id is None:
+            continue
+        precio = precios[concepto_id]
+        cantidad = float(cantidad or 0)
+        detalle = {
+            "id": detalle_id,
+            "concepto_id": concepto_id,
+            "cantidad_obra": cantidad,
+            "precio_unitario": precio["precio_unitario"],
+            "costo_directo": precio["costo_directo"],
+            "importe": cantidad * precio["precio_unitario"],
+        }
+        partida["detalles"].append(detalle)
+        partida["total"] += detalle["importe"]
+        partida["total_costo_directo"] += cantidad * precio["costo_directo"]
+
+    return {
+        "proyecto_id": proyecto.id,
+        "fecha": fecha.isoformat(),
+        "partidas": list(partidas.values()),
+        "total": sum(p["total"] for p in partidas.values()),
+        "total_costo_directo": sum(p["total_costo_directo"] for p in partidas.values()),
+        "total_vigente": float(proyecto.total or 0),
+    }
@@ -0,0 +1,66 @@
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import update
+from backend.models import VersionRecurso
+from backend.extensions import db
+
+# Contadores de versión por (usuario, recurso). Viven en la base de datos para que
+# todos los workers vean el mismo valor; se incrementan en la misma transacción que
+# la escritura que invalidan.
+AMBITO_GLOBAL = 0
+
+RECURSO_CATALOGO = "catalogo"
+RECURSO_MATRIZ = "matriz"
+RECURSO_FASAR = "fasar"
+RECURSO_PROYECTOS = "proyectos"
+
+# Los presupuestos se recalculan cuando cambian catálogos, matrices o constantes FASAR,
+# así que sus respuestas dependen de las cuatro versiones.
+RECURSOS_PROYECTOS = (RECURSO_PROYECTOS, RECURSO_CATALOGO, RECURSO_MATRIZ, RECURSO_FASAR)
+
+
+def ambito(user_id: Optional[int]) -> int:
+    """Las filas sin dueño (user_id NULL) son compartidas y usan el ámbito global."""
+    return int(user_id) if user_id else AMBITO_GLOBAL
+
+
+def incrementar_version(recurso: str, user_id: Optional[int]) -> None:
+    user_ambito = ambito(user_id)
+    resultado = db.session.execute(
+        update(VersionRecurso)
+        .where(VersionRecurso.user_id == user_ambito, VersionRecurso.recurso == recurso)
+        .values(version=VersionRecurso.version + 1)
+    )
+    if resultado.rowcount == 0:
+        db.session.add(VersionRecurso(user_id=user_ambito, recurso=recurso, version=1))
+        db.session.flush()
+
+
+def version_actual(recurso: str, user_id: Optional[int]) -> int:
+    version = db.session.query(VersionRecurso.version).filter(
+        VersionRecurso.user_id == ambito(user_id), VersionRecurso.recurso == recurso
+    ).scalar()
+    return version or 0
+
+
+def incrementar_versiones(recurso: str, user_ids: Iterable[Optional[int]]) -> None:
+    for user_ambito in sorted({ambito(uid) for uid in user_ids}):
+        incrementar_version(recurso, user_ambito)
+
+
+def obtener_versiones(user_id: Optional[int], recursos: Iterable[str]) -> Dict[Tuple[int, str], int]:
+    """Versiones del usuario y del ámbito global para los recursos pedidos, en una consulta."""
+    recursos = list(recursos)
+    ambitos = {ambito(user_id), AMBITO_GLOBAL}
+    filas = db.session.query(VersionRecurso.user_id, VersionRecurso.recurso, VersionRecurso.version).filter(
+        VersionRecurso.user_id.in_(ambitos), VersionRecurso.recurso.in_(recursos)
+    )
+    versiones = {(a, r): 0 for a in ambitos for r in recursos}
+    for user_ambito, recurso, version in filas:
+        versiones[(user_ambito, recurso)] = version
+    return versiones
+
+
+def huella_versiones(user_id: Optional[int], recursos: Iterable[str]) -> Tuple:
+    """Tupla estable (recurso, ámbito, versión) apta como parte de una llave de cache."""
+    versiones = obtener_versiones(user_id, recursos)
+    return tuple(sorted((r, a, v) for (a, r), v in versiones.items()))
@@ -1,15 +1,27 @@
+import random
 import pytest
+from decimal import Decimal
 from backend.app import create_app
+from backend.config import Config
 from backend.extensions import db
-from backend.models import Material, ManoObra
+from backend.models import Material, ManoObra, Equipo, Maquinaria, Concepto, MatrizInsumo, User, Partida, DetallePresupuesto
+from backend.services.calculation_service import calcular_precio_unitario, calcular_precio_unitario_lote, compilar_plan, obtener_costo_insumo, _sumar_plan
+from backend.services.cache_pu_service import cache_pu
+from backend.services.fasar_service import limpiar_cache_fasar, obtener_constantes
+from backend.services.catalogo_cache_service import limpiar_instantaneas
+
+
+class ConfigPruebas(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+
 
 @pytest.fixture
 def app():
-    app = create_app()
-    app.config.update({
-        "TESTING": True,
-        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"
-    })
+    app = create_app(ConfigPruebas)
+    cache_pu.limpiar()
+    limpiar_cache_fasar()
+    limpiar_instantaneas()
 
     with app.app_context():
         db.create_all()
@@ -21,6 +33,70 @@ def app():
 def client(app):
     return app.test_client()
 
+@pytest.fixture
+def auth_client(app, client):
+    user = User(username="tester", is_premium=True)
+    user.set_password("secreto")
+    db.session.add(user)
+    db.session.commit()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user.id
+    return client
+
+@pytest.fixture
+def otro_id(app):
+    """Id de un segundo usuario, para probar que no ve ni modifica lo de "tester"."""
+    otro = User(username="otro", is_premium=True)
+    otro.set_password("secreto")
+    db.session.add(otro)
+    db.session.commit()
+    return otro.id
+
+@pytest.fixture
+def otro_client(app, otro_id):
+    cliente = app.test_client()
+    with cliente.session_transaction() as sess:
+        sess["user_id"] = otro_id
+    return cliente
+
+def _crear_conceptos_de_prueba():
+    mat = Material(nombre="Cemento gris", unidad="bto", precio_unitario=Decimal("185.50"),
+                   porcentaje_merma=Decimal("0.05"), precio_flete_unitario=Decimal("3.25"))
+    mo = ManoObra(puesto="Oficial albañil", salario_base=Decimal("480.00"), antiguedad_anios=3,
+                  fasar=Decimal("1.6543"), rendimiento_jornada=Decimal("7.5"))
+    eq = Equipo(nombre="Revolvedora", unidad="hora", costo_hora_maq=Decimal("95.10"))
+    maq = Maquinaria(nombre="Retroexcavadora", costo_adquisicion=Decimal("1500000"), vida_util_horas=Decimal("12000"),
+                     tasa_interes_anual=Decimal("0.12"), rendimiento_horario=Decimal("2.5"))
+    maq.actualizar_costo_posesion()
+    db.session.add_all([mat, mo, eq, maq])
+    db.session.flush()
+
+    c1 = Concepto(clave="C-1", descripcion="Muro", unidad_concepto="m2")
+    c2 = Concepto(clave="C-2", descripcion="Excavación", unidad_concepto="m3")
+    db.session.add_all([c1, c2])
+    db.session.flush()
+    db.session.add_all([
+        MatrizInsumo(concepto_id=c1.id, tipo_insumo="Material", id_insumo=mat.id, cantidad=Decimal("0.14")),
+        MatrizInsumo(concepto_id=c1.id, tipo_insumo="Material", id_insumo=mat.id, cantidad=Decimal("0.3333"),
+                     porcentaje_merma=Decimal("0.10"), precio_flete_unitario=Decimal("0")),
+        MatrizInsumo(concepto_id=c1.id, tipo_insumo="ManoObra", id_insumo=mo.id, cantidad=Decimal("1.0")),
+        MatrizInsumo(concepto_id=c1.id, tipo_insumo="Equipo", id_insumo=eq.id, cantidad=Decimal("0.25")),
+        MatrizInsumo(concepto_id=c2.id, tipo_insumo="Maquinaria", id_insumo=maq.id, cantidad=Decimal("0.4")),
+        MatrizInsumo(concepto_id=c2.id, tipo_insumo="ManoObra", id_insumo=mo.id, cantidad=Decimal("0.2"),
+                     precio_custom=Decimal("600"), rendimiento_jornada=Decimal("3")),
+        MatrizInsumo(concepto_id=c2.id, tipo_insumo="Material", id_insumo=9999, cantidad=Decimal("2")),
+    ])
+    db.session.commit()
+    return [c1.id, c2.id]
+
+FACTORES = {
+    "mano_obra": {"activo": True, "porcentaje": Decimal("0.05")},
+    "indirectos": {"activo": True, "porcentaje": Decimal("0.12")},
+    "financiamiento": {"activo": False, "porcentaje": Decimal("0.02")},
+    "utilidad": {"activo": True, "porcentaje": Decimal("0.10")},
+    "iva": {"activo": True, "porcentaje": Decimal("0.16")},
+}
+
 def test_material_creation(app):
     with app.app_context():
         m = Material(nombre="Cemento", unidad="kg", precio_unitario=5.0)
@@ -39,3 +115,1088 @@ def test_mano_obra_fasar(app):
 
         assert mo.fasar > 1.0
         assert mo.id is not None
+
+def test_calculo_lote_igual_al_individual(app):
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        matriz_en_linea = [{"tipo_insumo": "Material", "id_insumo": 0, "cantidad": 2, "precio_unitario_temp": 10}]
+
+        lote = calcular_precio_unitario_lote(concepto_ids=ids, matrices=[matriz_en_linea], factores=FACTORES)
+
+        assert [r.get("concepto_id") for r in lote[:2]] == ids
+        for resultado, concepto_id in zip(lote, ids):
+            individual = calcular_precio_unitario(concepto_id=concepto_id, factores=FACTORES)
+            assert resultado["costo_directo"] == individual["costo_directo"]
+            assert resultado["precio_unitario"] == individual["precio_unitario"]
+        assert lote[2]["indice"] == 0
+        assert lote[2]["precio_unitario"] == calcular_precio_unitario(matriz=matriz_en_linea, factores=FACTORES)["precio_unitario"]
+
+def test_calcular_pu_lote_endpoint(app, auth_client):
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+    resp = auth_client.post("/api/conceptos/calcular_pu_lote", json={"conceptos": ids, "factores": {"indirectos": {"activo": True, "porcentaje": 0.1}}})
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data["total"] == 2
+    assert all(r["precio_unitario"] > 0 for r in data["resultados"])
+
+    resp = auth_client.post("/api/conceptos/calcular_pu_lote", json={"conceptos": ["x"]})
+    assert resp.status_code == 400
+
+    invalidas = [[5], [[1]], [[{"tipo_insumo": "Material"}]], [[{"tipo_insumo": "Material", "cantidad": "abc"}]],
+                 [[], [{"tipo_insumo": "Otro", "cantidad": 1}]], [[{"tipo_insumo": "Equipo", "cantidad": 1, "precio_custom": "x"}]]]
+    for matrices in invalidas:
+        resp = auth_client.post("/api/conceptos/calcular_pu_lote", json={"matrices": matrices})
+        assert resp.status_code == 400 and "matrices[" in resp.get_json()["error"]
+    resp = auth_client.post("/api/conceptos/calcular_pu_lote", json={"matrices": [[], [{"tipo_insumo": "Otro", "cantidad": 1}]]})
+    assert resp.get_json()["error"].startswith("matrices[1][0].tipo_insumo")
+    assert auth_client.post("/api/conceptos/calcular_pu", json={"matriz": [{"tipo_insumo": "Material"}]}).status_code == 400
+
+def test_calcular_pu_lote_solo_conceptos_visibles(app, auth_client, otro_id):
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        ajeno = Concepto(clave="AJ-1", descripcion="Ajeno", unidad_concepto="m2", user_id=otro_id)
+        db.session.add(ajeno)
+        db.session.commit()
+        ajeno_id = ajeno.id
+
+    lote = auth_client.post("/api/conceptos/calcular_pu_lote", json={"conceptos": [ids[0], ajeno_id, 99999]}).get_json()
+    assert [r["concepto_id"] for r in lote["resultados"]] == [ids[0]]
+    assert lote["no_encontrados"] == [ajeno_id, 99999]
+
+def _crear_presupuesto(client, concepto_ids):
+    proyecto = client.post("/api/proyectos", json={
+        "nombre_proyecto": "Casa",
+        "ajustes": {"indirectos": {"activo": True, "porcentaje": 0.1}},
+    }).get_json()
+    partida = client.post("/api/partidas", json={"proyecto": proyecto["id"], "nombre_partida": "Obra negra"}).get_json()
+    detalles = [
+        client.post("/api/detalles-presupuesto", json={"partida": partida["id"], "concepto": cid, "cantidad_obra": 10}).get_json()
+        for cid in concepto_ids
+    ]
+    return proyecto, partida, detalles
+
+def test_recalculo_tras_cambio_de_precio(app, auth_client):
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        material_id = Material.query.filter_by(nombre="Cemento gris").first().id
+    proyecto, _, detalles = _crear_presupuesto(auth_client, ids)
+
+    resp = auth_client.put(f"/api/materiales/{material_id}", json={"precio_unitario": 250})
+    assert resp.status_code == 200
+
+    with app.app_context():
+        detalle = db.session.get(DetallePresupuesto, detalles[0]["id"])
+        esperado = calcular_precio_unitario(concepto_id=ids[0], factores={"indirectos": {"activo": True, "porcentaje": Decimal("0.1")}})
+        assert float(detalle.precio_unitario_calculado) == pytest.approx(esperado["precio_unitario"], abs=1e-4)
+        assert float(detalle.precio_unitario_calculado) > detalles[0]["precio_unitario_calculado"]
+
+    reporte = auth_client.post(f"/api/proyectos/{proyecto['id']}/recalcular").get_json()
+    assert reporte["detalles"] == 2
+    assert reporte["actualizados"] == 0
+    assert "duracion_ms" in reporte
+
+def test_indice_inverso_y_recalculo_incremental(app, auth_client):
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        maquina_id = Maquinaria.query.first().id
+    proyecto, _, detalles = _crear_presupuesto(auth_client, ids)
+
+    deps = auth_client.get(f"/api/catalogos/dependencias/Maquinaria/{maquina_id}").get_json()
+    assert deps["conceptos"] == [ids[1]]
+    assert [d["id"] for d in deps["detalles"]] == [detalles[1]["id"]]
+    assert deps["proyectos"] == [proyecto["id"]]
+
+    resp = auth_client.put(f"/api/maquinaria/{maquina_id}", json={"costo_adquisicion": 3000000})
+    assert resp.status_code == 200
+    with app.app_context():
+        sin_cambio = db.session.get(DetallePresupuesto, detalles[0]["id"])
+        con_cambio = db.session.get(DetallePresupuesto, detalles[1]["id"])
+        assert float(sin_cambio.precio_unitario_calculado) == pytest.approx(detalles[0]["precio_unitario_calculado"])
+        assert float(con_cambio.precio_unitario_calculado) > detalles[1]["precio_unitario_calculado"]
+
+    assert auth_client.get("/api/catalogos/dependencias/Otro/1").status_code == 400
+
+def test_dependencias_solo_del_usuario(app, auth_client, otro_id, otro_client):
+    ids = _crear_conceptos_de_prueba()
+    proyecto, _, detalles = _crear_presupuesto(auth_client, ids)
+    with app.app_context():
+        maquina_id = Maquinaria.query.one().id
+        ajeno = Material(nombre="Material ajeno", unidad="pza", precio_unitario=10, user_id=otro_id)
+        db.session.add(ajeno)
+        db.session.commit()
+        ajeno_id = ajeno.id
+
+    # El insumo global es visible, pero los presupuestos del primer usuario no
+    deps = otro_client.get(f"/api/catalogos/dependencias/Maquinaria/{maquina_id}").get_json()
+    assert deps["conceptos"] == [ids[1]] and deps["detalles"] == [] and deps["proyectos"] == []
+    deps = auth_client.get(f"/api/catalogos/dependencias/Maquinaria/{maquina_id}").get_json()
+    assert [d["id"] for d in deps["detalles"]] == [detalles[1]["id"]] and deps["proyectos"] == [proyecto["id"]]
+    assert auth_client.get(f"/api/catalogos/dependencias/Material/{ajeno_id}").status_code == 404
+
+def test_cache_pu_se_invalida_con_ediciones(app, auth_client):
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        material_id = Material.query.filter_by(nombre="Cemento gris").first().id
+        registro_id = MatrizInsumo.query.filter_by(concepto_id=ids[0]).first().id
+    cache_pu.limpiar()
+    cuerpo = {"concepto_id": ids[0], "factores": {"utilidad": {"activo": True, "porcentaje": 0.1}}}
+
+    primero = auth_client.post("/api/conceptos/calcular_pu", json=cuerpo).get_json()
+    hits = cache_pu.hits
+    assert auth_client.post("/api/conceptos/calcular_pu", json=cuerpo).get_json() == primero
+    assert cache_pu.hits == hits + 1
+
+    auth_client.put(f"/api/materiales/{material_id}", json={"precio_unitario": 300})
+    tras_catalogo = auth_client.post("/api/conceptos/calcular_pu", json=cuerpo).get_json()
+    assert tras_catalogo["precio_unitario"] > primero["precio_unitario"]
+
+    auth_client.put(f"/api/matriz/{registro_id}", json={"cantidad": 1})
+    tras_matriz = auth_client.post("/api/conceptos/calcular_pu", json=cuerpo).get_json()
+    with app.app_context():
+        esperado = calcular_precio_unitario(concepto_id=ids[0], factores={"utilidad": {"activo": True, "porcentaje": Decimal("0.1")}})
+    assert tras_matriz == esperado
+
+def test_calcular_pu_de_conceptos_visibles(app, auth_client, otro_id):
+    ids = _crear_conceptos_de_prueba()
+    with app.app_context():
+        ajeno = Concepto(clave="AJ-1", descripcion="Ajeno", unidad_concepto="m2", user_id=otro_id)
+        db.session.add(ajeno)
+        db.session.commit()
+        ajeno_id = ajeno.id
+
+    calcular = lambda concepto_id: auth_client.post("/api/conceptos/calcular_pu", json={"concepto_id": concepto_id})
+    assert calcular(ids[0]).status_code == 200
+    assert calcular(ajeno_id).status_code == 404
+    assert calcular("abc").status_code == 400
+    with app.app_context():
+        from backend.services.cache_pu_service import calcular_precio_unitario_cacheado
+        assert calcular_precio_unitario_cacheado(ajeno_id, user_id=None) is None
+        assert calcular_precio_unitario_cacheado(ajeno_id, user_id=otro_id) is not None
+        # Un concepto global se memoiza con las versiones de su dueño: la misma entrada para todos
+        previo = calcular(ids[0]).get_json()
+        hits = cache_pu.hits
+        assert calcular_precio_unitario_cacheado(ids[0], user_id=otro_id) == previo
+        assert cache_pu.hits == hits + 1
+
+def test_detalle_con_concepto_ajeno_o_inexistente(app, auth_client, otro_id):
+    ids = _crear_conceptos_de_prueba()
+    with app.app_context():
+        ajeno = Concepto(clave="AJ-1", descripcion="Ajeno", unidad_concepto="m2", user_id=otro_id)
+        db.session.add(ajeno)
+        db.session.commit()
+        ajeno_id = ajeno.id
+
+    _, partida, detalles = _crear_presupuesto(auth_client, ids[:1])
+    assert detalles[0]["id"]
+    for concepto_id in (ajeno_id, 99999):
+        resp = auth_client.post("/api/detalles-presupuesto", json={"partida": partida["id"], "concepto": concepto_id, "cantidad_obra": 1})
+        assert resp.status_code == 404
+    with app.app_context():
+        assert DetallePresupuesto.query.filter_by(partida_id=partida["id"]).count() == 1
+
+def test_matriz_solo_con_insumos_del_dueno(app, auth_client):
+    ids = _crear_conceptos_de_prueba()
+    material = auth_client.post("/api/materiales", json={"nombre": "Cemento propio", "unidad": "bto", "precio_unitario": 100}).get_json()
+    renglon = {"tipo_insumo": "Material", "id_insumo": material["id"], "cantidad": 1}
+    # Un concepto global no puede usar insumos de un usuario: su PU memoizado no vería los cambios de precio
+    resp = auth_client.post("/api/matriz", json={"concepto": ids[0], **renglon})
+    assert resp.status_code == 400
+    assert auth_client.post("/api/matriz", json={"concepto": ids[0], **renglon, "id_insumo": 99999}).status_code == 400
+
+    with app.app_context():
+        propio = Concepto(clave="P-1", descripcion="Firme", unidad_concepto="m2", user_id=User.query.filter_by(username="tester").one().id)
+        db.session.add(propio)
+        db.session.commit()
+        propio_id = propio.id
+    assert auth_client.post("/api/matriz", json={"concepto": propio_id, **renglon}).status_code == 201
+    calcular = lambda: auth_client.post("/api/conceptos/calcular_pu", json={"concepto_id": propio_id}).get_json()["precio_unitario"]
+    antes = calcular()
+    auth_client.put(f"/api/materiales/{material['id']}", json={"precio_unitario": 500})
+    assert calcular() == pytest.approx(antes * 5)
+
+def test_escenarios_de_precio(app, auth_client):
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        material_id = Material.query.filter_by(nombre="Cemento gris").first().id
+    proyecto, partida, detalles = _crear_presupuesto(auth_client, ids)
+    total_guardado = sum(d["cantidad_obra"] * d["precio_unitario_calculado"] for d in detalles)
+
+    resp = auth_client.post(f"/api/proyectos/{proyecto['id']}/escenarios", json={"escenarios": [
+        {"nombre": "Cemento +12%", "insumos": [{"tipo_insumo": "Material", "id_insumo": material_id, "porcentaje": 0.12}]},
+        {"nombre": "Mano de obra +8%", "tipos": {"ManoObra": 0.08}},
+        {"nombre": "Sin cambios"},
+    ]})
+    assert resp.status_code == 200
+    data = resp.get_json()
+    base = data["base"]["total"]
+    assert base == pytest.approx(total_guardado, rel=1e-6)
+    assert data["base"]["partidas"][0]["id"] == partida["id"]
+    cemento, mano_obra, neutro = data["escenarios"]
+    assert cemento["total"] > base and mano_obra["total"] > base
+    assert neutro["total"] == pytest.approx(base)
+
+    with app.app_context():
+        material = db.session.get(Material, material_id)
+        material.precio_unitario = material.precio_unitario * Decimal("1.12")
+        db.session.commit()
+    reporte = auth_client.post(f"/api/proyectos/{proyecto['id']}/recalcular").get_json()
+    assert reporte["actualizados"] == 1
+    detalles_nuevos = auth_client.get(f"/api/partidas/{partida['id']}/detalles").get_json()
+    assert sum(d["cantidad_obra"] * d["precio_unitario_calculado"] for d in detalles_nuevos) == pytest.approx(cemento["total"], rel=1e-6)
+
+    assert auth_client.post(f"/api/proyectos/{proyecto['id']}/escenarios", json={"escenarios": [{"tipos": {"Otro": 1}}]}).status_code == 400
+    for escenario in ({"insumos": [{"tipo_insumo": "Material", "id_insumo": "x", "porcentaje": 0.1}]},
+                      {"insumos": [{"tipo_insumo": "Material", "id_insumo": 1, "porcentaje": "mucho"}]},
+                      {"insumos": ["Material"]}, {"tipos": {"Material": "abc"}}):
+        resp = auth_client.post(f"/api/proyectos/{proyecto['id']}/escenarios", json={"escenarios": [escenario]})
+        assert resp.status_code == 400 and "error" in resp.get_json()
+
+def test_montecarlo_con_distribuciones(app, auth_client):
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        material_id = Material.query.filter_by(nombre="Cemento gris").first().id
+        mano_id = ManoObra.query.first().id
+    proyecto, _, _ = _crear_presupuesto(auth_client, ids)
+
+    resp = auth_client.put("/api/catalogos/distribuciones", json=[
+        {"tipo_insumo": "Material", "id_insumo": material_id, "precio_min": 150, "precio_promedio": 185.5, "precio_max": 260},
+        {"tipo_insumo": "ManoObra", "id_insumo": mano_id, "precio_min": 470, "precio_promedio": 480, "precio_max": 490},
+    ])
+    assert resp.status_code == 200
+    assert len(auth_client.get("/api/catalogos/distribuciones").get_json()) == 2
+
+    data = auth_client.post(f"/api/proyectos/{proyecto['id']}/montecarlo", json={"iteraciones": 20000, "semilla": 7}).get_json()
+    assert data["insumos_con_distribucion"] == 2
+    assert data["p50"] <= data["p80"] <= data["p95"]
+    assert data["media"] > data["base"]  # el rango del cemento está sesgado hacia arriba
+    assert data["impulsores"][0]["id_insumo"] == material_id
+    assert sum(i["participacion_varianza"] for i in data["impulsores"]) == pytest.approx(1.0)
+
+    assert auth_client.put("/api/catalogos/distribuciones", json=[{"tipo_insumo": "Material", "id_insumo": material_id,
+                                                                   "precio_min": 300, "precio_promedio": 185.5, "precio_max": 260}]).status_code == 400
+    for invalido in ({"tipo_insumo": "Material", "id_insumo": material_id, "precio_min": "abc", "precio_promedio": 1, "precio_max": 2},
+                     {"tipo_insumo": "Material", "id_insumo": "x", "precio_min": 1, "precio_promedio": 1, "precio_max": 2},
+                     {"tipo_insumo": "Material", "id_insumo": -3, "precio_min": 1, "precio_promedio": 1, "precio_max": 2},
+                     "Material"):
+        resp = auth_client.put("/api/catalogos/distribuciones", json=[invalido])
+        assert resp.status_code == 400 and "error" in resp.get_json()
+    assert auth_client.post(f"/api/proyectos/{proyecto['id']}/montecarlo", json={"iteraciones": 0}).status_code == 400
+
+def test_aritmetica_entera_coincide_con_decimal(app, auth_client):
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        rng = random.Random(42)
+        insumos = [(t, m.query.first().id) for t, m in (("Material", Material), ("ManoObra", ManoObra),
+                                                         ("Equipo", Equipo), ("Maquinaria", Maquinaria))]
+        matrices = []
+        for _ in range(50):
+            matriz = []
+            for _ in range(rng.randint(1, 12)):
+                tipo, insumo_id = rng.choice(insumos)
+                registro = {"tipo_insumo": tipo, "id_insumo": insumo_id, "cantidad": round(rng.uniform(0, 25), 4)}
+                if rng.random() < 0.3:
+                    registro["precio_custom"] = round(rng.uniform(1, 5000), 2)
+                    registro["rendimiento_jornada"] = round(rng.uniform(0.5, 10), 2)
+                matriz.append(registro)
+            matrices.append(matriz)
+
+        decimal = calcular_precio_unitario_lote(concepto_ids=ids, matrices=matrices, factores=FACTORES)
+        entera = calcular_precio_unitario_lote(concepto_ids=ids, matrices=matrices, factores=FACTORES, aritmetica="entera")
+        for a, b in zip(decimal, entera):
+            assert b["costo_directo"] == pytest.approx(a["costo_directo"], abs=1e-3)
+            assert b["precio_unitario"] == pytest.approx(a["precio_unitario"], abs=1e-3)
+
+    resp = auth_client.post("/api/conceptos/calcular_pu", json={"concepto_id": ids[0], "aritmetica": "entera"})
+    assert resp.status_code == 200
+    assert auth_client.post("/api/conceptos/calcular_pu", json={"concepto_id": ids[0], "aritmetica": "binaria"}).status_code == 400
+
+def test_plan_de_costo_compilado(app, auth_client):
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        for concepto_id in ids:
+            registros = [r.to_dict() for r in MatrizInsumo.query.filter_by(concepto_id=concepto_id)]
+            esperado = sum(Decimal(str(r["cantidad"])) * obtener_costo_insumo(r, {}, {}, {}, {}) for r in registros)
+            assert _sumar_plan(compilar_plan(registros), {}, {}, {}, {})[0] == esperado
+        mano_id = ManoObra.query.first().id
+
+    antes = auth_client.post("/api/conceptos/calcular_pu", json={"concepto_id": ids[0]}).get_json()
+    registro = auth_client.post("/api/matriz", json={"concepto": ids[0], "tipo_insumo": "ManoObra",
+                                                     "id_insumo": mano_id, "cantidad": 0.5}).get_json()
+    with app.app_context():
+        assert db.session.get(Concepto, ids[0]).plan_costo is not None
+    despues = auth_client.post("/api/conceptos/calcular_pu", json={"concepto_id": ids[0]}).get_json()
+    assert despues["costo_directo"] > antes["costo_directo"]
+
+    auth_client.delete(f"/api/matriz/{registro['id']}")
+    final = auth_client.post("/api/conceptos/calcular_pu", json={"concepto_id": ids[0]}).get_json()
+    assert final["costo_directo"] == antes["costo_directo"]
+
+def test_matriz_en_linea_con_id_no_numerico(app, auth_client):
+    matriz = [
+        {"tipo_insumo": "Material", "id_insumo": "abc", "cantidad": 2},
+        {"tipo_insumo": "Equipo", "id_insumo": "x", "cantidad": 1, "precio_custom": 50},
+    ]
+    resp = auth_client.post("/api/conceptos/calcular_pu", json={"matriz": matriz})
+    assert resp.status_code == 200
+    assert resp.get_json()["costo_directo"] == pytest.approx(50.0)
+
+def test_explosion_insumos(app, auth_client):
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        cd_base = sum(calcular_precio_unitario(concepto_id=cid)["costo_directo"] for cid in ids)
+        material_id = Material.query.filter_by(nombre="Cemento gris").first().id
+    proyecto, _, _ = _crear_presupuesto(auth_client, ids)
+
+    resp = auth_client.get(f"/api/proyectos/{proyecto['id']}/explosion_insumos")
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data["total"] == pytest.approx(cd_base * 10)
+    cemento = next(i for i in data["insumos"] if i["tipo_insumo"] == "Material" and i["id_insumo"] == material_id)
+    assert cemento["cantidad"] == pytest.approx((0.14 + 0.3333) * 10)
+    assert cemento["cantidad_con_merma"] == pytest.approx((0.14 * 1.05 + 0.3333 * 1.10) * 10)
+    assert cemento["nombre"] == "Cemento gris"
+    borrado = next(i for i in data["insumos"] if i["id_insumo"] == 9999)
+    assert borrado["nombre"] is None and borrado["importe"] == 0
+    assert sum(data["totales_por_tipo"].values()) == pytest.approx(data["total"])
+
+def test_subtotales_materializados(app, auth_client):
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        material_id = Material.query.filter_by(nombre="Cemento gris").first().id
+    proyecto, partida, detalles = _crear_presupuesto(auth_client, ids)
+
+    def total_esperado():
+        with app.app_context():
+            return sum(float(d.cantidad_obra) * float(d.precio_unitario_calculado) for d in DetallePresupuesto.query.all())
+
+    data = auth_client.get(f"/api/proyectos/{proyecto['id']}/totales").get_json()
+    assert data["total"] == pytest.approx(total_esperado())
+    assert data["partidas"][0]["total"] == pytest.approx(data["total"])
+
+    auth_client.put(f"/api/detalles-presupuesto/{detalles[0]['id']}", json={"cantidad_obra": 25})
+    auth_client.put(f"/api/materiales/{material_id}", json={"precio_unitario": 250})
+    assert auth_client.get(f"/api/proyectos/{proyecto['id']}").get_json()["total"] == pytest.approx(total_esperado())
+
+    assert auth_client.delete(f"/api/detalles-presupuesto/{detalles[1]['id']}").status_code == 204
+    data = auth_client.get(f"/api/proyectos/{proyecto['id']}/totales").get_json()
+    assert data["total"] == pytest.approx(total_esperado())
+    assert data["excede_presupuesto_maximo"] is False
+
+    auth_client.put(f"/api/proyectos/{proyecto['id']}", json={"has_presupuesto_maximo": True, "monto_maximo": 1})
+    assert auth_client.get(f"/api/proyectos/{proyecto['id']}/totales").get_json()["excede_presupuesto_maximo"] is True
+
+def test_fasar_por_lote(app, auth_client):
+    with app.app_context():
+        user_id = User.query.filter_by(username="tester").first().id
+        for i in range(30):
+            mano = ManoObra(user_id=user_id, puesto=f"Puesto {i}", salario_base=Decimal(300 + 25 * (i % 7)),
+                            antiguedad_anios=i % 12)
+            mano.refresh_fasar()
+            db.session.add(mano)
+        db.session.commit()
+
+    data = auth_client.post("/api/fasar", json={"valor_uma": 113.14, "impuesto_sobre_nomina": 0.04}).get_json()
+    assert data["fasar"]["trabajadores"] == 30
+    assert data["fasar"]["actualizados"] == 30
+
+    with app.app_context():
+        for mano in ManoObra.query.filter_by(user_id=user_id):
+            esperado = ManoObra(user_id=user_id, salario_base=mano.salario_base, antiguedad_anios=mano.antiguedad_anios)
+            esperado.refresh_fasar()
+            assert mano.fasar == esperado.fasar
+
+def test_fasar_un_solo_commit(app, auth_client, monkeypatch):
+    with app.app_context():
+        user_id = User.query.filter_by(username="tester").first().id
+        mano = ManoObra(user_id=user_id, puesto="Oficial", salario_base=Decimal("480"), antiguedad_anios=3)
+        mano.refresh_fasar()
+        db.session.add(mano)
+        db.session.commit()
+        mano_id, fasar_original = mano.id, mano.fasar
+
+    def fallar(*args, **kwargs):
+        raise RuntimeError("recalculo")
+    monkeypatch.setattr("backend.routes.catalogos.recalcular_proyectos_usuario", fallar)
+    with pytest.raises(RuntimeError):
+        auth_client.post("/api/fasar", json={"valor_uma": 120})
+    db.session.rollback()  # lo que hace el teardown de la petición
+    monkeypatch.undo()
+    # Ni las constantes ni el FASAR de los trabajadores quedaron a medias
+    from backend.models import ConstantesFASAR
+    assert ConstantesFASAR.query.count() == 0
+    assert db.session.get(ManoObra, mano_id).fasar == fasar_original
+
+    # Las constantes que no se guardaron tampoco quedaron en el cache con la versión siguiente
+    auth_client.post("/api/fasar", json={"valor_uma": 130})
+    assert auth_client.get("/api/fasar").get_json()["valor_uma"] == pytest.approx(130)
+
+def test_constantes_fasar_lectura_sin_escritura(app, auth_client):
+    from backend.models import ConstantesFASAR
+
+    data = auth_client.get("/api/fasar").get_json()
+    assert data["valor_uma"] == pytest.approx(108.57)
+    with app.app_context():
+        assert ConstantesFASAR.query.count() == 0
+        mano = ManoObra(puesto="Peón", salario_base=Decimal("350"))
+        mano.refresh_fasar()
+        assert ConstantesFASAR.query.count() == 0
+        user_id = User.query.filter_by(username="tester").first().id
+        assert obtener_constantes(user_id) is obtener_constantes(user_id)
+
+    auth_client.post("/api/fasar", json={"valor_uma": 120})
+    assert auth_client.get("/api/fasar").get_json()["valor_uma"] == pytest.approx(120)
+    with app.app_context():
+        assert ConstantesFASAR.query.count() == 1
+
+def test_migraciones_versionadas(tmp_path):
+    from sqlalchemy import inspect, text
+    from backend.migraciones import PASOS, actualizar_esquema, version_esquema
+
+    class ConfigArchivo(ConfigPruebas):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'antigua.sqlite3'}"
+
+    app = create_app(ConfigArchivo)
+    with app.app_context():
+        # Base "antigua": sin subtotales, sin plan de costo y sin índices de user_id
+        db.create_all()
+        with db.engine.begin() as conn:
+            conn.execute(text("DROP INDEX ix_materiales_user_id"))
+            conn.execute(text("DROP INDEX ix_matriz_insumo_concepto_id"))
+            conn.execute(text("ALTER TABLE conceptos DROP COLUMN plan_costo"))
+            conn.execute(text("ALTER TABLE partidas DROP COLUMN total"))
+            conn.execute(text("INSERT INTO proyectos (id, nombre_proyecto, fecha_creacion, total, total_costo_directo) VALUES (1, 'Previo', '2024-01-01', 0, 0)"))
+            conn.execute(text("INSERT INTO partidas (id, proyecto_id, nombre_partida, total_costo_directo) VALUES (1, 1, 'P', 0)"))
+        assert version_esquema() == 0
+
+        assert actualizar_esquema() == [version for version, _, _ in PASOS]
+        assert version_esquema() == PASOS[-1][0]
+        inspector = inspect(db.engine)
+        assert "plan_costo" in {c["name"] for c in inspector.get_columns("conceptos")}
+        assert "total" in {c["name"] for c in inspector.get_columns("partidas")}
+        assert "ix_materiales_user_id" in {i["name"] for i in inspector.get_indexes("materiales")}
+        assert "ix_matriz_insumo_concepto_id" in {i["name"] for i in inspector.get_indexes("matriz_insumo")}
+
+        # Una segunda corrida no hace nada
+        assert actualizar_esquema() == []
+        db.session.remove()
+
+    resultado = app.test_cli_runner().invoke(args=["db-upgrade"])
+    assert resultado.exit_code == 0
+    assert f"versión {PASOS[-1][0]}" in resultado.output
+
+def test_perfil_sqlite_y_reintentos(tmp_path):
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+    from backend.base_datos import reintentar_si_bloqueada
+
+    class ConfigArchivo(ConfigPruebas):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'perfil.sqlite3'}"
+        SQLITE_BUSY_TIMEOUT_MS = 1234
+
+    app = create_app(ConfigArchivo)
+    with app.app_context():
+        with db.engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 1234
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+            assert conn.execute(text("PRAGMA foreign_keys")).scalar() == 1
+
+        llamadas = []
+
+        def escribir():
+            llamadas.append(1)
+            if len(llamadas) < 3:
+                raise OperationalError("UPDATE", {}, Exception("database is locked"))
+            return "ok"
+
+        assert reintentar_si_bloqueada(escribir, intentos=3, espera_ms=1)() == "ok"
+        assert len(llamadas) == 3
+
+        llamadas.clear()
+        with pytest.raises(OperationalError):
+            reintentar_si_bloqueada(escribir, intentos=2, espera_ms=1)()
+        assert len(llamadas) == 2
+        db.session.remove()
+
+    # Solo se repiten las vistas marcadas: ni la importación por lotes ni las que llaman a Gemini
+    con_reintentos = lambda endpoint: app.view_functions[endpoint].__code__ is reintentar_si_bloqueada(len).__code__
+    assert con_reintentos("catalogos.materiales_collection") and con_reintentos("proyectos.detalle_create")
+    assert not con_reintentos("catalogos.importar_catalogo_archivo")
+    assert not any(con_reintentos(f"ia.{vista}") for vista in ("chat_apu", "cotizar_material", "cotizar_multiples_materiales"))
+
+def test_borrar_concepto_presupuestado(app, auth_client):
+    ids = _crear_conceptos_de_prueba()
+    _, _, detalles = _crear_presupuesto(auth_client, ids[:1])
+
+    respuesta = auth_client.delete(f"/api/conceptos/{ids[0]}")
+    assert respuesta.status_code == 409
+    assert respuesta.get_json()["detalles"] == 1
+    with app.app_context():
+        assert db.session.get(Concepto, ids[0]) is not None
+
+    assert auth_client.delete(f"/api/detalles-presupuesto/{detalles[0]['id']}").status_code in (200, 204)
+    assert auth_client.delete(f"/api/conceptos/{ids[0]}").status_code == 204
+    assert auth_client.delete(f"/api/conceptos/{ids[1]}").status_code == 204
+    with app.app_context():
+        assert MatrizInsumo.query.count() == 0
+
+def test_listado_catalogos_paginado(app, auth_client, otro_id):
+    from datetime import date, timedelta
+
+    with app.app_context():
+        user_id = User.query.filter_by(username="tester").first().id
+        for i in range(25):
+            db.session.add(Material(
+                user_id=user_id, nombre=f"Mat {i:02d}", unidad="pza", precio_unitario=Decimal(i + 1),
+                disciplina="Eléctrica" if i % 2 else "Civil",
+                fecha_actualizacion=date.today() - timedelta(days=400 if i < 5 else 0),
+            ))
+        db.session.add(Material(user_id=otro_id, nombre="Ajeno", unidad="pza", precio_unitario=Decimal("1")))
+        db.session.add(Equipo(user_id=otro_id, nombre="Andamio ajeno", unidad="hr", costo_hora_maq=Decimal("5")))
+        db.session.commit()
+
+    # Sin limit se conserva la lista completa, igual a to_dict()
+    completa = auth_client.get("/api/materiales").get_json()
+    assert len(completa) == 25
+    with app.app_context():
+        assert completa[0] == Material.query.filter_by(nombre="Mat 00").one().to_dict()
+
+    nombres, cursor = [], None
+    while True:
+        url = "/api/materiales?limit=10&fields=id,nombre" + (f"&cursor={cursor}" if cursor else "")
+        pagina = auth_client.get(url).get_json()
+        assert all(set(item) == {"id", "nombre"} for item in pagina["items"])
+        nombres.extend(item["nombre"] for item in pagina["items"])
+        cursor = pagina["siguiente_cursor"]
+        if not cursor:
+            break
+    assert nombres == [f"Mat {i:02d}" for i in range(25)]
+
+    filtrada = auth_client.get("/api/materiales?disciplina=Civil&obsoleto=true&q=mat&fields=nombre,obsoleto").get_json()
+    assert filtrada == [{"nombre": f"Mat {i:02d}", "obsoleto": True} for i in (0, 2, 4)]
+
+    assert auth_client.get("/api/equipo").get_json() == []
+    assert auth_client.get("/api/materiales?fields=precio").status_code == 400
+    assert auth_client.get("/api/conceptos?obsoleto=true").status_code == 400
+
+def test_matriz_de_concepto_ajeno(app, auth_client, otro_id):
+    ids = _crear_conceptos_de_prueba()
+    with app.app_context():
+        ajeno = Concepto(clave="AJ-1", descripcion="Ajeno", unidad_concepto="m2", user_id=otro_id)
+        db.session.add(ajeno)
+        db.session.flush()
+        renglon = MatrizInsumo(concepto_id=ajeno.id, tipo_insumo="Equipo", id_insumo=0, cantidad=Decimal("1"), precio_custom=Decimal("10"))
+        db.session.add(renglon)
+        db.session.commit()
+        ajeno_id, renglon_id = ajeno.id, renglon.id
+
+    nuevo = {"tipo_insumo": "Equipo", "id_insumo": 0, "cantidad": 1, "precio_custom": 99}
+    assert auth_client.post("/api/matriz", json={"concepto": ajeno_id, **nuevo}).status_code == 404
+    assert auth_client.post("/api/matriz", json={"concepto": 99999, **nuevo}).status_code == 404
+    assert auth_client.put(f"/api/matriz/{renglon_id}", json={"cantidad": 5}).status_code == 404
+    assert auth_client.delete(f"/api/matriz/{renglon_id}").status_code == 404
+    assert auth_client.post("/api/matriz", json={"concepto": ids[0], **nuevo}).status_code == 201
+    with app.app_context():
+        assert MatrizInsumo.query.filter_by(concepto_id=ajeno_id).one().cantidad == Decimal("1")
+
+def test_etag_get_condicional(app, auth_client):
+    from sqlalchemy import event
+
+    primera = auth_client.get("/api/materiales")
+    etag = primera.headers["ETag"]
+    assert primera.status_code == 200 and etag
+
+    consultas = []
+    def registrar(conn, cursor, sql, *args):
+        consultas.append(sql)
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", registrar)
+        try:
+            respuesta = auth_client.get("/api/materiales", headers={"If-None-Match": etag})
+        finally:
+            event.remove(db.engine, "before_cursor_execute", registrar)
+    assert respuesta.status_code == 304
+    assert respuesta.headers["ETag"] == etag
+    assert not any("FROM materiales" in sql for sql in consultas)
+
+    # Otra URL (query string) tiene otro ETag; una escritura lo invalida
+    assert auth_client.get("/api/materiales?limit=5").headers["ETag"] != etag
+    auth_client.post("/api/materiales", json={"nombre": "Varilla", "unidad": "kg", "precio_unitario": 20})
+    respuesta = auth_client.get("/api/materiales", headers={"If-None-Match": etag})
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()[0]["nombre"] == "Varilla"
+
+    etag_proyectos = auth_client.get("/api/proyectos").headers["ETag"]
+    assert auth_client.get("/api/proyectos", headers={"If-None-Match": etag_proyectos}).status_code == 304
+    auth_client.post("/api/proyectos", json={"nombre_proyecto": "Casa"})
+    assert auth_client.get("/api/proyectos", headers={"If-None-Match": etag_proyectos}).status_code == 200
+
+    etag_fasar = auth_client.get("/api/fasar").headers["ETag"]
+    auth_client.post("/api/fasar", json={"valor_uma": 110})
+    assert auth_client.get("/api/fasar", headers={"If-None-Match": etag_fasar}).status_code == 200
+
+def test_escrituras_en_proyecto_ajeno(app, auth_client, otro_client):
+    ids = _crear_conceptos_de_prueba()
+    proyecto, partida, _ = _crear_presupuesto(auth_client, [])
+
+    etag = auth_client.get(f"/api/proyectos/{proyecto['id']}/totales").headers["ETag"]
+    assert otro_client.post("/api/partidas", json={"proyecto": proyecto["id"], "nombre_partida": "Intrusa"}).status_code == 404
+    resp = otro_client.post("/api/detalles-presupuesto", json={"partida": partida["id"], "concepto": ids[0], "cantidad_obra": 5})
+    assert resp.status_code == 404
+    assert auth_client.get(f"/api/proyectos/{proyecto['id']}/totales", headers={"If-None-Match": etag}).status_code == 304
+
+    auth_client.post("/api/detalles-presupuesto", json={"partida": partida["id"], "concepto": ids[0], "cantidad_obra": 5})
+    assert auth_client.get(f"/api/proyectos/{proyecto['id']}/totales", headers={"If-None-Match": etag}).status_code == 200
+
+def test_busqueda_fts(app, auth_client):
+    from backend.services.busqueda_service import buscar
+    from backend.services.gemini_service import construir_sugerencia_apu
+
+    auth_client.post("/api/materiales", json={"nombre": "Cemento gris CPC 30R", "unidad": "bto", "precio_unitario": 190})
+    auth_client.post("/api/materiales", json={"nombre": "Arena de río", "unidad": "m3", "precio_unitario": 450})
+    auth_client.post("/api/manoobra", json={"puesto": "Oficial albañil", "salario_base": 480})
+    auth_client.post("/api/conceptos", json={"clave": "MUR-01", "descripcion": "Muro de tabique rojo recocido", "unidad_concepto": "m2"})
+
+    data = auth_client.get("/api/buscar?q=albanil").get_json()
+    assert [(r["tipo"], r["texto"]) for r in data["resultados"]] == [("ManoObra", "Oficial albañil")]
+    assert auth_client.get("/api/buscar?q=RIO").get_json()["resultados"][0]["texto"] == "Arena de río"
+    assert auth_client.get("/api/buscar?q=tabiq&tipos=Concepto").get_json()["resultados"][0]["tipo"] == "Concepto"
+    assert auth_client.get("/api/buscar?q=tabique&tipos=Material").get_json()["resultados"] == []
+
+    # Las escrituras mantienen el índice al día
+    with app.app_context():
+        arena = Material.query.filter_by(nombre="Arena de río").one()
+        user_id = arena.user_id
+    auth_client.put(f"/api/materiales/{arena.id}", json={"nombre": "Grava triturada"})
+    with app.app_context():
+        assert buscar("arena", user_id) == []
+        assert buscar("grava", user_id)[0]["id"] == arena.id
+    auth_client.delete(f"/api/materiales/{arena.id}")
+    with app.app_context():
+        assert buscar("grava", user_id) == []
+        sugerencias = construir_sugerencia_apu("Concreto f'c=200", user_id)
+        assert sugerencias[0]["nombre"] == "Cemento gris CPC 30R"
+
+    sugerido = auth_client.post("/api/catalogos/sugerir_precio_mercado", json={"nombre": "cemento gris"}).get_json()
+    assert sugerido == {"precio_sugerido": 190.0, "fuente": "catalogo_similar"}
+
+def test_busqueda_fts_aislada_por_usuario(app):
+    from sqlalchemy import insert
+    from backend.services.busqueda_service import MAX_CANDIDATOS, buscar, buscar_con_tiempo
+
+    propio, ajeno = User(username="a"), User(username="b")
+    propio.set_password("secreto")
+    ajeno.set_password("secreto")
+    db.session.add_all([propio, ajeno])
+    db.session.flush()
+    db.session.add(Material(nombre="Cemento propio", unidad="bto", precio_unitario=190, user_id=propio.id))
+    db.session.add(Material(nombre="Cemento", unidad="bto", precio_unitario=200, user_id=ajeno.id))
+    db.session.flush()
+    # Coincidencias más recientes de otro usuario, más de las que entran en el corte
+    db.session.execute(insert(Material), [
+        {"nombre": f"Cemento ajeno {i}", "unidad": "bto", "precio_unitario": 100, "user_id": ajeno.id}
+        for i in range(MAX_CANDIDATOS + 200)
+    ])
+    db.session.commit()
+
+    assert [r["texto"] for r in buscar("cemento", propio.id)] == ["Cemento propio"]
+    assert len(buscar("cemento", ajeno.id, limite=50)) == 50
+    assert buscar("cemento", None) == []
+    assert buscar(f"u{ajeno.id}", propio.id) == []
+
+    # Con más coincidencias que el corte solo se ordenan las recientes y la respuesta lo indica
+    assert buscar("cemento", ajeno.id, limite=1)[0]["texto"] != "Cemento"
+    assert buscar("cemento", ajeno.id, limite=1, max_candidatos=None)[0]["texto"] == "Cemento"
+    assert buscar_con_tiempo("cemento", ajeno.id, None, 5)["candidatos_recortados"] is True
+    assert buscar_con_tiempo("cemento", propio.id, None, 5)["candidatos_recortados"] is False
+
+def test_emparejamiento_insumos_ia(app, auth_client, monkeypatch):
+    from backend.services.emparejamiento_service import indice_catalogo, unidades_compatibles
+
+    auth_client.post("/api/materiales", json={"nombre": "Cemento gris CPC 30R", "unidad": "bto", "precio_unitario": 190})
+    auth_client.post("/api/materiales", json={"nombre": "Varilla corrugada 3/8", "unidad": "kg", "precio_unitario": 24})
+    auth_client.post("/api/materiales", json={"nombre": "Arena de río", "unidad": "m3", "precio_unitario": 450})
+    auth_client.post("/api/manoobra", json={"puesto": "Oficial albañil", "salario_base": 480})
+
+    assert unidades_compatibles("m³", "M3") and unidades_compatibles("Kg.", "toneladas")
+    assert not unidades_compatibles("m2", "kg") and unidades_compatibles("bulto", "kg")
+
+    insumos = [
+        {"tipo_insumo": "Material", "nombre": "Cemento CPC 30R gris", "unidad": "bto", "cantidad": 0.2, "precio_sugerido": 200},
+        {"tipo_insumo": "Material", "nombre": "Varila corrugada de 3/8\"", "unidad": "kg", "cantidad": 4},
+        {"tipo_insumo": "Material", "nombre": "Arena de rio", "unidad": "kg", "cantidad": 1},
+        {"tipo_insumo": "Mano de Obra", "nombre": "Oficial albanil", "unidad": "jor", "cantidad": 0.1},
+        {"tipo_insumo": "Material", "nombre": "Impermeabilizante acrílico", "unidad": "lt", "cantidad": 1},
+    ]
+    monkeypatch.setattr("backend.routes.ia.generar_apu_con_gemini", lambda *args: {"insumos": insumos})
+    filas = auth_client.post("/api/ia/chat_apu", json={"descripcion": "Muro"}).get_json()["insumos"]
+
+    assert [f["nombre_catalogo"] for f in filas[:2]] == ["Cemento gris CPC 30R", "Varilla corrugada 3/8"]
+    assert all(f["existe_en_catalogo"] and f["insumo_id"] for f in filas[:2])
+    assert filas[0]["precio_unitario_temp"] == 200
+    # Mismo nombre pero unidad incompatible: baja la confianza y queda como sugerencia
+    assert filas[2]["insumo_id"] == 0 and filas[2]["nombre_catalogo"] == "Arena de río"
+    assert filas[3]["tipo_insumo"] == "ManoObra" and filas[3]["existe_en_catalogo"]
+    # costo_unitario es lo que cobra el cálculo de PU por unidad: con merma y flete, FASAR y rendimiento
+    for fila in (filas[0], filas[3]):
+        matriz = [{"tipo_insumo": fila["tipo_insumo"], "id_insumo": fila["insumo_id"], "cantidad": 1}]
+        costo = auth_client.post("/api/conceptos/calcular_pu", json={"matriz": matriz}).get_json()["costo_directo"]
+        assert fila["costo_unitario"] == pytest.approx(costo)
+    assert filas[0]["costo_unitario"] > 190 and filas[3]["costo_unitario"] != 480
+    assert filas[4]["insumo_id"] == 0 and not filas[4]["existe_en_catalogo"]
+
+    # El índice se reutiliza hasta que cambia el catálogo
+    with app.app_context():
+        user_id = Material.query.first().user_id
+        indice = indice_catalogo(user_id)
+        assert indice_catalogo(user_id) is indice
+    auth_client.post("/api/materiales", json={"nombre": "Impermeabilizante acrílico 5 años", "unidad": "lt", "precio_unitario": 95})
+    with app.app_context():
+        assert indice_catalogo(user_id) is not indice
+    filas = auth_client.post("/api/ia/chat_apu", json={"descripcion": "Muro"}).get_json()["insumos"]
+    assert filas[4]["existe_en_catalogo"] and filas[4]["nombre_catalogo"] == "Impermeabilizante acrílico 5 años"
+
+def _xlsx(filas):
+    import io
+    import zipfile
+    from xml.sax.saxutils import escape
+    compartidas = sorted({v for fila in filas for v in fila if isinstance(v, str)})
+    celdas = lambda i, fila: "".join(
+        f'<c r="{chr(65 + j)}{i}" t="s"><v>{compartidas.index(v)}</v></c>' if isinstance(v, str)
+        else f'<c r="{chr(65 + j)}{i}"><v>{v}</v></c>'
+        for j, v in enumerate(fila)
+    )
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    hoja = f'<worksheet {ns}><sheetData>' + "".join(
+        f'<row r="{i}">{celdas(i, fila)}</row>' for i, fila in enumerate(filas, start=1)
+    ) + "</sheetData></worksheet>"
+    cadenas = f'<sst {ns}>' + "".join(f"<si><t>{escape(v)}</t></si>" for v in compartidas) + "</sst>"
+    salida = io.BytesIO()
+    with zipfile.ZipFile(salida, "w") as libro:
+        libro.writestr("xl/worksheets/sheet1.xml", hoja)
+        libro.writestr("xl/sharedStrings.xml", cadenas)
+    salida.seek(0)
+    return salida
+
+def test_importacion_catalogo(app, auth_client):
+    import io
+    from backend.models import HistorialPrecio
+
+    auth_client.post("/api/materiales", json={"nombre": "Cemento Gris", "unidad": "bto", "precio_unitario": 180})
+    csv = ("Nombre;Unidad;Precio;Proveedor\n"
+           "cemento gris;bto;$195.50;Cemex\n"
+           "Arena de río;m3;1,450.00;\n"
+           "Grava;m3;abc;\n"
+           "Varilla 3/8;;24\n"
+           "Tabique rojo;pza;3,5;\n")
+    respuesta = auth_client.post("/api/catalogos/importar", data={
+        "tipo": "Material", "archivo": (io.BytesIO(csv.encode()), "lista.csv")}, content_type="multipart/form-data")
+    reporte = respuesta.get_json()
+    assert respuesta.status_code == 200
+    assert (reporte["filas"], reporte["insertados"], reporte["actualizados"], reporte["con_error"]) == (5, 2, 1, 2)
+    assert [e["fila"] for e in reporte["errores"]] == [4, 5] and reporte["columnas_ignoradas"] == ["Proveedor"]
+    with app.app_context():
+        precios = {m.nombre: float(m.precio_unitario) for m in Material.query.all()}
+        assert precios == {"Cemento Gris": 195.5, "Arena de río": 1450.0, "Tabique rojo": 3.5}
+        assert HistorialPrecio.query.count() == 4  # el alta por la API más las tres de la importación
+
+    # XLSX: mano de obra con FASAR calculado; la segunda carga solo escribe lo que cambió
+    xlsx = lambda salario: _xlsx([["Puesto", "Salario base", "Antigüedad años"], ["Oficial albañil", salario, 3], ["Peón", 300, 1]])
+    auth_client.post("/api/catalogos/importar", data={"tipo": "ManoObra", "archivo": (xlsx(480), "mo.xlsx")})
+    reporte = auth_client.post("/api/catalogos/importar", data={"tipo": "ManoObra", "archivo": (xlsx(500), "mo.xlsx")}).get_json()
+    assert (reporte["insertados"], reporte["actualizados"], reporte["sin_cambios"], reporte["historial"]) == (0, 1, 1, 1)
+    with app.app_context():
+        oficial = ManoObra.query.filter_by(puesto="Oficial albañil").one()
+        assert float(oficial.salario_base) == 500 and oficial.fasar > 1
+        fasar = oficial.fasar
+        oficial.refresh_fasar()
+        assert oficial.fasar == fasar
+        historial = HistorialPrecio.query.filter_by(tipo_insumo="ManoObra", id_insumo=oficial.id).order_by(HistorialPrecio.id).all()
+        assert [(h.precio_anterior, float(h.precio_nuevo)) for h in historial][-1] == (Decimal("480.0000"), 500.0)
+
+    assert auth_client.post("/api/catalogos/importar", data={
+        "archivo": (io.BytesIO(b"precio\n1\n"), "lista.csv")}).get_json() == {"error": "Faltan columnas: nombre, unidad"}
+    assert auth_client.post("/api/catalogos/importar", data={
+        "archivo": (io.BytesIO(b"x"), "lista.pdf")}).status_code == 400
+
+def test_importacion_interrumpida(app, auth_client):
+    import io
+
+    material = auth_client.post("/api/materiales", json={"nombre": "Cemento", "unidad": "bto", "precio_unitario": 100}).get_json()
+    concepto = auth_client.post("/api/conceptos", json={"clave": "M-1", "descripcion": "Firme", "unidad_concepto": "m2"}).get_json()
+    auth_client.post("/api/matriz", json={"concepto": concepto["id"], "tipo_insumo": "Material", "id_insumo": material["id"], "cantidad": 1})
+    _, _, detalles = _crear_presupuesto(auth_client, [concepto["id"]])
+
+    # Tres lotes válidos y después bytes que no son UTF-8
+    filas = "".join(f"Insumo {i};pza;1\n" for i in range(2999))
+    contenido = ("Nombre;Unidad;Precio\ncemento;bto;200\n" + filas).encode() + b"\xff\xfe;pza;1\n"
+    respuesta = auth_client.post("/api/catalogos/importar", data={
+        "tipo": "Material", "archivo": (io.BytesIO(contenido), "lista.csv")}, content_type="multipart/form-data")
+    reporte = respuesta.get_json()
+    assert respuesta.status_code == 400
+    assert reporte["error"] == "El CSV debe estar codificado en UTF-8"
+    # El bloque que no se pudo decodificar se pierde; lo leído antes sí se importa
+    assert reporte["actualizados"] == 1 and 2000 <= reporte["insertados"] == reporte["filas"] - 1
+    assert reporte["recalculo"]["actualizados"] == 1
+    with app.app_context():
+        detalle = db.session.get(DetallePresupuesto, detalles[0]["id"])
+        assert float(detalle.costo_directo) == pytest.approx(2 * detalles[0]["costo_directo"])
+
+def test_exportaciones_en_streaming(app, auth_client):
+    import csv
+    import gzip
+    import io
+    import json
+
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        db.session.add(Concepto(clave="C-3", descripcion="Sin matriz", unidad_concepto="pza"))
+        db.session.commit()
+    proyecto, partida, detalles = _crear_presupuesto(auth_client, ids)
+
+    respuesta = auth_client.get("/api/materiales/exportar")
+    assert respuesta.is_streamed and respuesta.headers["Content-Disposition"] == 'attachment; filename="materiales.csv"'
+    filas = list(csv.DictReader(io.StringIO(respuesta.get_data(as_text=True))))
+    assert [(f["nombre"], f["precio_unitario"], f["obsoleto"]) for f in filas] == [("Cemento gris", "185.5", "false")]
+
+    respuesta = auth_client.get("/api/maquinaria/exportar?formato=ndjson&gzip=1&fields=id,nombre")
+    assert respuesta.mimetype == "application/gzip"
+    lineas = gzip.decompress(respuesta.get_data()).decode().splitlines()
+    assert [json.loads(l) for l in lineas] == [{"id": 1, "nombre": "Retroexcavadora"}]
+
+    filas = list(csv.DictReader(io.StringIO(auth_client.get("/api/conceptos/exportar").get_data(as_text=True))))
+    assert [(f["clave"], f["tipo_insumo"], f["nombre_insumo"]) for f in filas][:3] == [
+        ("C-1", "Material", "Cemento gris"), ("C-1", "Material", "Cemento gris"), ("C-1", "ManoObra", "Oficial albañil")]
+    assert filas[-1]["clave"] == "C-3" and filas[-1]["renglon_id"] == ""
+    conceptos = [json.loads(l) for l in auth_client.get("/api/conceptos/exportar?formato=ndjson").get_data(as_text=True).splitlines()]
+    assert [(c["clave"], len(c["matriz"])) for c in conceptos] == [("C-1", 4), ("C-2", 3), ("C-3", 0)]
+
+    lineas = auth_client.get(f"/api/proyectos/{proyecto['id']}/exportar?formato=ndjson").get_data(as_text=True).splitlines()
+    renglones = [json.loads(l) for l in lineas]
+    total = auth_client.get(f"/api/proyectos/{proyecto['id']}/totales").get_json()["total"]
+    assert [r["detalle_id"] for r in renglones] == [d["id"] for d in detalles]
+    assert sum(r["importe"] for r in renglones) == pytest.approx(total)
+
+    assert auth_client.get("/api/materiales/exportar?formato=xml").status_code == 400
+    assert auth_client.get("/api/equipo/exportar?fields=precio").status_code == 400
+    assert auth_client.get("/api/proyectos/999/exportar").status_code == 404
+
+def test_arbol_de_proyecto_en_consultas_fijas(app, auth_client):
+    from sqlalchemy import event
+
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+    proyecto, partida, detalles = _crear_presupuesto(auth_client, ids)
+    url = f"/api/proyectos/{proyecto['id']}/arbol"
+
+    def consultas_de_arbol():
+        consultas = []
+        def registrar(conn, cursor, sql, *args):
+            consultas.append(sql)
+        with app.app_context():
+            event.listen(db.engine, "before_cursor_execute", registrar)
+            try:
+                data = auth_client.get(url).get_json()
+            finally:
+                event.remove(db.engine, "before_cursor_execute", registrar)
+        return data, len(consultas)
+
+    data, pocas = consultas_de_arbol()
+    assert [d["id"] for d in data["partidas"][0]["detalles"]] == [d["id"] for d in detalles]
+    detalle = data["partidas"][0]["detalles"][0]
+    assert (detalle["clave"], detalle["descripcion"], detalle["unidad_concepto"]) == ("C-1", "Muro", "m2")
+    assert detalle["importe"] == pytest.approx(detalle["cantidad_obra"] * detalle["precio_unitario_calculado"])
+
+    for n in range(3):
+        otra = auth_client.post("/api/partidas", json={"proyecto": proyecto["id"], "nombre_partida": f"P{n}"}).get_json()
+        for _ in range(4):
+            for cid in ids:
+                auth_client.post("/api/detalles-presupuesto", json={"partida": otra["id"], "concepto": cid, "cantidad_obra": 2})
+    data, muchas = consultas_de_arbol()
+    assert sum(len(p["detalles"]) for p in data["partidas"]) == 2 + 3 * 4 * 2
+    assert muchas == pocas <= 6  # usuario, versiones, proyecto, partidas, detalles, conceptos
+    assert data["total"] == pytest.approx(sum(p["total"] for p in data["partidas"]))
+    assert auth_client.get("/api/proyectos/999/arbol").status_code == 404
+
+def test_actualizacion_masiva_de_precios(app, auth_client):
+    from backend.models import HistorialPrecio
+
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        user_id = User.query.filter_by(username="tester").one().id
+        for modelo in (Material, ManoObra, Maquinaria):
+            modelo.query.update({"user_id": user_id})
+        ajeno = Equipo.query.one().id  # sigue siendo global: no es del usuario
+        db.session.commit()
+        mat, mo, maq = Material.query.one(), ManoObra.query.one(), Maquinaria.query.one()
+        mat_id, mo_id, maq_id, fasar_antes = mat.id, mo.id, maq.id, mo.fasar
+    proyecto, _, detalles = _crear_presupuesto(auth_client, ids)
+
+    reporte = auth_client.post("/api/catalogos/actualizar_precios_masivo", json=[
+        {"tipo": "Material", "insumo_id": mat_id, "nuevo_precio": 200},
+        {"tipo": "ManoObra", "insumo_id": mo_id, "nuevo_precio": "520.5"},
+        {"tipo": "Maquinaria", "insumo_id": maq_id, "nuevo_precio": 1800000},
+        {"tipo": "Equipo", "insumo_id": ajeno, "nuevo_precio": 10},
+        {"tipo": "Material", "insumo_id": mat_id, "nuevo_precio": 210},
+        {"tipo": "Concreto", "insumo_id": 1, "nuevo_precio": 5},
+        {"tipo": "Material", "insumo_id": mat_id},
+    ]).get_json()
+    assert (reporte["actualizados"], reporte["sin_cambios"], reporte["con_error"], reporte["historial"]) == (3, 0, 2, 3)
+    assert reporte["no_encontrados"] == [{"tipo": "Equipo", "insumo_id": ajeno}]
+    assert [e["indice"] for e in reporte["errores"]] == [5, 6]
+    assert reporte["conceptos_afectados"] == sorted(ids) and reporte["proyectos_afectados"] == [proyecto["id"]]
+    assert reporte["recalculo"]["actualizados"] == 2
+
+    with app.app_context():
+        mo = db.session.get(ManoObra, mo_id)
+        assert float(db.session.get(Material, mat_id).precio_unitario) == 210
+        assert mo.fasar != fasar_antes
+        fasar = mo.fasar
+        mo.refresh_fasar()
+        assert mo.fasar == fasar
+        maq = db.session.get(Maquinaria, maq_id)
+        posesion = maq.costo_posesion_hora
+        maq.actualizar_costo_posesion()
+        assert posesion == maq.costo_posesion_hora.quantize(Decimal("0.0001"))
+        assert float(db.session.get(Equipo, ajeno).costo_hora_maq) == pytest.approx(95.10)
+        assert HistorialPrecio.query.filter_by(fuente="masivo").count() == 3
+        por_concepto = {d.concepto_id: float(d.precio_unitario_calculado) for d in DetallePresupuesto.query.all()}
+    assert por_concepto[ids[0]] > detalles[0]["precio_unitario_calculado"]
+
+    repetido = auth_client.post("/api/catalogos/actualizar_precios_masivo", json=[
+        {"tipo": "Material", "insumo_id": mat_id, "nuevo_precio": 210}]).get_json()
+    assert (repetido["actualizados"], repetido["sin_cambios"], repetido["recalculo"]) == (0, 1, None)
+    assert auth_client.post("/api/catalogos/actualizar_precios_masivo", json={"x": 1}).status_code == 400
+
+def test_historial_y_precios_a_fecha(app, auth_client):
+    from datetime import datetime
+    from sqlalchemy import exc, text
+    from backend.models import HistorialPrecio
+
+    with app.app_context():
+        ids = _crear_conceptos_de_prueba()
+        mat, mo = Material.query.one(), ManoObra.query.one()
+        mat_id, mo_id = mat.id, mo.id
+        # Historial previo al alta registrada por el ORM (como si viniera de otra base)
+        db.session.add_all([
+            HistorialPrecio(tipo_insumo="Material", id_insumo=mat_id, precio_anterior=Decimal("100"),
+                            precio_nuevo=Decimal("150"), fuente="importacion", fecha=datetime(2024, 6, 1)),
+            HistorialPrecio(tipo_insumo="ManoObra", id_insumo=mo_id, precio_anterior=Decimal("400"),
+                            precio_nuevo=Decimal("480"), fuente="importacion", fecha=datetime(2024, 6, 1)),
+        ])
+        db.session.commit()
+        with pytest.raises(exc.DBAPIError):
+            db.session.execute(text("DELETE FROM historial_precios"))
+        db.session.rollback()
+
+        # Esperado: el PU con los precios de entonces aplicados directamente al catálogo
+        mat.precio_unitario = Decimal("100")
+        mo.salario_base = Decimal("400")
+        mo.refresh_fasar()
+        esperado = calcular_precio_unitario(concepto_id=ids[0], factores=FACTORES)
+        db.session.rollback()
+        vigente = calcular_precio_unitario(concepto_id=ids[0], factores=FACTORES)
+
+    assert auth_client.put(f"/api/materiales/{mat_id}", json={"precio_unitario": 250}).status_code == 200
+    factores = {"mano_obra": {"activo": True, "porcentaje": 0.05}, "indirectos": {"activo": True, "porcentaje": 0.12},
+                "utilidad": {"activo": True, "porcentaje": 0.10}, "iva": {"activo": True, "porcentaje": 0.16}}
+    calcular = lambda fecha: auth_client.post("/api/conceptos/calcular_pu", json={
+        "concepto_id": ids[0], "factores": factores, "fecha": fecha}).get_json()
+    assert calcular("2024-03-01")["precio_unitario"] == pytest.approx(esperado["precio_unitario"])
+    assert calcular("2030-01-01")["precio_unitario"] > vigente["precio_unitario"]  # ya con el precio de 250
+    lote = auth_client.post("/api/conceptos/calcular_pu_lote", json={
+        "conceptos": ids, "factores": factores, "fecha": "2024-03-01"}).get_json()["resultados"]
+    assert lote[0]["precio_unitario"] == pytest.approx(esperado["precio_unitario"])
+    assert calcular("01/03/2024") == {"error": "fecha debe tener formato AAAA-MM-DD"}
+
+    historial = auth_client.get(f"/api/catalogos/historial/Material/{mat_id}").get_json()
+    assert [(c["precio_anterior"], c["precio_nuevo"]) for c in historial["cambios"]] == [(100, 150), (None, 185.5), (185.5, 250)]
+    assert (historial["precio_inicial"], historial["variacion"]) == (100, 150)
+
+    proyecto, _, detalles = _crear_presupuesto(auth_client, ids)
+    cotizacion = auth_client.get(f"/api/proyectos/{proyecto['id']}/cotizacion?fecha=2024-03-01").get_json()
+    assert [d["id"] for d in cotizacion["partidas"][0]["detalles"]] == [d["id"] for d in detalles]
+    assert cotizacion["total"] < cotizacion["total_vigente"]
+    assert auth_client.get(f"/api/proyectos/{proyecto['id']}/cotizacion").status_code == 400
+
+def test_json_rapido_y_listas_sin_orm(app, auth_client):
+    from datetime import date
+    from flask.json.provider import DefaultJSONProvider
+    from backend.json_rapido import ProveedorJSONRapido
+
+    ids = _crear_conceptos_de_prueba()
+    proyecto, partida, _ = _crear_presupuesto(auth_client, ids)
+    with app.app_context():
+        esperados = {
+            f"/api/proyectos/{proyecto['id']}/partidas": [p.to_dict() for p in Partida.query.order_by(Partida.id)],
+            f"/api/partidas/{partida['id']}/detalles": [d.to_dict() for d in DetallePresupuesto.query.order_by(DetallePresupuesto.id)],
+            f"/api/conceptos/{ids[0]}/matriz": [
+                m.to_dict() for m in MatrizInsumo.query.filter_by(concepto_id=ids[0]).order_by(MatrizInsumo.id)],
+        }
+    for url, esperado in esperados.items():
+        respuesta = auth_client.get(url)
+        assert respuesta.get_json() == esperado, url
+        assert respuesta.get_data().endswith(b"]\n")
+
+    # Mismo documento (y mismo orden de llaves) que el proveedor de Flask
+    assert isinstance(app.json, ProveedorJSONRapido)
+    datos = {"z": [Decimal("1.50"), date(2024, 3, 1)], "a": {"ñ": None, "b": True}, "n": 2 ** 40}
+    with app.test_request_context():
+        rapido = app.json.response(datos).get_data()
+        flask = DefaultJSONProvider(app).response(datos).get_data()
+    assert rapido.endswith(b"\n")
+    assert list(app.json.loads(rapido)) == list(app.json.loads(flask)) == ["a", "n", "z"]
+    assert app.json.loads(rapido) == app.json.loads(flask)
+    assert app.json.dumps({2: "x", 1: 2 ** 70}) == DefaultJSONProvider(app).dumps({2: "x", 1: 2 ** 70})
+
+def test_instantanea_de_catalogo(app, auth_client):
+    from backend.services.catalogo_cache_service import cache_catalogo, instantanea_catalogo, MaterialCompacto
+    from backend.services.gemini_service import construir_sugerencia_apu
+
+    ids = _crear_conceptos_de_prueba()
+    with app.app_context():
+        user = User.query.one()
+        user_id, mat_id = user.id, Material.query.one().id
+        referencia = calcular_precio_unitario_lote(ids, factores=FACTORES)
+        instantanea = instantanea_catalogo(user_id)
+        assert instantanea_catalogo(user_id) is instantanea
+        material = instantanea.obtener("Material", mat_id)
+        assert isinstance(material, MaterialCompacto) and not hasattr(material, "__dict__")
+        assert material.precio_unitario == Decimal("185.5000")
+        with pytest.raises(AttributeError):
+            material.precio_unitario = Decimal("1")
+        # Mismos resultados que leyendo los insumos de la base (el 9999 no existe en ninguna)
+        assert calcular_precio_unitario_lote(ids, factores=FACTORES, user_id=user_id) == referencia
+        sugerencias = construir_sugerencia_apu("barda de tabique", user_id)
+        assert [(s["tipo_insumo"], s["insumo_id"]) for s in sugerencias] == [
+            ("Material", mat_id), ("Material", mat_id), ("ManoObra", ManoObra.query.one().id)]
+        assert sugerencias[0]["costo_unitario"] == 185.5
+
+        # Con un cambio sin commit la instantánea no se usa y el cálculo ve el precio nuevo
+        db.session.get(Material, mat_id).precio_unitario = Decimal("300")
+        pendiente = calcular_precio_unitario(concepto_id=ids[0], factores=FACTORES, user_id=user_id)
+        assert instantanea_catalogo(user_id) is None
+        assert pendiente["precio_unitario"] > referencia[0]["precio_unitario"]
+        db.session.rollback()
+
+    assert auth_client.put(f"/api/materiales/{mat_id}", json={"precio_unitario": 300}).status_code == 200
+    with app.app_context():
+        nueva = instantanea_catalogo(user_id)
+        assert nueva is not instantanea and nueva.obtener("Material", mat_id).precio_unitario == Decimal("300.0000")
+        assert calcular_precio_unitario(concepto_id=ids[0], factores=FACTORES, user_id=user_id) == pendiente
+
+        estadisticas = cache_catalogo.estadisticas()
+        assert estadisticas["hits"] >= 2 and estadisticas["misses"] >= 2 and estadisticas["omitidas"] >= 1
+        assert estadisticas["entradas"] == 1 and 0 < estadisticas["bytes"] == nueva.tamano_bytes
+        # Presupuesto de memoria: la instantánea más antigua sale al entrar otra
+        presupuesto = cache_catalogo.presupuesto_bytes
+        cache_catalogo.presupuesto_bytes = nueva.tamano_bytes
+        try:
+            instantanea_catalogo(None)
+            assert cache_catalogo.estadisticas()["entradas"] == 1 and cache_catalogo.evictions == 1
+        finally:
+            cache_catalogo.presupuesto_bytes = presupuesto
+        User.query.get(user_id).is_admin = True
+        db.session.commit()
+    assert auth_client.get("/api/admin/cache").get_json()["catalogo"]["evictions"] == 1